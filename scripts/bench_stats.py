@@ -0,0 +1,157 @@
+#!/usr/bin/env python
+
+# Copyright (c) 2015 Marin Atanasov Nikolov <dnaeon@gmail.com>
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions
+# are met:
+# 1. Redistributions of source code must retain the above copyright
+#    notice, this list of conditions and the following disclaimer
+#    in this position and unchanged.
+# 2. Redistributions in binary form must reproduce the above copyright
+#    notice, this list of conditions and the following disclaimer in the
+#    documentation and/or other materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE AUTHOR(S) ``AS IS'' AND ANY EXPRESS OR
+# IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED WARRANTIES
+# OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE DISCLAIMED.
+# IN NO EVENT SHALL THE AUTHOR(S) BE LIABLE FOR ANY DIRECT, INDIRECT,
+# INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT
+# NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE,
+# DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY
+# THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF
+# THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+"""
+Benchmark of the performance statistics
+
+Compares the numpy implementations in pvc.stats with the
+equivalent pure Python code working on lists of
+(timestamp, value) tuples, which graphs used before.
+
+Usage: python scripts/bench_stats.py [--samples N] [--repeat N]
+
+"""
+
+import os
+import sys
+import math
+import timeit
+import argparse
+import collections
+
+import numpy
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+
+import pvc.stats  # noqa: E402
+
+
+def python_align(a, b):
+    b_values = dict(b)
+    return [(t, v, b_values[t]) for t, v in a if t in b_values]
+
+
+def python_rate(samples):
+    result = [float('nan')]
+    for (t0, v0), (t1, v1) in zip(samples, samples[1:]):
+        if t1 > t0 and v1 >= v0:
+            result.append((v1 - v0) / (t1 - t0))
+        else:
+            result.append(float('nan'))
+    return result
+
+
+def python_rolling_mean(values, window):
+    result = []
+    recent = collections.deque()
+    total = 0.0
+    count = 0
+    for value in values:
+        recent.append(value)
+        if not math.isnan(value):
+            total += value
+            count += 1
+        if len(recent) > window:
+            old = recent.popleft()
+            if not math.isnan(old):
+                total -= old
+                count -= 1
+        result.append(total / count if count and not math.isnan(value) else float('nan'))
+    return result
+
+
+def python_summary(values):
+    y = sorted(v for v in values if not math.isnan(v))
+
+    def percentile(q):
+        k = (len(y) - 1) * q / 100.0
+        f = int(k)
+        c = min(f + 1, len(y) - 1)
+        return y[f] + (y[c] - y[f]) * (k - f)
+
+    return collections.OrderedDict([
+        ('count', len(y)),
+        ('min', y[0]),
+        ('avg', sum(y) / len(y)),
+        ('p50', percentile(50)),
+        ('p95', percentile(95)),
+        ('p99', percentile(99)),
+        ('max', y[-1]),
+    ])
+
+
+def intersect1d_align(a, b):
+    timestamps, index_a, index_b = numpy.intersect1d(a[0], b[0], assume_unique=True, return_indices=True)
+    return timestamps, a[1][index_a], b[1][index_b]
+
+
+def make_series(samples, step, missing):
+    timestamps = numpy.arange(samples, dtype=numpy.int64) * step
+    values = numpy.cumsum(numpy.random.random(samples) * 100)
+    values[numpy.random.random(samples) < missing] = numpy.nan
+    return timestamps, values
+
+
+def bench(name, old, new, repeat):
+    old_time = min(timeit.repeat(old, number=1, repeat=repeat)) if old else float('nan')
+    new_time = min(timeit.repeat(new, number=1, repeat=repeat))
+    print('{:<16} {:>12.3f} {:>12.3f} {:>9.1f}x'.format(name, old_time * 1000, new_time * 1000, old_time / new_time))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the performance statistics')
+    parser.add_argument('--samples', type=int, default=100000, help='Number of samples of each series')
+    parser.add_argument('--repeat', type=int, default=5, help='Number of times to repeat each benchmark')
+    args = parser.parse_args()
+
+    numpy.random.seed(0)
+    a = make_series(args.samples, 20, 0.01)
+    b = make_series(args.samples, 30, 0.01)
+    a_list = list(zip(a[0].tolist(), a[1].tolist()))
+    b_list = list(zip(b[0].tolist(), b[1].tolist()))
+
+    print('{} samples, best of {} runs'.format(args.samples, args.repeat))
+    print('{:<16} {:>12} {:>12} {:>10}'.format('', 'python (ms)', 'numpy (ms)', 'speedup'))
+    bench('align', lambda: python_align(a_list, b_list), lambda: pvc.stats.align(a, b), args.repeat)
+    bench('rate', lambda: python_rate(a_list), lambda: pvc.stats.rate(*a), args.repeat)
+    bench(
+        'rolling_mean',
+        lambda: python_rolling_mean(a[1].tolist(), 15),
+        lambda: pvc.stats.rolling_mean(a[1], 15),
+        args.repeat
+    )
+    bench('summary', lambda: python_summary(a[1].tolist()), lambda: pvc.stats.summary(a[1]), args.repeat)
+
+    # numpy.intersect1d() returns indices with NumPy 1.15 or later only
+    try:
+        intersect1d_align(a, b)
+    except TypeError:
+        return
+    bench('align/intersect', lambda: intersect1d_align(a, b), lambda: pvc.stats.align(a, b), args.repeat)
+
+
+if __name__ == '__main__':
+    main()
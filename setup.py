@@ -14,11 +14,7 @@ with open('src/pvc/__init__.py', 'rb') as f:
         f.read().decode('utf-8')).group(1))
     )
 
-if (2, 7) <= sys.version_info < (3, 0):
-    dialog_package = 'python2-pythondialog'
-elif sys.version_info >= (3, 0):
-    dialog_package = 'pythondialog'
-else:
+if sys.version_info < (3, 6):
     print('Unsupported Python version')
     sys.exit(1)
 
@@ -32,16 +28,25 @@ setup(
     license='BSD',
     url='https://github.com/dnaeon/pvc',
     download_url='https://github.com/dnaeon/pvc/releases',
+    python_requires='>=3.6',
     package_dir={'': 'src'},
     packages=find_packages('src'),
     scripts=[
         'src/pvc-tui',
+        'src/pvc-collector',
+        'src/pvc-report',
     ],
     install_requires=[
-        '{} >= 3.2.1'.format(dialog_package),
+        'pythondialog >= 3.2.1',
         'humanize >= 0.5.1',
+        'numpy >= 1.10.0',
         'pyvmomi >= 5.5.0-2014.1.1',
         'requests >= 2.6.0',
         'vconnector >= 0.3.7',
+    ],
+    classifiers=[
+        'License :: OSI Approved :: BSD License',
+        'Programming Language :: Python :: 3',
+        'Programming Language :: Python :: 3 :: Only',
     ]
 )
@@ -0,0 +1,485 @@
+# Copyright (c) 2015 Marin Atanasov Nikolov <dnaeon@gmail.com>
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions
+# are met:
+# 1. Redistributions of source code must retain the above copyright
+#    notice, this list of conditions and the following disclaimer
+#    in this position and unchanged.
+# 2. Redistributions in binary form must reproduce the above copyright
+#    notice, this list of conditions and the following disclaimer in the
+#    documentation and/or other materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE AUTHOR(S) ``AS IS'' AND ANY EXPRESS OR
+# IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED WARRANTIES
+# OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE DISCLAIMED.
+# IN NO EVENT SHALL THE AUTHOR(S) BE LIABLE FOR ANY DIRECT, INDIRECT,
+# INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT
+# NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE,
+# DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY
+# THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF
+# THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+"""
+Alarm module
+
+Inventory-wide collection of triggered alarms.
+
+"""
+
+import time
+import logging
+import threading
+
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+import pyVmomi
+
+__all__ = [
+    'SEVERITY', 'alarm_info_cache', 'AlarmInfoCache', 'TriggeredAlarm',
+    'triggered_alarms', 'sort_alarms', 'filter_alarms', 'bulk_alarm_action',
+    'AlarmWatcher',
+]
+
+# Alarm statuses ordered by decreasing severity
+SEVERITY = ('red', 'yellow', 'gray', 'green')
+
+logger = logging.getLogger(__name__)
+
+# Alarm info caches by server
+_caches = {}
+_caches_lock = threading.Lock()
+
+
+def alarm_info_cache(agent):
+    """
+    Get the shared alarm info cache of a server
+
+    Args:
+        agent (VConnector): A VConnector instance
+
+    Returns:
+        An AlarmInfoCache instance
+
+    """
+    about = agent.si.content.about
+    server = about.instanceUuid if about.instanceUuid else agent.host
+
+    with _caches_lock:
+        if server not in _caches:
+            _caches[server] = AlarmInfoCache(agent)
+
+        return _caches[server]
+
+
+class AlarmInfoCache(object):
+    def __init__(self, agent, ttl=600):
+        """
+        Cache of alarm definitions
+
+        Alarm definitions rarely change, so the info of each alarm
+        is retrieved once, together with the info of all other
+        alarms not yet in the cache, and kept for a while.
+
+        Args:
+            agent (VConnector): A VConnector instance
+            ttl          (int): Seconds to keep alarm definitions in the cache
+
+        """
+        self.agent = agent
+        self.ttl = ttl
+        self.lock = threading.Lock()
+        self.info = {}
+
+    def get(self, alarms):
+        """
+        Get the info of alarms
+
+        Args:
+            alarms (list): A list of vim.alarm.Alarm instances
+
+        Returns:
+            A dict mapping the moId of each alarm to its vim.alarm.AlarmInfo
+
+        """
+        now = time.monotonic()
+        with self.lock:
+            missing = {
+                a._moId: a for a in alarms
+                if a._moId not in self.info or now - self.info[a._moId][0] > self.ttl
+            }
+
+            if missing:
+                spec = pyVmomi.vmodl.query.PropertyCollector.FilterSpec(
+                    objectSet=[
+                        pyVmomi.vmodl.query.PropertyCollector.ObjectSpec(obj=a)
+                        for a in missing.values()
+                    ],
+                    propSet=[
+                        pyVmomi.vmodl.query.PropertyCollector.PropertySpec(
+                            type=pyVmomi.vim.alarm.Alarm,
+                            pathSet=['info']
+                        )
+                    ]
+                )
+                result = self.agent.si.content.propertyCollector.RetrieveContents([spec])
+                for content in result:
+                    for prop in content.propSet:
+                        self.info[content.obj._moId] = (now, prop.val)
+
+            return {
+                a._moId: self.info[a._moId][1]
+                for a in alarms if a._moId in self.info
+            }
+
+    def clear(self):
+        with self.lock:
+            self.info = {}
+
+
+class TriggeredAlarm(object):
+    def __init__(self, state, entity_name, name):
+        """
+        A triggered alarm
+
+        Args:
+            state (vim.alarm.AlarmState): The state of the triggered alarm
+            entity_name            (str): Name of the entity the alarm was triggered on
+            name                   (str): Name of the alarm
+
+        """
+        self.state = state
+        self.entity_name = entity_name
+        self.name = name
+
+    @property
+    def severity(self):
+        """
+        Severity of the alarm, 0 being the most severe
+
+        """
+        status = self.state.overallStatus
+        return SEVERITY.index(status) if status in SEVERITY else len(SEVERITY)
+
+
+def triggered_alarms(agent, container=None):
+    """
+    Get the triggered alarms of all managed entities
+
+    The triggered alarms of all entities in the container are
+    retrieved in a single property collector pass, and the alarm
+    definitions are resolved through the shared alarm info cache.
+
+    Args:
+        agent           (VConnector): A VConnector instance
+        container (vim.ManagedEntity): Container to search in, the root folder if None
+
+    Returns:
+        A list of TriggeredAlarm instances
+
+    """
+    view = agent.get_container_view(
+        obj_type=[pyVmomi.vim.ManagedEntity],
+        container=container
+    )
+    properties = agent.collect_properties(
+        view_ref=view,
+        obj_type=pyVmomi.vim.ManagedEntity,
+        path_set=['name', 'triggeredAlarmState'],
+        include_mors=True
+    )
+    view.DestroyView()
+
+    # The container view does not include the container itself
+    if container is None:
+        container = agent.si.content.rootFolder
+    properties.append({
+        'obj': container,
+        'name': container.name,
+        'triggeredAlarmState': container.triggeredAlarmState
+    })
+
+    names = {p['obj']._moId: p['name'] for p in properties}
+
+    # Alarm states of descendant entities are also present in
+    # the triggered alarms of their parents
+    states = {}
+    for p in properties:
+        for state in p.get('triggeredAlarmState') or []:
+            states[state.key] = state
+
+    info = alarm_info_cache(agent).get([s.alarm for s in states.values()])
+
+    return [
+        TriggeredAlarm(
+            state=s,
+            entity_name=names.get(s.entity._moId, s.entity._moId),
+            name=info[s.alarm._moId].name if s.alarm._moId in info else s.alarm._moId
+        ) for s in states.values()
+    ]
+
+
+def sort_alarms(alarms, key):
+    """
+    Sort triggered alarms
+
+    Args:
+        alarms (list): A list of TriggeredAlarm instances
+        key     (str): One of 'severity', 'age' or 'entity'
+
+    Returns:
+        A new list of the sorted alarms
+
+    """
+    if key == 'severity':
+        return sorted(alarms, key=lambda a: (a.severity, -a.state.time.timestamp()))
+    elif key == 'age':
+        return sorted(alarms, key=lambda a: a.state.time)
+    elif key == 'entity':
+        return sorted(alarms, key=lambda a: (a.entity_name, a.severity))
+
+    raise ValueError('Unknown sort key: {}'.format(key))
+
+
+def filter_alarms(alarms, statuses=None, name=None, entity=None, acknowledged=None):
+    """
+    Filter triggered alarms
+
+    Args:
+        alarms        (list): A list of TriggeredAlarm instances
+        statuses      (list): Alarm statuses to include, e.g. ['red', 'yellow']
+        name           (str): Include alarms whose name contains this string
+        entity         (str): Include alarms whose entity name contains this string
+        acknowledged  (bool): If not None include only alarms with this acknowledged state
+
+    Returns:
+        A list of the matching alarms
+
+    """
+    name = name.lower() if name else None
+    entity = entity.lower() if entity else None
+
+    return [
+        a for a in alarms
+        if (not statuses or a.state.overallStatus in statuses) and
+        (not name or name in a.name.lower()) and
+        (not entity or entity in a.entity_name.lower()) and
+        (acknowledged is None or bool(a.state.acknowledged) == acknowledged)
+    ]
+
+
+def bulk_alarm_action(agent, states, action, max_workers=8, progress=None):
+    """
+    Acknowledge or reset triggered alarms concurrently
+
+    Each alarm is acknowledged or reset using a separate call,
+    with no more than 'max_workers' calls in flight.
+
+    Args:
+        agent      (VConnector): A VConnector instance
+        states           (list): A list of vim.alarm.AlarmState instances
+        action            (str): Either 'acknowledge' or 'reset'
+        max_workers       (int): Maximum number of concurrent calls
+        progress         (func): Called with the number of completed and
+                                 total calls after each completed call
+
+    Returns:
+        A list of (state, message) tuples of the failed calls
+
+    Raises:
+        ValueError: If the action is unknown
+
+    """
+    am = agent.si.content.alarmManager
+    if action == 'acknowledge':
+        def call(s):
+            am.AcknowledgeAlarm(alarm=s.alarm, entity=s.entity)
+    elif action == 'reset':
+        def call(s):
+            am.SetAlarmStatus(alarm=s.alarm, entity=s.entity, status='green')
+    else:
+        raise ValueError('Unknown alarm action: {}'.format(action))
+
+    failed = []
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = {executor.submit(call, s): s for s in states}
+        for done, future in enumerate(as_completed(futures), 1):
+            try:
+                future.result()
+            except Exception as e:
+                msg = e.msg if isinstance(e, pyVmomi.vmodl.MethodFault) else str(e)
+                failed.append((futures[future], msg))
+            if progress:
+                progress(done, len(futures))
+
+    return failed
+
+
+class AlarmWatcher(threading.Thread):
+    # Maximum number of seconds to wait for updates in a single call
+    MAX_WAIT_SECONDS = 300
+
+    # Number of seconds to wait before watching again after a failure,
+    # doubled after each consecutive failure up to MAX_RETRY_SECONDS
+    RETRY_SECONDS = 30
+    MAX_RETRY_SECONDS = 300
+
+    def __init__(self, agent, on_change=None):
+        """
+        Alarm Watcher Thread
+
+        Watches the triggered alarms of the whole inventory using
+        the triggered alarms of the root folder, to which the alarms
+        of all descendant entities are propagated.
+
+        Changes are received as incremental property collector
+        updates, so no requests are made while no alarms fire
+        or clear.
+
+        When watching fails, e.g. because the session was lost, the
+        failure is logged and the alarms are watched again after a
+        back-off of RETRY_SECONDS, doubled after each consecutive
+        failure without any update received. Alarms which fired in
+        the meantime are reported as fired once watching resumes.
+
+        Args:
+            agent (VConnector): A VConnector instance
+            on_change   (func): Called with the watcher, the fired and the
+                                cleared vim.alarm.AlarmState instances
+                                after each change, and once with the
+                                initially triggered alarms
+
+        """
+        super().__init__()
+        self.daemon = True
+        self.time_to_die = threading.Event()
+        self.agent = agent
+        self.on_change = on_change
+        self.states = {}
+        self.initialized = False
+        self.updated = False
+        self.property_collector = None
+
+    def counts(self):
+        """
+        Get the number of triggered alarms by status
+
+        Returns:
+            A dict mapping each status to the number of alarms
+
+        """
+        states = list(self.states.values())
+        return {status: sum(1 for s in states if s.overallStatus == status) for status in SEVERITY}
+
+    def update(self, states):
+        """
+        Update the triggered alarms
+
+        Args:
+            states (list): The current vim.alarm.AlarmState instances
+
+        Returns:
+            A tuple of the fired and cleared alarm states
+
+        """
+        current = {s.key: s for s in states}
+        fired = [s for k, s in current.items() if k not in self.states]
+        cleared = [s for k, s in self.states.items() if k not in current]
+        self.states = current
+
+        return fired, cleared
+
+    def run(self):
+        delay = self.RETRY_SECONDS
+        while not self.time_to_die.is_set():
+            self.updated = False
+            try:
+                self.watch()
+            except pyVmomi.vmodl.fault.RequestCanceled:
+                pass
+            except Exception as e:
+                if self.time_to_die.is_set():
+                    break
+                if self.updated:
+                    delay = self.RETRY_SECONDS
+                msg = e.msg if isinstance(e, pyVmomi.vmodl.MethodFault) else e
+                logger.error(
+                    'Alarm watcher of %s failed, retrying in %d seconds: %s',
+                    self.agent.host, delay, msg
+                )
+                self.time_to_die.wait(delay)
+                delay = min(delay * 2, self.MAX_RETRY_SECONDS)
+
+    def watch(self):
+        """
+        Watch the triggered alarms until signaled to stop
+
+        """
+        try:
+            self.property_collector = self.agent.si.content.propertyCollector.CreatePropertyCollector()
+            self.property_collector.CreateFilter(
+                spec=pyVmomi.vmodl.query.PropertyCollector.FilterSpec(
+                    objectSet=[
+                        pyVmomi.vmodl.query.PropertyCollector.ObjectSpec(
+                            obj=self.agent.si.content.rootFolder
+                        )
+                    ],
+                    propSet=[
+                        pyVmomi.vmodl.query.PropertyCollector.PropertySpec(
+                            type=pyVmomi.vim.Folder,
+                            pathSet=['triggeredAlarmState']
+                        )
+                    ]
+                ),
+                partialUpdates=False
+            )
+            options = pyVmomi.vmodl.query.PropertyCollector.WaitOptions(
+                maxWaitSeconds=self.MAX_WAIT_SECONDS
+            )
+
+            version = ''
+            while not self.time_to_die.is_set():
+                update = self.property_collector.WaitForUpdatesEx(
+                    version=version,
+                    options=options
+                )
+                if update is None:
+                    continue
+
+                version = update.version
+                self.updated = True
+                for f in update.filterSet:
+                    for o in f.objectSet:
+                        for change in o.changeSet:
+                            if change.name != 'triggeredAlarmState':
+                                continue
+                            fired, cleared = self.update(change.val or [])
+                            # The very first update contains the alarms triggered so far
+                            if not self.initialized:
+                                fired = []
+                                self.initialized = True
+                            if self.on_change:
+                                self.on_change(self, fired, cleared)
+        finally:
+            try:
+                if self.property_collector:
+                    self.property_collector.DestroyPropertyCollector()
+            except Exception:
+                pass
+            self.property_collector = None
+
+    def signal_stop(self):
+        """
+        Signal the thread that it's time to die
+
+        """
+        self.time_to_die.set()
+
+        # Wake up the thread if it is waiting for updates
+        if self.property_collector:
+            try:
+                self.property_collector.CancelWaitForUpdates()
+            except pyVmomi.vmodl.MethodFault:
+                pass
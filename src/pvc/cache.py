@@ -0,0 +1,216 @@
+# Copyright (c) 2015 Marin Atanasov Nikolov <dnaeon@gmail.com>
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions
+# are met:
+# 1. Redistributions of source code must retain the above copyright
+#    notice, this list of conditions and the following disclaimer
+#    in this position and unchanged.
+# 2. Redistributions in binary form must reproduce the above copyright
+#    notice, this list of conditions and the following disclaimer in the
+#    documentation and/or other materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE AUTHOR(S) ``AS IS'' AND ANY EXPRESS OR
+# IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED WARRANTIES
+# OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE DISCLAIMED.
+# IN NO EVENT SHALL THE AUTHOR(S) BE LIABLE FOR ANY DIRECT, INDIRECT,
+# INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT
+# NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE,
+# DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY
+# THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF
+# THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+"""
+Performance Cache module
+
+A persistent local cache of historical performance samples.
+
+"""
+
+import os
+import array
+import struct
+import hashlib
+import calendar
+import datetime
+
+__all__ = ['PerformanceCache']
+
+_UTC = datetime.timezone.utc
+
+
+def _to_epoch(t):
+    """
+    Convert a datetime instance in UTC to a UNIX timestamp
+
+    """
+    return calendar.timegm(t.utctimetuple())
+
+
+class PerformanceCache(object):
+    # Start, end and number of samples of a cached series
+    _header = struct.Struct('<qqI')
+
+    def __init__(self, path=None, max_size=256 * 1024 * 1024):
+        """
+        Local cache of historical performance samples
+
+        Historical performance data in vSphere does not change once
+        it has been rolled up, so samples retrieved once can be kept
+        locally and only newer samples need to be retrieved later.
+
+        Each series is identified by the vCenter instance UUID,
+        entity moId, counter key, instance and interval, and is kept
+        in a separate file which consists of a header followed by
+        two columns of 64-bit integers - the sample timestamps and
+        the sample values.
+
+        The PVC_CACHE_DIR environment variable may be used to
+        override the default location of the cache.
+
+        Args:
+            path     (str): Path to the cache directory
+            max_size (int): Maximum size of the cache in bytes. When
+                            exceeded the least recently used series
+                            are evicted from the cache.
+
+        """
+        if not path:
+            path = os.environ.get('PVC_CACHE_DIR') or os.path.join(
+                os.environ.get('XDG_CACHE_HOME') or os.path.expanduser('~/.cache'),
+                'pvc'
+            )
+
+        self.path = os.path.join(path, 'perf')
+        self.max_size = max_size
+
+    def _series_path(self, uuid, moid, key, interval_id):
+        """
+        Get the path to the file of a cached series
+
+        """
+        counter_id, instance = key
+        digest = hashlib.sha1(
+            '{}:{}:{}:{}'.format(moid, counter_id, instance, interval_id).encode('utf-8')
+        ).hexdigest()
+
+        return os.path.join(self.path, uuid, digest)
+
+    def load(self, uuid, moid, key, interval_id):
+        """
+        Load a series from the cache
+
+        Args:
+            uuid         (str): Instance UUID of the vCenter server
+            moid         (str): The moId of the managed entity
+            key        (tuple): A metric key as returned by pvc.perf.metric_key()
+            interval_id  (int): Sampling period of the interval
+
+        Returns:
+            A tuple of the (start, end, samples) of the series, where
+            start and end are the boundaries of the time range covered
+            by the cache and samples is a list of (timestamp, value)
+            tuples. Returns None if the series is not cached.
+
+        """
+        path = self._series_path(uuid, moid, key, interval_id)
+
+        try:
+            with open(path, 'rb') as f:
+                start, end, count = self._header.unpack(f.read(self._header.size))
+                timestamps = array.array('q')
+                values = array.array('q')
+                timestamps.frombytes(f.read(count * timestamps.itemsize))
+                values.frombytes(f.read(count * values.itemsize))
+            os.utime(path, None)
+        except (IOError, OSError, struct.error):
+            return None
+
+        if len(timestamps) != count or len(values) != count:
+            return None
+
+        samples = [
+            (datetime.datetime.fromtimestamp(t, tz=_UTC), v)
+            for t, v in zip(timestamps, values)
+        ]
+
+        return (
+            datetime.datetime.fromtimestamp(start, tz=_UTC),
+            datetime.datetime.fromtimestamp(end, tz=_UTC),
+            samples
+        )
+
+    def store(self, uuid, moid, key, interval_id, start, end, samples):
+        """
+        Store a series in the cache
+
+        Args:
+            uuid                  (str): Instance UUID of the vCenter server
+            moid                  (str): The moId of the managed entity
+            key                 (tuple): A metric key as returned by pvc.perf.metric_key()
+            interval_id           (int): Sampling period of the interval
+            start   (datetime.datetime): Start of the time range covered by the samples
+            end     (datetime.datetime): End of the time range covered by the samples
+            samples              (list): A list of (timestamp, value) tuples
+
+        """
+        path = self._series_path(uuid, moid, key, interval_id)
+        timestamps = array.array('q', [_to_epoch(t) for t, v in samples])
+        values = array.array('q', [v for t, v in samples])
+
+        if not os.path.isdir(os.path.dirname(path)):
+            os.makedirs(os.path.dirname(path))
+
+        tmp_path = '{}.tmp'.format(path)
+        with open(tmp_path, 'wb') as f:
+            f.write(self._header.pack(_to_epoch(start), _to_epoch(end), len(samples)))
+            f.write(timestamps.tobytes())
+            f.write(values.tobytes())
+        os.replace(tmp_path, path)
+
+    def size(self):
+        """
+        Get the total size of the cache in bytes
+
+        """
+        return sum(os.path.getsize(p) for p, mtime in self._files())
+
+    def _files(self):
+        """
+        Get the cached series files
+
+        Returns:
+            A list of (path, mtime) tuples
+
+        """
+        result = []
+        for root, dirs, files in os.walk(self.path):
+            for name in files:
+                path = os.path.join(root, name)
+                try:
+                    result.append((path, os.path.getmtime(path)))
+                except OSError:
+                    continue
+
+        return result
+
+    def evict(self):
+        """
+        Evict the least recently used series until the
+        cache size is within the configured limit
+
+        """
+        files = sorted(self._files(), key=lambda f: f[1])
+        sizes = {p: os.path.getsize(p) for p, mtime in files}
+        total = sum(sizes.values())
+
+        for path, mtime in files:
+            if total <= self.max_size:
+                break
+            try:
+                os.unlink(path)
+            except OSError:
+                continue
+            total -= sizes[path]
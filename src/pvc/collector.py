@@ -0,0 +1,368 @@
+# Copyright (c) 2015 Marin Atanasov Nikolov <dnaeon@gmail.com>
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions
+# are met:
+# 1. Redistributions of source code must retain the above copyright
+#    notice, this list of conditions and the following disclaimer
+#    in this position and unchanged.
+# 2. Redistributions in binary form must reproduce the above copyright
+#    notice, this list of conditions and the following disclaimer in the
+#    documentation and/or other materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE AUTHOR(S) ``AS IS'' AND ANY EXPRESS OR
+# IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED WARRANTIES
+# OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE DISCLAIMED.
+# IN NO EVENT SHALL THE AUTHOR(S) BE LIABLE FOR ANY DIRECT, INDIRECT,
+# INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT
+# NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE,
+# DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY
+# THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF
+# THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+"""
+Performance Collector module
+
+Non-interactive collection of performance metrics to files.
+
+"""
+
+import logging
+import calendar
+import datetime
+import threading
+import collections
+import logging.handlers
+
+import pyVmomi
+
+import pvc.perf
+
+__all__ = [
+    'ENTITY_TYPES', 'CsvSampleWriter', 'LineProtocolSampleWriter',
+    'PerformanceCollector',
+]
+
+logger = logging.getLogger(__name__)
+
+# Entity types which may be specified as targets of the collector
+ENTITY_TYPES = collections.OrderedDict([
+    ('vm', pyVmomi.vim.VirtualMachine),
+    ('host', pyVmomi.vim.HostSystem),
+    ('cluster', pyVmomi.vim.ClusterComputeResource),
+    ('datacenter', pyVmomi.vim.Datacenter),
+    ('datastore', pyVmomi.vim.Datastore),
+    ('pool', pyVmomi.vim.ResourcePool),
+])
+
+
+class _SampleFileHandler(logging.handlers.RotatingFileHandler):
+    def __init__(self, filename, header=None, **kwargs):
+        """
+        Rotating file handler which writes a header to each new file
+
+        Args:
+            filename (str): Path to the file
+            header   (str): Header written at the beginning of each file
+            kwargs  (dict): Additional args passed to RotatingFileHandler
+
+        """
+        self.header = header
+        super().__init__(filename, **kwargs)
+
+    def _open(self):
+        stream = super()._open()
+        if self.header and stream.tell() == 0:
+            stream.write('{}\n'.format(self.header))
+
+        return stream
+
+
+class CsvSampleWriter(object):
+    header = 'timestamp,entity,moid,counter,instance,value'
+
+    def __init__(self, path, max_bytes=64 * 1024 * 1024, backup_count=10):
+        """
+        Writes performance samples to rotating CSV files
+
+        Args:
+            path          (str): Path to the output file
+            max_bytes     (int): Rotate the file once it reaches that size
+            backup_count  (int): Number of rotated files to keep
+
+        """
+        self.handler = _SampleFileHandler(
+            filename=path,
+            header=self.header,
+            maxBytes=max_bytes,
+            backupCount=backup_count
+        )
+        self.handler.setFormatter(logging.Formatter('%(message)s'))
+
+    def _emit(self, line):
+        self.handler.handle(logging.makeLogRecord({'msg': line}))
+
+    def format(self, timestamp, entity, moid, counter, instance, value):
+        """
+        Format a single sample
+
+        """
+        fields = [timestamp.isoformat(), entity, moid, counter, instance, str(value)]
+
+        return ','.join('"{}"'.format(f.replace('"', '""')) if ',' in f or '"' in f else f for f in fields)
+
+    def write(self, entity, moid, counter, instance, samples):
+        """
+        Write samples of a metric
+
+        Args:
+            entity    (str): Name of the managed entity
+            moid      (str): The moId of the managed entity
+            counter   (str): Name of the performance counter
+            instance  (str): Instance of the performance counter
+            samples  (list): A list of (timestamp, value) tuples
+
+        """
+        for timestamp, value in samples:
+            self._emit(self.format(timestamp, entity, moid, counter, instance, value))
+
+    def flush(self):
+        self.handler.flush()
+
+    def close(self):
+        self.handler.close()
+
+
+class LineProtocolSampleWriter(CsvSampleWriter):
+    header = None
+
+    def _escape(self, value):
+        for c in ('\\', ',', '=', ' '):
+            value = value.replace(c, '\\' + c)
+
+        return value
+
+    def format(self, timestamp, entity, moid, counter, instance, value):
+        """
+        Format a single sample using the InfluxDB line protocol
+
+        """
+        tags = [('entity', entity), ('moid', moid)]
+        if instance:
+            tags.append(('instance', instance))
+
+        return '{},{} value={} {}'.format(
+            self._escape(counter),
+            ','.join('{}={}'.format(k, self._escape(v)) for k, v in tags),
+            value,
+            calendar.timegm(timestamp.utctimetuple()) * 1000000000
+        )
+
+
+class PerformanceCollector(object):
+    def __init__(self, agent, targets, writer, retry_interval=30):
+        """
+        Performance Collector
+
+        Continuously polls performance metrics of a set of entities
+        and writes the collected samples using a sample writer.
+
+        All entities are polled using a single QueryPerf() call at
+        the real-time refresh rate of the providers. Each poll
+        retrieves the samples collected since the previous one, so no
+        samples are lost if a poll is delayed or the connection to
+        the server is lost for a while.
+
+        Args:
+            agent      (VConnector): A VConnector instance
+            targets          (list): A list of dicts with the 'entity', 'counters'
+                                     and 'instances' keys. Entities are specified
+                                     as <type>:<name>, e.g. vm:web01. Counters are
+                                     specified as <group>.<name>.<rollup>, e.g.
+                                     cpu.usage.average. An instance of '*' means
+                                     all available instances of a counter.
+            writer         (object): A sample writer, e.g. a CsvSampleWriter instance
+            retry_interval    (int): Seconds to wait before reconnecting to the server
+
+        """
+        self.agent = agent
+        self.targets = targets
+        self.writer = writer
+        self.retry_interval = retry_interval
+        self.time_to_die = threading.Event()
+        self.pollers = []
+        self.last_sample_time = {}
+        self.interval = 20
+
+    def signal_stop(self):
+        """
+        Signal the collector that it's time to stop
+
+        """
+        self.time_to_die.set()
+
+    def find_entities(self):
+        """
+        Find the managed entities specified as targets
+
+        Returns:
+            A dict mapping <type>:<name> strings to managed entities
+
+        """
+        names = set(t['entity'] for t in self.targets)
+        types = set(n.split(':', 1)[0] for n in names)
+        result = {}
+
+        for t in types:
+            if t not in ENTITY_TYPES:
+                raise ValueError('Unknown entity type: {}'.format(t))
+
+            view = self.agent.get_container_view(obj_type=[ENTITY_TYPES[t]])
+            properties = self.agent.collect_properties(
+                view_ref=view,
+                obj_type=ENTITY_TYPES[t],
+                path_set=['name'],
+                include_mors=True
+            )
+            view.DestroyView()
+
+            for p in properties:
+                name = '{}:{}'.format(t, p['name'])
+                if name in names:
+                    result[name] = p['obj']
+
+        missing = names - set(result.keys())
+        if missing:
+            raise ValueError('Entities not found: {}'.format(', '.join(sorted(missing))))
+
+        return result
+
+    def setup(self):
+        """
+        Create the pollers for the target entities
+
+        """
+        pm = self.agent.si.content.perfManager
+        counters = pvc.perf.counter_names(pm)
+        entities = self.find_entities()
+        now = self.agent.si.CurrentTime()
+
+        self.pollers = []
+        for target in self.targets:
+            entity = entities[target['entity']]
+            summary = pm.QueryPerfProviderSummary(entity=entity)
+            if summary.currentSupported:
+                interval_id = summary.refreshRate
+            else:
+                interval_id = pm.historicalInterval[0].samplingPeriod
+
+            unknown = [c for c in target['counters'] if c not in counters]
+            if unknown:
+                raise ValueError('Unknown counters: {}'.format(', '.join(unknown)))
+
+            counter_id = [counters[c].key for c in target['counters']]
+            instances = target.get('instances') or ['']
+            metric_id = [
+                pyVmomi.vim.PerformanceManager.MetricId(counterId=c, instance=i)
+                for c in counter_id for i in instances if i != '*'
+            ]
+
+            # Resolve wildcard instances to the currently available ones
+            if '*' in instances:
+                available = pm.QueryAvailablePerfMetric(entity=entity, intervalId=interval_id)
+                metric_id.extend([
+                    m for m in available
+                    if m.counterId in counter_id and m.instance and m.instance not in instances
+                ])
+
+            poller = pvc.perf.RealtimePoller(
+                pm=pm,
+                entity=entity,
+                metric_id=metric_id,
+                interval_id=interval_id,
+                start_time=now - datetime.timedelta(seconds=interval_id)
+            )
+
+            # Continue from where we left before a reconnect
+            for m in metric_id:
+                key = (entity._moId, pvc.perf.metric_key(m))
+                if key in self.last_sample_time:
+                    poller.last_sample_time[key[1]] = self.last_sample_time[key]
+
+            name = target['entity'].split(':', 1)[1]
+            self.pollers.append((name, poller))
+
+        self.interval = min(p.interval_id for name, p in self.pollers)
+        self.counter_by_key = {c.key: name for name, c in counters.items()}
+        self.percent = set(c.key for c in counters.values() if c.unitInfo.key == 'percent')
+
+    def poll(self):
+        """
+        Poll all entities using a single QueryPerf() call and
+        write the new samples
+
+        """
+        pm = self.agent.si.content.perfManager
+        specs = [s for name, poller in self.pollers for s in poller.query_specs()]
+        result = pm.QueryPerf(querySpec=specs)
+
+        by_entity = collections.defaultdict(list)
+        for data in result:
+            by_entity[data.entity._moId].append(data)
+
+        for name, poller in self.pollers:
+            moid = poller.entity._moId
+            for (counter_id, instance), samples in poller.update(by_entity.get(moid, [])).items():
+                if not samples:
+                    continue
+                if counter_id in self.percent:
+                    samples = [(t, v / 100.0 if v != -1 else v) for t, v in samples]
+                self.writer.write(
+                    entity=name,
+                    moid=moid,
+                    counter=self.counter_by_key.get(counter_id, str(counter_id)),
+                    instance=instance,
+                    samples=samples
+                )
+                self.last_sample_time[(moid, (counter_id, instance))] = samples[-1][0]
+
+        self.writer.flush()
+
+    def run(self):
+        """
+        Collect performance metrics until signaled to stop
+
+        Invalid targets, e.g. unknown entities or counters, raise
+        ValueError when the collector starts. Failures after that
+        are logged and collecting is retried after reconnecting.
+
+        """
+        self.setup()
+
+        connected = True
+        while not self.time_to_die.is_set():
+            try:
+                if not connected:
+                    logger.info('Reconnecting to %s', self.agent.host)
+                    self.agent.connect()
+                    connected = True
+                if not self.pollers:
+                    self.setup()
+                self.poll()
+            except Exception as e:
+                msg = e.msg if isinstance(e, pyVmomi.vmodl.MethodFault) else e
+                logger.error('Failed to collect metrics from %s: %s', self.agent.host, msg)
+                connected = False
+                self.pollers = []
+                try:
+                    self.agent.disconnect()
+                except Exception:
+                    pass
+                self.time_to_die.wait(self.retry_interval)
+                continue
+
+            self.time_to_die.wait(self.interval)
+
+        self.writer.close()
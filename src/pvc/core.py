@@ -27,7 +27,10 @@ Core Widgets
 
 """
 
+import os
 import ssl
+import logging
+import threading
 
 try:
     _create_unverified_https_context = ssl._create_unverified_context
@@ -43,6 +46,7 @@ import pyVmomi
 import requests
 requests.packages.urllib3.disable_warnings()
 
+import pvc.alarm
 import pvc.widget.form
 import pvc.widget.home
 
@@ -54,18 +58,111 @@ from pvc import __version__
 __all__ = ['MainApp']
 
 
+class _StatusDialog(object):
+    def __init__(self, dialog):
+        """
+        Dialog wrapper showing a status in the background title
+
+        The status may be set from any thread, while the background
+        title is only updated from the thread using the dialog, right
+        before the next widget is drawn. The background title is kept
+        as a single persistent argument of the dialog, which is
+        replaced instead of being added again on every change.
+
+        Args:
+            dialog (dialog.Dialog): A Dialog instance
+
+        """
+        self._dialog = dialog
+        self._lock = threading.Lock()
+        self._title = ''
+        self._status = None
+        self._changed = False
+
+    def set_background_title(self, text):
+        """
+        Set the background title shown before the status
+
+        Args:
+            text (str): The background title
+
+        """
+        with self._lock:
+            self._title = text
+            self._changed = True
+
+    def set_status(self, status):
+        """
+        Set the status shown in the background title
+
+        This method is safe to call from any thread.
+
+        Args:
+            status (str): The status to show, None to clear it
+
+        """
+        with self._lock:
+            self._status = status
+            self._changed = True
+
+    def _update_background_title(self):
+        with self._lock:
+            if not self._changed:
+                return
+            text = self._title
+            if self._status:
+                text = '{} - {}'.format(text, self._status)
+            self._changed = False
+
+        args = self._dialog.dialog_persistent_arglist
+        if '--backtitle' in args:
+            args[args.index('--backtitle') + 1] = text
+        else:
+            self._dialog.set_background_title(text)
+
+    def __getattr__(self, name):
+        attr = getattr(self._dialog, name)
+        if callable(attr):
+            self._update_background_title()
+
+        return attr
+
+
 class MainApp(object):
     """
     Main App class
 
     """
     def __init__(self):
-        self.dialog = Dialog(autowidgetsize=True)
+        self.setup_logging()
+        self.dialog = _StatusDialog(Dialog(autowidgetsize=True))
         self.dialog.add_persistent_args(['--no-mouse'])
         self.dialog.set_background_title(
             'Python vSphere Client version {}'.format(__version__)
         )
         self.agent = None
+        self.alarm_watcher = None
+
+    def setup_logging(self):
+        """
+        Setup logging of the background threads
+
+        Log messages would otherwise be written to stderr on top
+        of the dialog screen, so they are discarded, unless the
+        PVC_LOG_FILE environment variable is set to the path of
+        a file to which they are appended.
+
+        """
+        path = os.environ.get('PVC_LOG_FILE')
+        if path:
+            handler = logging.FileHandler(os.path.expanduser(path))
+            handler.setFormatter(
+                logging.Formatter('%(asctime)s %(levelname)s %(name)s: %(message)s')
+            )
+        else:
+            handler = logging.NullHandler()
+
+        logging.getLogger().addHandler(handler)
 
     def about(self):
         welcome = (
@@ -153,6 +250,25 @@ class MainApp(object):
                     text='Failed to login to {}\n\n{}\n'.format(self.agent.host, msg)
                 )
 
+    def on_alarm_change(self, watcher, fired, cleared):
+        """
+        Show the number of triggered alarms in the background title
+
+        Called from the alarm watcher thread. The background title
+        is updated when the next widget is drawn, so the user is
+        notified without interrupting the current widget.
+
+        """
+        counts = watcher.counts()
+        status = 'Alarms: {} red, {} yellow'.format(
+            counts['red'],
+            counts['yellow']
+        )
+        if fired:
+            status = '{} ({} new)'.format(status, len(fired))
+
+        self.dialog.set_status(status)
+
     def disconnect(self):
         """
         Disconnect from the remote vSphere host
@@ -173,6 +289,12 @@ class MainApp(object):
             if not self.login():
                 return
 
+            self.alarm_watcher = pvc.alarm.AlarmWatcher(
+                agent=self.agent,
+                on_change=self.on_alarm_change
+            )
+            self.alarm_watcher.start()
+
             home = pvc.widget.home.HomeWidget(
                 agent=self.agent,
                 dialog=self.dialog
@@ -181,4 +303,7 @@ class MainApp(object):
         except KeyboardInterrupt:
             pass
         finally:
+            if self.alarm_watcher:
+                self.alarm_watcher.signal_stop()
+                self.alarm_watcher.join(1)
             self.disconnect()
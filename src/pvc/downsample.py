@@ -0,0 +1,170 @@
+# Copyright (c) 2015 Marin Atanasov Nikolov <dnaeon@gmail.com>
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions
+# are met:
+# 1. Redistributions of source code must retain the above copyright
+#    notice, this list of conditions and the following disclaimer
+#    in this position and unchanged.
+# 2. Redistributions in binary form must reproduce the above copyright
+#    notice, this list of conditions and the following disclaimer in the
+#    documentation and/or other materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE AUTHOR(S) ``AS IS'' AND ANY EXPRESS OR
+# IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED WARRANTIES
+# OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE DISCLAIMED.
+# IN NO EVENT SHALL THE AUTHOR(S) BE LIABLE FOR ANY DIRECT, INDIRECT,
+# INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT
+# NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE,
+# DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY
+# THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF
+# THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+"""
+Downsampling module
+
+Reduces the number of points of dense time series, so that
+they can be plotted in a limited space without losing their
+overall shape and peaks.
+
+Missing samples are represented as NaN values.
+
+"""
+
+import numpy
+
+__all__ = ['METHODS', 'lttb', 'minmax', 'downsample']
+
+# Supported downsampling methods, the first one being the default
+METHODS = ('minmax', 'lttb')
+
+
+def lttb(x, y, threshold):
+    """
+    Downsample a series using the Largest-Triangle-Three-Buckets algorithm
+
+    Missing samples are dropped before downsampling.
+
+    Args:
+        x     (array_like): The x values of the series in ascending order
+        y     (array_like): The y values of the series
+        threshold    (int): Number of points to return
+
+    Returns:
+        A tuple of the downsampled x and y values as numpy arrays
+
+    """
+    x = numpy.asarray(x, dtype=float)
+    y = numpy.asarray(y, dtype=float)
+    valid = ~numpy.isnan(y)
+    x, y = x[valid], y[valid]
+    n = len(x)
+
+    if threshold >= n or threshold < 3:
+        return x, y
+
+    # Bucket boundaries, the first and last points are always selected
+    every = (n - 2) / float(threshold - 2)
+    bounds = numpy.floor(numpy.arange(threshold - 1) * every).astype(int) + 1
+    bounds[-1] = n - 1
+
+    # Average point of each bucket, calculated using prefix sums
+    sum_x = numpy.concatenate(([0.0], numpy.cumsum(x)))
+    sum_y = numpy.concatenate(([0.0], numpy.cumsum(y)))
+    counts = bounds[1:] - bounds[:-1]
+    avg_x = (sum_x[bounds[1:]] - sum_x[bounds[:-1]]) / counts
+    avg_y = (sum_y[bounds[1:]] - sum_y[bounds[:-1]]) / counts
+
+    selected = numpy.empty(threshold, dtype=int)
+    selected[0], selected[-1] = 0, n - 1
+    a = 0
+    for i in range(threshold - 2):
+        start, end = bounds[i], bounds[i + 1]
+        if i + 1 < threshold - 2:
+            next_x, next_y = avg_x[i + 1], avg_y[i + 1]
+        else:
+            next_x, next_y = x[-1], y[-1]
+
+        # Select the point forming the largest triangle with the
+        # previously selected point and the next bucket's average
+        area = numpy.abs(
+            (x[a] - next_x) * (y[start:end] - y[a]) -
+            (x[a] - x[start:end]) * (next_y - y[a])
+        )
+        a = start + int(numpy.argmax(area))
+        selected[i + 1] = a
+
+    return x[selected], y[selected]
+
+
+def minmax(x, y, buckets):
+    """
+    Downsample a series to its min/max envelope
+
+    The range of x values is split into buckets of equal size and
+    the minimum and maximum points of each bucket are kept in their
+    original order, so that no peaks are lost. Buckets consisting
+    of missing samples only are represented by a single NaN point.
+
+    Args:
+        x   (array_like): The x values of the series in ascending order
+        y   (array_like): The y values of the series
+        buckets    (int): Number of buckets
+
+    Returns:
+        A tuple of the downsampled x and y values as numpy arrays
+
+    """
+    x = numpy.asarray(x, dtype=float)
+    y = numpy.asarray(y, dtype=float)
+
+    if len(x) <= buckets * 2 or buckets < 1:
+        return x, y
+
+    edges = numpy.linspace(x[0], x[-1], buckets + 1)
+    bucket = numpy.clip(numpy.searchsorted(edges, x, side='right') - 1, 0, buckets - 1)
+
+    # Sort the valid points by bucket and value, so that the first
+    # and last point of each bucket are its minimum and maximum
+    index = numpy.flatnonzero(~numpy.isnan(y))
+    if not len(index):
+        first_of_bucket = numpy.searchsorted(bucket, numpy.unique(bucket))
+        return x[first_of_bucket], y[first_of_bucket]
+
+    order = numpy.lexsort((y[index], bucket[index]))
+    index = index[order]
+    valid_bucket = bucket[index]
+    first = numpy.flatnonzero(numpy.concatenate(([True], valid_bucket[1:] != valid_bucket[:-1])))
+    last = numpy.concatenate((first[1:], [len(index)])) - 1
+
+    # Buckets which contain missing samples only
+    empty = numpy.setdiff1d(numpy.unique(bucket), valid_bucket[first])
+    missing = numpy.searchsorted(bucket, empty)
+
+    selected = numpy.unique(numpy.concatenate((index[first], index[last], missing)))
+
+    return x[selected], y[selected]
+
+
+def downsample(x, y, points, method='minmax'):
+    """
+    Downsample a series to a given number of points
+
+    Args:
+        x  (array_like): The x values of the series in ascending order
+        y  (array_like): The y values of the series
+        points    (int): Maximum number of points to return
+        method    (str): Downsampling method, 'minmax' or 'lttb'
+
+    Returns:
+        A tuple of the downsampled x and y values as numpy arrays
+
+    """
+    if method == 'lttb':
+        return lttb(x, y, points)
+    elif method == 'minmax':
+        return minmax(x, y, points // 2)
+
+    raise ValueError('Unknown downsampling method: {}'.format(method))
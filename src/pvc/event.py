@@ -0,0 +1,371 @@
+# Copyright (c) 2015 Marin Atanasov Nikolov <dnaeon@gmail.com>
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions
+# are met:
+# 1. Redistributions of source code must retain the above copyright
+#    notice, this list of conditions and the following disclaimer
+#    in this position and unchanged.
+# 2. Redistributions in binary form must reproduce the above copyright
+#    notice, this list of conditions and the following disclaimer in the
+#    documentation and/or other materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE AUTHOR(S) ``AS IS'' AND ANY EXPRESS OR
+# IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED WARRANTIES
+# OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE DISCLAIMED.
+# IN NO EVENT SHALL THE AUTHOR(S) BE LIABLE FOR ANY DIRECT, INDIRECT,
+# INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT
+# NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE,
+# DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY
+# THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF
+# THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+"""
+Event module
+
+Helpers for collecting vSphere events as they are created.
+
+"""
+
+import logging
+import threading
+import collections
+
+import pyVmomi
+
+import pvc.eventstore
+
+__all__ = ['EventCollector']
+
+logger = logging.getLogger(__name__)
+
+
+class EventCollector(threading.Thread):
+    # Maximum number of events read from the collector at a time
+    PAGE_SIZE = 100
+
+    # Maximum number of seconds to wait for updates in a single call,
+    # kept short so that a stop requested before a wait has started
+    # and missed by CancelWaitForUpdates() is noticed soon after
+    MAX_WAIT_SECONDS = 5
+
+    # Maximum number of event history collectors created by a
+    # single thread, each session may only have a few of them
+    MAX_COLLECTORS = 16
+
+    # Number of seconds to wait before subscribing again after a failure
+    RETRY_SECONDS = 30
+
+    def __init__(self, agent, obj, path=None, store_path=None, sink=None):
+        """
+        Event Collector Thread
+
+        The latest page of an event history collector is watched
+        for changes using a property collector, so new events are
+        received as soon as they are created, with a single request
+        every MAX_WAIT_SECONDS while there are no new events.
+
+        Each change is used only as a trigger to read all new events
+        from the history collector, which means that no events are
+        lost even if more than a page of events arrive at once.
+
+        Events of multiple entities are collected by a single
+        thread, using a history collector per entity and a single
+        property collector watching all of them. The events of all
+        entities are merged in a single stream ordered by time. When
+        more than MAX_COLLECTORS entities are given a single history
+        collector is used for all events, which are then filtered by
+        the entities they refer to.
+
+        When collecting fails, e.g. because the session was lost and
+        the agent is being reconnected, the failure is logged and the
+        collectors are created again after RETRY_SECONDS. The new
+        collectors start from the last event seen for each entity,
+        so no events are lost or repeated.
+
+        New events are also added to the local event store if
+        the path to the event store is provided, and written to
+        the event sink if one is provided.
+
+        Args:
+            agent        (VConnector): A VConnector instance
+            obj   (vim.ManagedEntity): A Managed Entity or a list of Managed Entities
+            path                (str): Path where new events are appended to
+            store_path          (str): Path to the local event store
+            sink      (JsonEventSink): An event sink to write new events to
+
+        """
+        super().__init__()
+        self.daemon = True
+        self.time_to_die = threading.Event()
+        self.ready = threading.Event()
+
+        self.agent = agent
+        self.objs = obj if isinstance(obj, list) else [obj]
+        self.path = path
+        self.store_path = store_path
+        self.sink = sink
+        self.server = None
+        self.start_time = None
+        self.last_event = {}
+        self.seen = collections.OrderedDict()
+        self.property_collector = None
+
+    def create_collectors(self):
+        """
+        Create the event history collectors for the entities
+
+        The first time the collectors are created they start
+        reading from the oldest event in the latest page. When
+        they are created again they start reading from the last
+        event seen for their entity, or from the time collection
+        was started if no events were seen yet.
+
+        Returns:
+            A dict mapping the moId of each collector to a tuple
+            of the collector and its entity. The entity is None
+            if the collector is used for all entities.
+
+        """
+        event_manager = self.agent.si.content.eventManager
+
+        if len(self.objs) > self.MAX_COLLECTORS:
+            entities = [None]
+        else:
+            entities = self.objs
+
+        collectors = {}
+        for obj in entities:
+            filter_spec = pyVmomi.vim.event.EventFilterSpec(disableFullMessage=False)
+            if obj is not None:
+                filter_spec.entity = pyVmomi.vim.event.EventFilterSpec.ByEntity(
+                    entity=obj,
+                    recursion=pyVmomi.vim.event.EventFilterSpec.RecursionOption.all
+                )
+
+            if self.start_time is None:
+                collector = event_manager.CreateCollectorForEvents(filter=filter_spec)
+                collector.ResetCollector()
+            else:
+                entity_key = obj._moId if obj is not None else None
+                begin_time = self.last_event.get(entity_key, (0, self.start_time))[1]
+                filter_spec.time = pyVmomi.vim.event.EventFilterSpec.ByTime(beginTime=begin_time)
+                collector = event_manager.CreateCollectorForEvents(filter=filter_spec)
+                collector.RewindCollector()
+            collectors[collector._moId] = (collector, obj)
+
+        return collectors
+
+    def run(self):
+        store = None
+        if self.store_path:
+            store = pvc.eventstore.EventStore(self.store_path)
+
+        try:
+            while not self.time_to_die.is_set():
+                try:
+                    self.collect(store)
+                except pyVmomi.vmodl.fault.RequestCanceled:
+                    pass
+                except Exception as e:
+                    if self.time_to_die.is_set():
+                        break
+                    msg = e.msg if isinstance(e, pyVmomi.vmodl.MethodFault) else e
+                    logger.error(
+                        'Event collector of %s failed, retrying in %d seconds: %s',
+                        self.agent.host, self.RETRY_SECONDS, msg
+                    )
+                    self.time_to_die.wait(self.RETRY_SECONDS)
+        finally:
+            self.ready.set()
+            if store:
+                store.close()
+
+    def collect(self, store=None):
+        """
+        Collect the events of the entities until signaled to stop
+
+        Args:
+            store (pvc.eventstore.EventStore): An EventStore instance
+
+        """
+        collectors = {}
+        moids = set(obj._moId for obj in self.objs)
+
+        try:
+            collectors = self.create_collectors()
+            self.property_collector = self.agent.si.content.propertyCollector.CreatePropertyCollector()
+            self.property_collector.CreateFilter(
+                spec=pyVmomi.vmodl.query.PropertyCollector.FilterSpec(
+                    objectSet=[
+                        pyVmomi.vmodl.query.PropertyCollector.ObjectSpec(obj=collector)
+                        for collector, obj in collectors.values()
+                    ],
+                    propSet=[
+                        pyVmomi.vmodl.query.PropertyCollector.PropertySpec(
+                            type=pyVmomi.vim.event.EventHistoryCollector,
+                            pathSet=['latestPage']
+                        )
+                    ]
+                ),
+                partialUpdates=False
+            )
+            options = pyVmomi.vmodl.query.PropertyCollector.WaitOptions(
+                maxWaitSeconds=self.MAX_WAIT_SECONDS
+            )
+
+            about = self.agent.si.content.about
+            self.server = about.instanceUuid if about.instanceUuid else self.agent.host
+            if self.start_time is None:
+                self.start_time = self.agent.si.CurrentTime()
+
+            version = ''
+            while not self.time_to_die.is_set():
+                update = self.property_collector.WaitForUpdatesEx(
+                    version=version,
+                    options=options
+                )
+                if update is None or self.time_to_die.is_set():
+                    continue
+
+                version = update.version
+                changed = [
+                    collectors[o.obj._moId]
+                    for f in update.filterSet for o in f.objectSet
+                    if o.obj._moId in collectors
+                ]
+
+                latest_events = []
+                for collector, obj in changed:
+                    events = self.get_latest_events(collector, obj)
+                    if obj is None:
+                        events = [
+                            e for e in events
+                            if any(moid in moids for moid, name in pvc.eventstore.event_entities(e))
+                        ]
+                    elif store and events:
+                        # All events since the collector was started are known
+                        # up to the latest one, so the range can be recorded
+                        store.add(self.server, events, entity=obj._moId)
+                        store.add_coverage(self.server, obj._moId, self.start_time, events[-1].createdTime)
+                    latest_events.extend(events)
+
+                latest_events = self.merge_events(latest_events)
+                if latest_events:
+                    self.save_events(latest_events)
+                    if store and not any(obj for collector, obj in changed):
+                        store.add(self.server, latest_events)
+                self.ready.set()
+        finally:
+            # The session may already be gone, in which case
+            # the server has destroyed the collectors as well
+            try:
+                if self.property_collector:
+                    self.property_collector.DestroyPropertyCollector()
+                for collector, obj in collectors.values():
+                    collector.DestroyCollector()
+            except Exception:
+                pass
+            self.property_collector = None
+
+    def signal_stop(self):
+        """
+        Signal the thread that it's time to die
+
+        """
+        self.time_to_die.set()
+
+        # Wake up the thread if it is waiting for updates
+        if self.property_collector:
+            try:
+                self.property_collector.CancelWaitForUpdates()
+            except pyVmomi.vmodl.MethodFault:
+                pass
+
+    def get_latest_events(self, collector, obj=None):
+        """
+        Get the events created since the last read
+
+        Args:
+            collector (vim.event.EventHistoryCollector): A collector instance
+            obj                   (vim.ManagedEntity): The entity of the collector,
+                                                       None if collecting all events
+
+        Returns:
+            A list of the latest events, ordered by their key
+
+        """
+        entity_key = obj._moId if obj is not None else None
+        last_event_key = self.last_event.get(entity_key, (0, None))[0]
+        latest_events = []
+        while True:
+            events = collector.ReadNextEvents(maxCount=self.PAGE_SIZE)
+            if not events:
+                break
+            latest_events.extend(e for e in events if e.key > last_event_key)
+
+        if latest_events:
+            latest_events.sort(key=lambda x: x.key)
+            self.last_event[entity_key] = (latest_events[-1].key, latest_events[-1].createdTime)
+
+        return latest_events
+
+    def merge_events(self, events):
+        """
+        Merge the events of multiple collectors in a single stream
+
+        Events seen by more than one collector, e.g. the events of
+        a Virtual Machine which are also events of its host, are
+        returned only once.
+
+        Args:
+            events (list): A list of vim.event.Event instances
+
+        Returns:
+            A list of the events not seen yet, ordered by time
+
+        """
+        result = []
+        for e in sorted(events, key=lambda x: (x.createdTime, x.key)):
+            if e.key in self.seen:
+                continue
+            self.seen[e.key] = True
+            result.append(e)
+
+        # Only recent events may be seen again by another collector
+        while len(self.seen) > self.PAGE_SIZE * self.MAX_COLLECTORS:
+            self.seen.popitem(last=False)
+
+        return result
+
+    def save_events(self, events):
+        """
+        Append new events to a file and write them to the event sink
+
+        Args:
+            events (list): A list of vim.event.Event instances
+
+        """
+        if self.sink:
+            self.sink.write(events, server=self.server)
+
+        # The file may be removed as soon as the thread is told to stop
+        if not self.path or self.time_to_die.is_set():
+            return
+
+        with open(self.path, 'a') as f:
+            for e in events:
+                message = e.fullFormattedMessage
+
+                # Prefix events with the entity when following multiple entities
+                if len(self.objs) > 1:
+                    entities = pvc.eventstore.event_entities(e)
+                    if entities:
+                        message = '{}: {}'.format(entities[0][1], message)
+
+                if e.userName:
+                    f.write('[{}]: User {}: {}\n'.format(str(e.createdTime), e.userName, message))
+                else:
+                    f.write('[{}]: {}\n'.format(str(e.createdTime), message))
@@ -0,0 +1,170 @@
+# Copyright (c) 2015 Marin Atanasov Nikolov <dnaeon@gmail.com>
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions
+# are met:
+# 1. Redistributions of source code must retain the above copyright
+#    notice, this list of conditions and the following disclaimer
+#    in this position and unchanged.
+# 2. Redistributions in binary form must reproduce the above copyright
+#    notice, this list of conditions and the following disclaimer in the
+#    documentation and/or other materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE AUTHOR(S) ``AS IS'' AND ANY EXPRESS OR
+# IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED WARRANTIES
+# OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE DISCLAIMED.
+# IN NO EVENT SHALL THE AUTHOR(S) BE LIABLE FOR ANY DIRECT, INDIRECT,
+# INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT
+# NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE,
+# DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY
+# THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF
+# THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+"""
+Event Sink module
+
+Writes vSphere events as JSON lines to rotating files.
+
+"""
+
+import os
+import gzip
+import json
+import time
+import shutil
+import threading
+
+import pvc.eventstore
+
+__all__ = ['event_record', 'JsonEventSink']
+
+
+def event_record(event, server=None):
+    """
+    Convert an event to a record which can be serialized as JSON
+
+    Args:
+        event (vim.event.Event): An event
+        server           (str): The vSphere server the event comes from
+
+    Returns:
+        A dict with the details of the event
+
+    """
+    entities = pvc.eventstore.event_entities(event)
+    moid, name = entities[0] if entities else (None, None)
+
+    return {
+        'server': server,
+        'key': event.key,
+        'time': event.createdTime.isoformat(),
+        'type': pvc.eventstore.event_type_id(event),
+        'user': event.userName or None,
+        'entity': moid,
+        'entityName': name,
+        'message': event.fullFormattedMessage,
+    }
+
+
+class JsonEventSink(object):
+    def __init__(self, path, max_bytes=64 * 1024 * 1024, interval=0, backup_count=10, compress=False):
+        """
+        Writes events as JSON lines to rotating files
+
+        The file is kept open and written in batches, one record
+        per event. Once the file reaches the given size or age it
+        is rotated to <path>.1, optionally compressed with gzip.
+
+        Events may be written from another thread than the one
+        closing the sink. Events written after the sink has been
+        closed are discarded.
+
+        Args:
+            path          (str): Path to the output file
+            max_bytes     (int): Rotate the file once it reaches that size, 0 to disable
+            interval      (int): Rotate the file after that many seconds, 0 to disable
+            backup_count  (int): Number of rotated files to keep
+            compress     (bool): If True compress the rotated files
+
+        """
+        self.path = path
+        self.max_bytes = max_bytes
+        self.interval = interval
+        self.backup_count = backup_count
+        self.compress = compress
+        self.stream = None
+        self.opened_at = None
+        self.lock = threading.Lock()
+        self._open()
+
+    def _open(self):
+        self.stream = open(self.path, 'a', encoding='utf-8')
+        self.opened_at = time.time()
+
+    def _backup_name(self, i):
+        return '{}.{}{}'.format(self.path, i, '.gz' if self.compress else '')
+
+    def should_rotate(self):
+        """
+        Check whether the file should be rotated
+
+        """
+        if self.max_bytes and self.stream.tell() >= self.max_bytes:
+            return True
+        if self.interval and time.time() - self.opened_at >= self.interval:
+            return True
+
+        return False
+
+    def rotate(self):
+        """
+        Rotate the output file
+
+        """
+        self.stream.close()
+
+        for i in range(self.backup_count - 1, 0, -1):
+            src = self._backup_name(i)
+            if os.path.exists(src):
+                os.replace(src, self._backup_name(i + 1))
+
+        if self.backup_count < 1:
+            os.unlink(self.path)
+        elif self.compress:
+            with open(self.path, 'rb') as src, gzip.open(self._backup_name(1), 'wb') as dst:
+                shutil.copyfileobj(src, dst)
+            os.unlink(self.path)
+        else:
+            os.replace(self.path, self._backup_name(1))
+
+        self._open()
+
+    def write(self, events, server=None):
+        """
+        Write a batch of events
+
+        Args:
+            events  (list): A list of vim.event.Event instances
+            server   (str): The vSphere server the events come from
+
+        """
+        with self.lock:
+            if not self.stream:
+                return
+
+            if self.stream.tell() and self.should_rotate():
+                self.rotate()
+
+            self.stream.writelines(
+                json.dumps(event_record(e, server), separators=(',', ':')) + '\n'
+                for e in events
+            )
+            self.stream.flush()
+
+    def close(self):
+        with self.lock:
+            if self.stream:
+                self.stream.close()
+                self.stream = None
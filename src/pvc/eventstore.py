@@ -0,0 +1,448 @@
+# Copyright (c) 2015 Marin Atanasov Nikolov <dnaeon@gmail.com>
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions
+# are met:
+# 1. Redistributions of source code must retain the above copyright
+#    notice, this list of conditions and the following disclaimer
+#    in this position and unchanged.
+# 2. Redistributions in binary form must reproduce the above copyright
+#    notice, this list of conditions and the following disclaimer in the
+#    documentation and/or other materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE AUTHOR(S) ``AS IS'' AND ANY EXPRESS OR
+# IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED WARRANTIES
+# OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE DISCLAIMED.
+# IN NO EVENT SHALL THE AUTHOR(S) BE LIABLE FOR ANY DIRECT, INDIRECT,
+# INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT
+# NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE,
+# DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY
+# THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF
+# THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+"""
+Event Store module
+
+A local SQLite store of vSphere events, so that repeated queries
+for the same events can be answered without the event manager.
+
+"""
+
+import os
+import sqlite3
+import calendar
+import datetime
+
+__all__ = [
+    'event_type_id', 'event_entities', 'store_path', 'StoredEvent',
+    'EventStore', 'StoredEventPager',
+]
+
+_UTC = datetime.timezone.utc
+
+# Event arguments referring to managed entities, as
+# (event property, entity property of the argument) tuples
+_ENTITY_ARGUMENTS = (
+    ('vm', 'vm'),
+    ('host', 'host'),
+    ('computeResource', 'computeResource'),
+    ('datacenter', 'datacenter'),
+    ('ds', 'datastore'),
+    ('net', 'network'),
+    ('dvs', 'dvs'),
+)
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS events (
+    server TEXT NOT NULL,
+    key INTEGER NOT NULL,
+    created REAL NOT NULL,
+    entity TEXT,
+    entity_name TEXT,
+    type TEXT,
+    user TEXT,
+    message TEXT,
+    PRIMARY KEY (server, key)
+);
+CREATE INDEX IF NOT EXISTS events_created ON events (server, created);
+CREATE INDEX IF NOT EXISTS events_entity ON events (server, entity, created);
+CREATE INDEX IF NOT EXISTS events_type ON events (server, type, created);
+CREATE INDEX IF NOT EXISTS events_user ON events (server, user, created);
+
+CREATE TABLE IF NOT EXISTS event_entities (
+    server TEXT NOT NULL,
+    entity TEXT NOT NULL,
+    key INTEGER NOT NULL,
+    created REAL NOT NULL,
+    PRIMARY KEY (server, entity, key)
+);
+CREATE INDEX IF NOT EXISTS event_entities_created ON event_entities (server, entity, created);
+
+CREATE TABLE IF NOT EXISTS coverage (
+    server TEXT NOT NULL,
+    entity TEXT NOT NULL,
+    start REAL NOT NULL,
+    end REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS coverage_entity ON coverage (server, entity);
+"""
+
+
+def _to_epoch(t):
+    """
+    Convert a datetime instance to a UNIX timestamp with microseconds
+
+    """
+    return calendar.timegm(t.utctimetuple()) + t.microsecond / 1000000.0
+
+
+def _from_epoch(t):
+    """
+    Convert a UNIX timestamp to a datetime instance in UTC
+
+    """
+    return datetime.datetime.fromtimestamp(t, tz=_UTC)
+
+
+def event_type_id(event):
+    """
+    Get the type id of an event, e.g. VmPoweredOnEvent
+
+    Args:
+        event (vim.event.Event): An event or a StoredEvent instance
+
+    Returns:
+        The type id of the event as used by vim.event.EventFilterSpec
+
+    """
+    type_id = getattr(event, 'eventTypeId', None)
+    if type_id:
+        return type_id
+
+    return event.__class__.__name__.rsplit('.', 1)[-1]
+
+
+def event_entities(event):
+    """
+    Get the managed entities an event refers to
+
+    Args:
+        event (vim.event.Event): An event
+
+    Returns:
+        A list of (moId, name) tuples of the entities, starting
+        with the most specific one, e.g. the Virtual Machine
+        before its host and datacenter
+
+    """
+    result = []
+    for name, prop in _ENTITY_ARGUMENTS:
+        argument = getattr(event, name, None)
+        ref = getattr(argument, prop, None) if argument else None
+        if ref is not None:
+            result.append((ref._moId, argument.name))
+
+    return result
+
+
+def store_path():
+    """
+    Get the path to the event store
+
+    The event store is enabled by setting the PVC_EVENT_STORE
+    environment variable to the path of the database file.
+
+    Returns:
+        The path to the event store or None if it is not enabled
+
+    """
+    path = os.environ.get('PVC_EVENT_STORE')
+
+    return os.path.expanduser(path) if path else None
+
+
+class StoredEvent(object):
+    def __init__(self, key, created, userName, fullFormattedMessage, eventTypeId, entityName):
+        """
+        An event loaded from the event store
+
+        Provides the properties of vim.event.Event used for
+        displaying events, so stored events and events retrieved
+        from the server can be used interchangeably.
+
+        """
+        self.key = key
+        self.created = created
+        self.createdTime = _from_epoch(created)
+        self.userName = userName
+        self.fullFormattedMessage = fullFormattedMessage
+        self.eventTypeId = eventTypeId
+        self.entityName = entityName
+
+
+class EventStore(object):
+    def __init__(self, path):
+        """
+        Local store of vSphere events
+
+        Events are identified by the vCenter instance UUID and the
+        event key and are indexed by time, entity moId, event type
+        and user. Events are linked to the entities they refer to and
+        to the entity they were retrieved for, and the time ranges
+        retrieved for each entity are recorded, so it is known which
+        queries can be answered from the store.
+
+        Each instance holds its own connection to the database and
+        must be used from the thread which created it.
+
+        Args:
+            path (str): Path to the database file
+
+        """
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+        self.path = path
+        self.connection = sqlite3.connect(path, timeout=30)
+        self.connection.execute('PRAGMA journal_mode=WAL')
+        self.connection.executescript(_SCHEMA)
+
+    def close(self):
+        self.connection.close()
+
+    def add(self, server, events, entity=None):
+        """
+        Add events to the store
+
+        Args:
+            server  (str): Instance UUID of the vCenter server
+            events (list): A list of vim.event.Event instances
+            entity  (str): The moId of the entity the events were retrieved for
+
+        """
+        rows = []
+        links = []
+        for e in events:
+            created = _to_epoch(e.createdTime)
+            entities = event_entities(e)
+            moids = [moid for moid, name in entities]
+            if entity:
+                moids.append(entity)
+
+            rows.append((
+                server,
+                e.key,
+                created,
+                entities[0][0] if entities else None,
+                entities[0][1] if entities else None,
+                event_type_id(e),
+                e.userName or None,
+                e.fullFormattedMessage,
+            ))
+            links.extend((server, moid, e.key, created) for moid in set(moids))
+
+        with self.connection:
+            self.connection.executemany(
+                'INSERT OR IGNORE INTO events VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+                rows
+            )
+            self.connection.executemany(
+                'INSERT OR IGNORE INTO event_entities VALUES (?, ?, ?, ?)',
+                links
+            )
+
+    def add_coverage(self, server, entity, start_time, end_time):
+        """
+        Record that all events of an entity within a time range are stored
+
+        Overlapping and adjacent ranges are merged.
+
+        Args:
+            server                   (str): Instance UUID of the vCenter server
+            entity                   (str): The moId of the entity
+            start_time (datetime.datetime): Start of the time range
+            end_time   (datetime.datetime): End of the time range
+
+        """
+        start, end = _to_epoch(start_time), _to_epoch(end_time)
+
+        with self.connection:
+            overlapping = self.connection.execute(
+                'SELECT rowid, start, end FROM coverage '
+                'WHERE server = ? AND entity = ? AND start <= ? AND end >= ?',
+                (server, entity, end, start)
+            ).fetchall()
+
+            for rowid, s, e in overlapping:
+                start, end = min(start, s), max(end, e)
+
+            self.connection.executemany(
+                'DELETE FROM coverage WHERE rowid = ?',
+                [(rowid,) for rowid, s, e in overlapping]
+            )
+            self.connection.execute(
+                'INSERT INTO coverage VALUES (?, ?, ?, ?)',
+                (server, entity, start, end)
+            )
+
+    def gaps(self, server, entity, start_time, end_time):
+        """
+        Get the parts of a time range not covered by the store
+
+        Args:
+            server                   (str): Instance UUID of the vCenter server
+            entity                   (str): The moId of the entity
+            start_time (datetime.datetime): Start of the time range
+            end_time   (datetime.datetime): End of the time range
+
+        Returns:
+            A list of (start, end) tuples of the uncovered time ranges
+
+        """
+        start, end = _to_epoch(start_time), _to_epoch(end_time)
+        covered = self.connection.execute(
+            'SELECT start, end FROM coverage '
+            'WHERE server = ? AND entity = ? AND start < ? AND end > ? ORDER BY start',
+            (server, entity, end, start)
+        ).fetchall()
+
+        result = []
+        position = start
+        for s, e in covered:
+            if s > position:
+                result.append((position, s))
+            position = max(position, e)
+        if position < end:
+            result.append((position, end))
+
+        return [(_from_epoch(s), _from_epoch(e)) for s, e in result]
+
+    def query(self, server, entity, start_time, end_time, event_types=None,
+              users=None, before=None, after=None, limit=100):
+        """
+        Query the events of an entity
+
+        Pages of events are retrieved using the first or the
+        last event of the adjacent page as a starting point.
+
+        Args:
+            server                   (str): Instance UUID of the vCenter server
+            entity                   (str): The moId of the entity
+            start_time (datetime.datetime): Start of the time range
+            end_time   (datetime.datetime): End of the time range
+            event_types             (list): Event type ids to include, all if None
+            users                   (list): User names to include, all if None
+            before           (StoredEvent): Return the events preceding this event
+            after            (StoredEvent): Return the events following this event
+            limit                    (int): Maximum number of events to return
+
+        Returns:
+            A list of StoredEvent instances ordered by time. Without
+            before and after the latest events are returned.
+
+        """
+        conditions = ['l.server = ?', 'l.entity = ?', 'l.created >= ?', 'l.created <= ?']
+        params = [server, entity, _to_epoch(start_time), _to_epoch(end_time)]
+
+        if event_types:
+            conditions.append('e.type IN ({})'.format(', '.join('?' * len(event_types))))
+            params.extend(event_types)
+        if users:
+            conditions.append('e.user IN ({})'.format(', '.join('?' * len(users))))
+            params.extend(users)
+
+        if after:
+            conditions.append('(l.created, l.key) > (?, ?)')
+            params.extend([after.created, after.key])
+            order = 'ASC'
+        else:
+            if before:
+                conditions.append('(l.created, l.key) < (?, ?)')
+                params.extend([before.created, before.key])
+            order = 'DESC'
+
+        rows = self.connection.execute(
+            'SELECT e.key, e.created, e.user, e.message, e.type, e.entity_name '
+            'FROM event_entities l JOIN events e ON e.server = l.server AND e.key = l.key '
+            'WHERE {} ORDER BY l.created {order}, l.key {order} LIMIT ?'.format(' AND '.join(conditions), order=order),
+            params + [limit]
+        ).fetchall()
+
+        events = [
+            StoredEvent(
+                key=key,
+                created=created,
+                userName=user,
+                fullFormattedMessage=message,
+                eventTypeId=type_id,
+                entityName=entity_name
+            ) for key, created, user, message, type_id, entity_name in rows
+        ]
+
+        return events if order == 'ASC' else events[::-1]
+
+
+class StoredEventPager(object):
+    def __init__(self, store, server, entity, filter_spec, page_size):
+        """
+        Pages through the events in an event store
+
+        Provides the same interface as pvc.widget.event.EventPager
+        for events which are already present in the store.
+
+        Args:
+            store                     (EventStore): An EventStore instance
+            server                           (str): Instance UUID of the vCenter server
+            entity                           (str): The moId of the entity
+            filter_spec (vim.event.EventFilterSpec): Filter with the time range, event
+                                                     types and users to include
+            page_size                        (int): Number of events in a page
+
+        """
+        self.store = store
+        self.server = server
+        self.entity = entity
+        self.page_size = page_size
+        self.page = []
+        self.kwargs = {
+            'start_time': filter_spec.time.beginTime,
+            'end_time': filter_spec.time.endTime,
+            'event_types': filter_spec.eventTypeId,
+            'users': filter_spec.userName.userList if filter_spec.userName else None,
+        }
+
+    def _query(self, **kwargs):
+        kwargs.update(self.kwargs)
+
+        return self.store.query(
+            server=self.server,
+            entity=self.entity,
+            limit=self.page_size,
+            **kwargs
+        )
+
+    def latest(self):
+        self.page = self._query()
+
+        return bool(self.page)
+
+    def older(self):
+        events = self._query(before=self.page[0]) if self.page else []
+        if not events:
+            return False
+
+        self.page = events
+
+        return True
+
+    def newer(self):
+        events = self._query(after=self.page[-1]) if self.page else []
+        if not events:
+            return False
+
+        self.page = events
+
+        return True
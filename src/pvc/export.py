@@ -0,0 +1,221 @@
+# Copyright (c) 2015 Marin Atanasov Nikolov <dnaeon@gmail.com>
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions
+# are met:
+# 1. Redistributions of source code must retain the above copyright
+#    notice, this list of conditions and the following disclaimer
+#    in this position and unchanged.
+# 2. Redistributions in binary form must reproduce the above copyright
+#    notice, this list of conditions and the following disclaimer in the
+#    documentation and/or other materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE AUTHOR(S) ``AS IS'' AND ANY EXPRESS OR
+# IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED WARRANTIES
+# OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE DISCLAIMED.
+# IN NO EVENT SHALL THE AUTHOR(S) BE LIABLE FOR ANY DIRECT, INDIRECT,
+# INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT
+# NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE,
+# DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY
+# THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF
+# THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+"""
+Performance Export module
+
+Writes performance samples to columnar files for offline analysis.
+
+Samples are written to Parquet files if pyarrow is installed or to
+NumPy .npz archives otherwise. In both cases samples are written in
+row groups as they are retrieved, so exports of any size can be
+written without keeping all samples in memory.
+
+The layout of .npz archives is as follows:
+
+* ``metrics`` - an array of shape (N, 2) holding the counter name
+  and instance of each metric in the archive
+* ``timestamp_<n>`` - UNIX timestamps of the samples in row group n
+* ``metric_<n>`` - index in ``metrics`` of the samples in row group n
+* ``value_<n>`` - values of the samples in row group n
+
+Row groups are numbered from zero, using six digits, e.g. value_000000.
+
+"""
+
+import zipfile
+
+import numpy
+
+try:
+    import pyarrow
+    import pyarrow.parquet
+except ImportError:
+    pyarrow = None
+
+__all__ = [
+    'default_extension', 'sample_writer', 'NpzSampleWriter',
+    'ParquetSampleWriter',
+]
+
+
+def default_extension():
+    """
+    Get the file extension of the preferred export format
+
+    Returns:
+        '.parquet' if pyarrow is installed, '.npz' otherwise
+
+    """
+    return '.parquet' if pyarrow is not None else '.npz'
+
+
+def sample_writer(path):
+    """
+    Create a sample writer for a path based on its extension
+
+    Args:
+        path (str): Path to the output file, ending in .parquet or .npz
+
+    Returns:
+        A ParquetSampleWriter or NpzSampleWriter instance
+
+    Raises:
+        ValueError: If the extension is not supported
+
+    """
+    if path.endswith('.parquet'):
+        return ParquetSampleWriter(path)
+    elif path.endswith('.npz'):
+        return NpzSampleWriter(path)
+
+    raise ValueError('Unsupported export format: {}'.format(path))
+
+
+def _columns(series):
+    """
+    Concatenate series to columns
+
+    Args:
+        series (dict): A dict mapping (counter, instance) tuples to
+                       a tuple of the timestamps and values of a metric
+
+    Returns:
+        A tuple of the metrics, the lengths of their series and
+        the concatenated timestamps and values of all series
+
+    """
+    metrics = list(series.keys())
+    lengths = [len(series[m][0]) for m in metrics]
+    if not metrics:
+        return metrics, lengths, numpy.empty(0, dtype=numpy.int64), numpy.empty(0)
+
+    timestamps = numpy.concatenate([numpy.asarray(series[m][0], dtype=numpy.int64) for m in metrics])
+    values = numpy.concatenate([numpy.asarray(series[m][1], dtype=numpy.float64) for m in metrics])
+
+    return metrics, lengths, timestamps, values
+
+
+class NpzSampleWriter(object):
+    def __init__(self, path):
+        """
+        Writes performance samples to a NumPy .npz archive
+
+        Each call to write() adds a row group to the archive. The
+        layout of the archive is described in the module docstring.
+
+        Args:
+            path (str): Path to the output file
+
+        """
+        self.zipfile = zipfile.ZipFile(path, mode='w', compression=zipfile.ZIP_DEFLATED, allowZip64=True)
+        self.metrics = {}
+        self.row_groups = 0
+
+    def _write_array(self, name, array):
+        with self.zipfile.open('{}.npy'.format(name), mode='w', force_zip64=True) as f:
+            numpy.lib.format.write_array(f, numpy.asarray(array), allow_pickle=False)
+
+    def write(self, series):
+        """
+        Write a row group of samples
+
+        Args:
+            series (dict): A dict mapping (counter, instance) tuples to
+                           a tuple of the timestamps and values of a metric
+
+        """
+        metrics, lengths, timestamps, values = _columns(series)
+        if not len(timestamps):
+            return
+
+        index = [self.metrics.setdefault(m, len(self.metrics)) for m in metrics]
+        suffix = '{:06d}'.format(self.row_groups)
+        self._write_array('timestamp_' + suffix, timestamps)
+        self._write_array('metric_' + suffix, numpy.repeat(numpy.asarray(index, dtype=numpy.int32), lengths))
+        self._write_array('value_' + suffix, values)
+        self.row_groups += 1
+
+    def close(self):
+        metrics = sorted(self.metrics, key=self.metrics.get)
+        self._write_array('metrics', numpy.array(metrics, dtype=str).reshape(len(metrics), 2))
+        self.zipfile.close()
+
+
+class ParquetSampleWriter(object):
+    def __init__(self, path):
+        """
+        Writes performance samples to a Parquet file
+
+        Each call to write() adds a row group to the file, with
+        the timestamp, counter, instance and value columns.
+
+        Args:
+            path (str): Path to the output file
+
+        Raises:
+            ValueError: If pyarrow is not installed
+
+        """
+        if pyarrow is None:
+            raise ValueError('Writing Parquet files requires pyarrow')
+
+        self.schema = pyarrow.schema([
+            ('timestamp', pyarrow.timestamp('s', tz='UTC')),
+            ('counter', pyarrow.string()),
+            ('instance', pyarrow.string()),
+            ('value', pyarrow.float64()),
+        ])
+        self.writer = pyarrow.parquet.ParquetWriter(path, self.schema, compression='zstd')
+
+    def write(self, series):
+        """
+        Write a row group of samples
+
+        Args:
+            series (dict): A dict mapping (counter, instance) tuples to
+                           a tuple of the timestamps and values of a metric
+
+        """
+        metrics, lengths, timestamps, values = _columns(series)
+        if not len(timestamps):
+            return
+
+        # Repeated strings are dictionary encoded in the file
+        # and missing samples (NaN) are written as nulls
+        counters = numpy.repeat([m[0] for m in metrics], lengths)
+        instances = numpy.repeat([m[1] for m in metrics], lengths)
+        table = pyarrow.Table.from_arrays(
+            [
+                pyarrow.array(timestamps, type=pyarrow.timestamp('s', tz='UTC')),
+                pyarrow.array(counters, type=pyarrow.string()),
+                pyarrow.array(instances, type=pyarrow.string()),
+                pyarrow.array(values, type=pyarrow.float64(), from_pandas=True),
+            ],
+            schema=self.schema
+        )
+        self.writer.write_table(table)
+
+    def close(self):
+        self.writer.close()
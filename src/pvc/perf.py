@@ -0,0 +1,532 @@
+# Copyright (c) 2015 Marin Atanasov Nikolov <dnaeon@gmail.com>
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions
+# are met:
+# 1. Redistributions of source code must retain the above copyright
+#    notice, this list of conditions and the following disclaimer
+#    in this position and unchanged.
+# 2. Redistributions in binary form must reproduce the above copyright
+#    notice, this list of conditions and the following disclaimer in the
+#    documentation and/or other materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE AUTHOR(S) ``AS IS'' AND ANY EXPRESS OR
+# IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED WARRANTIES
+# OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE DISCLAIMED.
+# IN NO EVENT SHALL THE AUTHOR(S) BE LIABLE FOR ANY DIRECT, INDIRECT,
+# INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT
+# NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE,
+# DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY
+# THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF
+# THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+"""
+Performance Metrics module
+
+Helpers for retrieving performance samples from the
+vSphere Performance Manager.
+
+"""
+
+import logging
+import calendar
+import datetime
+import collections
+
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy
+import pyVmomi
+
+__all__ = [
+    'metric_key', 'counter_names', 'unit_scale', 'entity_metric_samples',
+    'sample_arrays', 'query_perf_parallel', 'query_historical_samples',
+    'RealtimePoller', 'QueryPlanner',
+]
+
+logger = logging.getLogger(__name__)
+
+
+def metric_key(metric_id):
+    """
+    Get a hashable key identifying a metric
+
+    Args:
+        metric_id (vim.PerformanceManager.MetricId): A MetricId instance
+
+    Returns:
+        A tuple of the counter id and instance of the metric
+
+    """
+    return (metric_id.counterId, metric_id.instance)
+
+
+def counter_names(pm):
+    """
+    Get the performance counters by their names
+
+    Args:
+        pm (vim.PerformanceManager): A PerformanceManager instance
+
+    Returns:
+        A dict mapping counter names in the form of
+        <group>.<name>.<rollup>, e.g. cpu.usage.average,
+        to vim.PerformanceManager.CounterInfo instances
+
+    """
+    return {
+        '{}.{}.{}'.format(c.groupInfo.key, c.nameInfo.key, c.rollupType): c
+        for c in pm.perfCounter
+    }
+
+
+def unit_scale(counter):
+    """
+    Get the factor converting raw sample values of a counter to its unit
+
+    Values of counters measured in percent are returned
+    by the server in 1/100th of the percent.
+
+    Args:
+        counter (vim.PerformanceManager.CounterInfo): A CounterInfo instance
+
+    Returns:
+        The factor by which raw sample values are multiplied
+
+    """
+    return 0.01 if counter.unitInfo.key == 'percent' else 1.0
+
+
+def entity_metric_samples(data):
+    """
+    Convert the result of a QueryPerf() call to samples
+
+    Args:
+        data (vim.PerformanceManager.EntityMetric): The samples to be converted
+
+    Returns:
+        An ordered dict mapping metric keys to a list of
+        (timestamp, value) tuples, ordered by timestamp
+
+    """
+    result = collections.OrderedDict()
+    if not data:
+        return result
+
+    timestamps = [s.timestamp for s in data.sampleInfo]
+    for series in data.value:
+        samples = result.setdefault(metric_key(series.id), [])
+        samples.extend(zip(timestamps, series.value))
+
+    return result
+
+
+def sample_arrays(samples, counters):
+    """
+    Convert samples to arrays scaled to the units of their counters
+
+    The samples of all metrics are scaled in a single vectorized
+    pass, regardless of how many metrics and units are involved.
+    Missing samples, reported by the server as -1, become NaN.
+
+    Args:
+        samples  (dict): A dict mapping metric keys to a list of
+                         (timestamp, value) tuples
+        counters (dict): A dict mapping counter ids to
+                         vim.PerformanceManager.CounterInfo instances
+
+    Returns:
+        An ordered dict mapping metric keys to a tuple of two numpy
+        arrays - the UNIX timestamps and the scaled sample values
+
+    """
+    keys = list(samples.keys())
+    lengths = [len(samples[key]) for key in keys]
+    total = sum(lengths)
+
+    timestamps = numpy.fromiter(
+        (calendar.timegm(t.utctimetuple()) for key in keys for t, v in samples[key]),
+        dtype=numpy.int64,
+        count=total
+    )
+    values = numpy.fromiter(
+        (v for key in keys for t, v in samples[key]),
+        dtype=numpy.float64,
+        count=total
+    )
+    scale = numpy.repeat(
+        [unit_scale(counters[key[0]]) if key[0] in counters else 1.0 for key in keys],
+        lengths
+    )
+    values = numpy.where(values == -1, numpy.nan, values * scale)
+
+    splits = numpy.cumsum(lengths)[:-1]
+
+    return collections.OrderedDict(
+        zip(keys, zip(numpy.split(timestamps, splits), numpy.split(values, splits)))
+    )
+
+
+def query_perf_parallel(pm, batches, max_workers=4, errors=None):
+    """
+    Execute batches of performance queries concurrently
+
+    Each batch is sent to the server using a separate QueryPerf()
+    call, with no more than 'max_workers' calls in flight.
+
+    A batch which fails is logged and skipped, so that a fault
+    in one batch does not discard the samples of the others.
+
+    Args:
+        pm (vim.PerformanceManager): A PerformanceManager instance
+        batches              (list): A list of lists of vim.PerformanceManager.QuerySpec
+                                     instances, e.g. as returned by QueryPlanner.plan()
+        max_workers           (int): Maximum number of concurrent QueryPerf() calls
+        errors               (list): If not None, a (batch, exception) tuple
+                                     is appended to it for each failed batch
+
+    Returns:
+        An ordered dict mapping the moId of each entity to an
+        ordered dict of metric keys and (timestamp, value) tuples.
+        Samples are merged in the order of the batches.
+
+    """
+    result = collections.OrderedDict()
+    if not batches:
+        return result
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = [executor.submit(pm.QueryPerf, querySpec=b) for b in batches]
+        for batch, future in zip(batches, futures):
+            try:
+                response = future.result()
+            except Exception as e:
+                msg = e.msg if isinstance(e, pyVmomi.vmodl.MethodFault) else e
+                logger.warning('Performance query of %d specs failed: %s', len(batch), msg)
+                if errors is not None:
+                    errors.append((batch, e))
+                continue
+
+            for data in response:
+                entity_samples = result.setdefault(data.entity._moId, collections.OrderedDict())
+                for key, samples in entity_metric_samples(data).items():
+                    entity_samples.setdefault(key, []).extend(samples)
+
+    return result
+
+
+def query_historical_samples(pm, entity, metric_id, interval_id, start_time,
+                             end_time, cache=None, cache_id=None, max_workers=4,
+                             errors=None):
+    """
+    Retrieve historical samples of an entity for a time range
+
+    When a cache is provided only the samples newer than the ones
+    already present in the cache are retrieved from the server,
+    and the cache is updated with the newly retrieved samples.
+
+    Args:
+        pm        (vim.PerformanceManager): A PerformanceManager instance
+        entity         (vim.ManagedEntity): A managed entity
+        metric_id                   (list): A list of vim.PerformanceManager.MetricId instances
+        interval_id                  (int): Sampling period of the historical interval
+        start_time     (datetime.datetime): Start of the time range
+        end_time       (datetime.datetime): End of the time range
+        cache (pvc.cache.PerformanceCache): A PerformanceCache instance
+        cache_id                     (str): Identifier of the server, e.g. the vCenter instance UUID
+        max_workers                  (int): Maximum number of concurrent QueryPerf() calls
+        errors                      (list): If not None, a (batch, exception) tuple
+                                            is appended to it for each failed batch
+
+    Returns:
+        An ordered dict mapping metric keys to a list of
+        (timestamp, value) tuples
+
+    """
+    planner = QueryPlanner(interval_id=interval_id)
+    moid = entity._moId
+
+    # Group the metrics by the time from which they need to
+    # be retrieved, depending on what is already in the cache
+    cached = {}
+    groups = collections.OrderedDict()
+    for m in metric_id:
+        key = metric_key(m)
+        entry = cache.load(cache_id, moid, key, interval_id) if cache else None
+        if entry and entry[0] <= start_time:
+            cached[key] = entry
+            fetch_from = entry[1]
+        else:
+            fetch_from = start_time
+        groups.setdefault(fetch_from, []).append(m)
+
+    batches = []
+    for fetch_from, metrics in groups.items():
+        if fetch_from < end_time:
+            batches.extend(planner.plan([entity], metrics, fetch_from, end_time))
+
+    failed = []
+    fetched = query_perf_parallel(pm, batches, max_workers, failed).get(moid, {})
+    if errors is not None:
+        errors.extend(failed)
+
+    result = collections.OrderedDict()
+    for m in metric_id:
+        key = metric_key(m)
+        cache_start, cache_end, samples = cached.get(key, (start_time, start_time, []))
+        samples = samples + [s for s in fetched.get(key, []) if s[0] > cache_end]
+
+        # Samples of failed batches are missing, so do not record
+        # the range as covered, otherwise the gap is never refetched
+        if cache and samples and not failed:
+            # Only the range up to the last sample is considered covered,
+            # as samples for the most recent period may not be rolled up yet
+            cache.store(cache_id, moid, key, interval_id, cache_start, samples[-1][0], samples)
+
+        result[key] = [s for s in samples if start_time < s[0] <= end_time]
+
+    if cache:
+        cache.evict()
+
+    return result
+
+
+class QueryPlanner(object):
+    def __init__(self, interval_id, max_samples=2880, max_metrics=64, max_specs=16):
+        """
+        Planner for performance queries over long time ranges
+
+        Splits a time range into windows and the requested
+        entities and metrics into batches, so that no single
+        QueryPerf() call returns an excessive amount of data.
+
+        The number of metrics is limited across all query specs
+        of a batch, i.e. entities times metrics, which is what
+        vCenter Server limits for historical intervals using the
+        config.vpxd.stats.maxQueryMetrics setting (64 by default).
+
+        Args:
+            interval_id (int): Sampling period of the queried interval in seconds
+            max_samples (int): Maximum number of samples per metric in a window
+            max_metrics (int): Maximum number of metrics in a single batch
+            max_specs   (int): Maximum number of query specs in a single batch
+
+        """
+        self.interval_id = interval_id
+        self.max_samples = max_samples
+        self.max_metrics = max_metrics
+        self.max_specs = max_specs
+
+    def windows(self, start_time, end_time):
+        """
+        Split a time range into windows
+
+        The start time of each window is exclusive and the end
+        time is inclusive, which matches the semantics of the
+        startTime and endTime properties of a query spec, so
+        that adjacent windows never return the same sample.
+
+        Args:
+            start_time (datetime.datetime): Start of the time range
+            end_time   (datetime.datetime): End of the time range
+
+        Returns:
+            A list of (start, end) tuples in chronological order
+
+        """
+        size = datetime.timedelta(seconds=self.interval_id * self.max_samples)
+        result = []
+        start = start_time
+        while start < end_time:
+            end = min(start + size, end_time)
+            result.append((start, end))
+            start = end
+
+        return result
+
+    def plan(self, entities, metric_id, start_time, end_time):
+        """
+        Plan the queries needed to retrieve a time range
+
+        Args:
+            entities                (list): A list of managed entities
+            metric_id               (list): A list of vim.PerformanceManager.MetricId
+                                            instances to retrieve for each entity
+            start_time (datetime.datetime): Start of the time range
+            end_time   (datetime.datetime): End of the time range
+
+        Returns:
+            A list of batches, each one being a list of
+            vim.PerformanceManager.QuerySpec instances.
+            Batches are ordered chronologically.
+
+        """
+        metric_chunks = [
+            metric_id[i:i + self.max_metrics]
+            for i in range(0, len(metric_id), self.max_metrics)
+        ]
+
+        batches = []
+        for start, end in self.windows(start_time, end_time):
+            batch = []
+            num_metrics = 0
+            for entity in entities:
+                for chunk in metric_chunks:
+                    if batch and (len(batch) >= self.max_specs or
+                                  num_metrics + len(chunk) > self.max_metrics):
+                        batches.append(batch)
+                        batch = []
+                        num_metrics = 0
+
+                    batch.append(pyVmomi.vim.PerformanceManager.QuerySpec(
+                        entity=entity,
+                        metricId=chunk,
+                        intervalId=self.interval_id,
+                        startTime=start,
+                        endTime=end
+                    ))
+                    num_metrics += len(chunk)
+            if batch:
+                batches.append(batch)
+
+        return batches
+
+
+class RealtimePoller(object):
+    def __init__(self, pm, entity, metric_id, interval_id, start_time=None, single_spec=False):
+        """
+        Incremental poller for real-time performance samples
+
+        The poller remembers the timestamp of the last sample
+        received for each metric and asks for samples newer than
+        that timestamp only. This way each poll returns exactly
+        the samples which were not seen yet, regardless of how
+        much time has passed since the previous poll.
+
+        Args:
+            pm     (vim.PerformanceManager): A PerformanceManager instance
+            entity      (vim.ManagedEntity): A managed entity
+            metric_id                (list): A list of vim.PerformanceManager.MetricId instances
+            interval_id               (int): The real-time refresh rate of the provider
+            start_time  (datetime.datetime): Time from which to start collecting samples.
+                                             If None the first poll returns only the
+                                             latest sample of each metric
+            single_spec              (bool): If True always query all metrics using a
+                                             single query spec, starting from the
+                                             oldest last sample of the metrics
+
+        """
+        self.pm = pm
+        self.entity = entity
+        self.metric_id = metric_id
+        self.interval_id = interval_id
+        self.start_time = start_time
+        self.single_spec = single_spec
+        self.last_sample_time = {}
+
+    def query_specs(self):
+        """
+        Build the query specs for the next poll
+
+        Metrics are grouped by the timestamp of their last
+        sample, so that metrics which are in sync with each other
+        share the same query spec.
+
+        Returns:
+            A list of vim.PerformanceManager.QuerySpec instances
+
+        """
+        groups = collections.OrderedDict()
+        for m in self.metric_id:
+            start_time = self.last_sample_time.get(metric_key(m), self.start_time)
+            groups.setdefault(start_time, []).append(m)
+
+        if self.single_spec and len(groups) > 1:
+            # Samples of metrics which are ahead of the oldest one
+            # are returned again, but are dropped by update()
+            known = [t for t in groups if t is not None]
+            groups = {min(known) if known else None: list(self.metric_id)}
+
+        specs = []
+        for start_time, metric_id in groups.items():
+            if start_time is None:
+                spec = pyVmomi.vim.PerformanceManager.QuerySpec(
+                    maxSample=1,
+                    entity=self.entity,
+                    metricId=metric_id,
+                    intervalId=self.interval_id
+                )
+            else:
+                spec = pyVmomi.vim.PerformanceManager.QuerySpec(
+                    entity=self.entity,
+                    metricId=metric_id,
+                    intervalId=self.interval_id,
+                    startTime=start_time
+                )
+            specs.append(spec)
+
+        return specs
+
+    def update(self, result):
+        """
+        Process the result of querying the specs from query_specs()
+
+        This allows the specs of several pollers to be sent
+        to the server using a single QueryPerf() call. Samples
+        of entities other than the one of this poller are ignored.
+
+        Args:
+            result (list): A list of vim.PerformanceManager.EntityMetric instances
+
+        Returns:
+            An ordered dict mapping metric keys to a list of new
+            (timestamp, value) tuples, ordered by timestamp
+
+        """
+        new = collections.OrderedDict(
+            (metric_key(m), []) for m in self.metric_id
+        )
+
+        for data in result:
+            # Skip entities of other pollers sharing the same QueryPerf() call
+            if data.entity._moId != self.entity._moId:
+                continue
+
+            for key, samples in entity_metric_samples(data).items():
+                if key not in new:
+                    continue
+
+                last = self.last_sample_time.get(key)
+                seen = set()
+                new_samples = []
+                for timestamp, value in samples:
+                    # The start time of a query is exclusive, but be
+                    # safe and drop any samples we have already seen
+                    if (last is not None and timestamp <= last) or timestamp in seen:
+                        continue
+                    seen.add(timestamp)
+                    new_samples.append((timestamp, value))
+
+                if not new_samples:
+                    continue
+
+                new_samples.sort(key=lambda s: s[0])
+                new.setdefault(key, []).extend(new_samples)
+                self.last_sample_time[key] = new_samples[-1][0]
+
+        return new
+
+    def poll(self):
+        """
+        Retrieve the samples collected since the last poll
+
+        All metrics are retrieved using a single QueryPerf() call.
+
+        Returns:
+            An ordered dict mapping metric keys to a list of new
+            (timestamp, value) tuples, ordered by timestamp
+
+        """
+        return self.update(self.pm.QueryPerf(querySpec=self.query_specs()))
@@ -0,0 +1,275 @@
+# Copyright (c) 2015 Marin Atanasov Nikolov <dnaeon@gmail.com>
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions
+# are met:
+# 1. Redistributions of source code must retain the above copyright
+#    notice, this list of conditions and the following disclaimer
+#    in this position and unchanged.
+# 2. Redistributions in binary form must reproduce the above copyright
+#    notice, this list of conditions and the following disclaimer in the
+#    documentation and/or other materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE AUTHOR(S) ``AS IS'' AND ANY EXPRESS OR
+# IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED WARRANTIES
+# OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE DISCLAIMED.
+# IN NO EVENT SHALL THE AUTHOR(S) BE LIABLE FOR ANY DIRECT, INDIRECT,
+# INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT
+# NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE,
+# DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY
+# THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF
+# THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+"""
+Placement module
+
+Ranking of the hosts of a cluster as migration targets of a
+Virtual Machine.
+
+"""
+
+import time
+
+from concurrent.futures import ThreadPoolExecutor
+
+import pyVmomi
+
+__all__ = ['check_messages', 'Placement', 'PlacementAdvisor']
+
+
+def check_messages(results):
+    """
+    Get the warning and error messages of compatibility checks
+
+    Args:
+        results (list): A list of vim.vm.check.Result instances
+
+    Returns:
+        A tuple of the warning and error messages, each of them
+        a list of messages followed by their indented details
+
+    """
+    warnings = []
+    errors = []
+    for r in results or []:
+        for messages, faults in ((warnings, r.warning), (errors, r.error)):
+            for f in faults or []:
+                messages.append(f.msg)
+                messages.extend(['    {}'.format(m.message) for m in f.faultMessage])
+
+    return warnings, errors
+
+
+class Placement(object):
+    def __init__(self, host, name, cpu_free, memory_free):
+        """
+        A candidate host for a Virtual Machine
+
+        Args:
+            host   (vim.HostSystem): The candidate host
+            name              (str): Name of the host
+            cpu_free        (float): Fraction of the host CPU capacity
+                                     left after placing the Virtual Machine
+            memory_free     (float): Fraction of the host memory left
+                                     after placing the Virtual Machine
+
+        """
+        self.host = host
+        self.name = name
+        self.cpu_free = cpu_free
+        self.memory_free = memory_free
+        self.warnings = []
+        self.errors = []
+
+    @property
+    def valid(self):
+        return not self.errors
+
+    @property
+    def score(self):
+        """
+        Score of the host, the headroom of the scarcer resource
+
+        """
+        return min(self.cpu_free, self.memory_free)
+
+
+class PlacementAdvisor(object):
+    # Seconds between checks of the running compatibility checks
+    INTERVAL = 0.5
+
+    def __init__(self, agent, vm, cluster, max_workers=8, timeout=120):
+        """
+        Placement Advisor
+
+        Runs the migration compatibility checks of a Virtual Machine
+        against all candidate hosts of a cluster concurrently, and
+        ranks the hosts on which the migration would succeed by the
+        CPU and memory headroom left after the migration.
+
+        The CPU and memory usage of all hosts is retrieved using a
+        single property collection, and the state of all running
+        checks using a single property collector call on each check.
+
+        Args:
+            agent                  (VConnector): A VConnector instance
+            vm             (vim.VirtualMachine): The Virtual Machine to migrate
+            cluster (vim.ClusterComputeResource): The target cluster
+            max_workers                   (int): Maximum number of concurrent CheckMigrate_Task() calls
+            timeout                       (int): Seconds to wait for the checks to complete
+
+        """
+        self.agent = agent
+        self.vm = vm
+        self.cluster = cluster
+        self.max_workers = max_workers
+        self.timeout = timeout
+
+    def _retrieve(self, objs, obj_type, path_set):
+        """
+        Retrieve properties of managed objects using a single call
+
+        Returns:
+            A dict mapping the moId of each object to a dict of its properties
+
+        """
+        spec = pyVmomi.vmodl.query.PropertyCollector.FilterSpec(
+            objectSet=[pyVmomi.vmodl.query.PropertyCollector.ObjectSpec(obj=o) for o in objs],
+            propSet=[
+                pyVmomi.vmodl.query.PropertyCollector.PropertySpec(
+                    type=obj_type,
+                    pathSet=path_set
+                )
+            ]
+        )
+
+        result = self.agent.si.content.propertyCollector.RetrieveContents([spec])
+
+        return {
+            content.obj._moId: {prop.name: prop.val for prop in content.propSet}
+            for content in result
+        }
+
+    def candidates(self):
+        """
+        Get the candidate hosts along with their headroom
+
+        Hosts which are not connected, are in maintenance mode or
+        are the current host of the Virtual Machine are skipped.
+
+        Returns:
+            A list of Placement instances
+
+        """
+        vm = self._retrieve(
+            [self.vm],
+            pyVmomi.vim.VirtualMachine,
+            ['runtime.host', 'summary.quickStats.overallCpuUsage', 'config.hardware.memoryMB']
+        )[self.vm._moId]
+        current_host = vm.get('runtime.host')
+        vm_cpu = vm.get('summary.quickStats.overallCpuUsage') or 0
+        vm_memory = (vm.get('config.hardware.memoryMB') or 0) * 1024 * 1024
+
+        view = self.agent.get_container_view(
+            obj_type=[pyVmomi.vim.HostSystem],
+            container=self.cluster
+        )
+        properties = self.agent.collect_properties(
+            view_ref=view,
+            obj_type=pyVmomi.vim.HostSystem,
+            path_set=[
+                'name',
+                'runtime.connectionState',
+                'runtime.inMaintenanceMode',
+                'summary.hardware.cpuMhz',
+                'summary.hardware.numCpuCores',
+                'summary.hardware.memorySize',
+                'summary.quickStats.overallCpuUsage',
+                'summary.quickStats.overallMemoryUsage',
+            ],
+            include_mors=True
+        )
+        view.DestroyView()
+
+        result = []
+        for p in properties:
+            if current_host is not None and p['obj']._moId == current_host._moId:
+                continue
+            if p.get('runtime.connectionState') != pyVmomi.vim.HostSystemConnectionState.connected:
+                continue
+            if p.get('runtime.inMaintenanceMode'):
+                continue
+
+            cpu_capacity = (p.get('summary.hardware.cpuMhz') or 0) * (p.get('summary.hardware.numCpuCores') or 0)
+            cpu_used = (p.get('summary.quickStats.overallCpuUsage') or 0) + vm_cpu
+            memory_capacity = p.get('summary.hardware.memorySize') or 0
+            memory_used = (p.get('summary.quickStats.overallMemoryUsage') or 0) * 1024 * 1024 + vm_memory
+
+            result.append(
+                Placement(
+                    host=p['obj'],
+                    name=p['name'],
+                    cpu_free=1.0 - float(cpu_used) / cpu_capacity if cpu_capacity else 0.0,
+                    memory_free=1.0 - float(memory_used) / memory_capacity if memory_capacity else 0.0
+                )
+            )
+
+        return result
+
+    def rank(self):
+        """
+        Check and rank the candidate hosts
+
+        Returns:
+            A list of Placement instances, the hosts on which the
+            migration would succeed first, ordered by their score
+
+        """
+        placements = self.candidates()
+        if not placements:
+            return []
+
+        checker = self.agent.si.content.vmProvisioningChecker
+        pool = self.cluster.resourcePool
+
+        def check(placement):
+            try:
+                return checker.CheckMigrate_Task(vm=self.vm, host=placement.host, pool=pool)
+            except pyVmomi.vmodl.MethodFault as e:
+                placement.errors.append(e.msg)
+                return None
+
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            tasks = list(executor.map(check, placements))
+
+        running = {t._moId: (t, p) for t, p in zip(tasks, placements) if t is not None}
+        deadline = time.monotonic() + self.timeout
+        while running:
+            states = self._retrieve(
+                [t for t, p in running.values()],
+                pyVmomi.vim.Task,
+                ['info.state', 'info.result', 'info.error']
+            )
+            for moid, info in states.items():
+                state = info.get('info.state')
+                task, placement = running[moid]
+                if state == pyVmomi.vim.TaskInfoState.success:
+                    placement.warnings, placement.errors = check_messages(info.get('info.result'))
+                elif state == pyVmomi.vim.TaskInfoState.error:
+                    error = info.get('info.error')
+                    placement.errors.append(error.msg if error else 'Compatibility check failed')
+                else:
+                    continue
+                del running[moid]
+
+            if running and time.monotonic() > deadline:
+                for task, placement in running.values():
+                    placement.errors.append('Compatibility check timed out')
+                break
+
+            if running:
+                time.sleep(self.INTERVAL)
+
+        return sorted(placements, key=lambda p: (not p.valid, -p.score, len(p.warnings), p.name))
@@ -0,0 +1,323 @@
+# Copyright (c) 2015 Marin Atanasov Nikolov <dnaeon@gmail.com>
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions
+# are met:
+# 1. Redistributions of source code must retain the above copyright
+#    notice, this list of conditions and the following disclaimer
+#    in this position and unchanged.
+# 2. Redistributions in binary form must reproduce the above copyright
+#    notice, this list of conditions and the following disclaimer in the
+#    documentation and/or other materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE AUTHOR(S) ``AS IS'' AND ANY EXPRESS OR
+# IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED WARRANTIES
+# OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE DISCLAIMED.
+# IN NO EVENT SHALL THE AUTHOR(S) BE LIABLE FOR ANY DIRECT, INDIRECT,
+# INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT
+# NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE,
+# DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY
+# THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF
+# THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+"""
+Performance Report module
+
+Summary statistics of the performance of all hosts and
+Virtual Machines within a cluster or datacenter.
+
+"""
+
+import csv
+import html
+import logging
+import datetime
+import collections
+
+import pyVmomi
+
+import pvc.perf
+import pvc.stats
+
+__all__ = [
+    'CONTAINER_TYPES', 'DEFAULT_COUNTERS', 'find_container',
+    'CsvReportWriter', 'HtmlReportWriter', 'PerformanceReport',
+]
+
+logger = logging.getLogger(__name__)
+
+# Entity types for which a report may be generated
+CONTAINER_TYPES = collections.OrderedDict([
+    ('cluster', pyVmomi.vim.ClusterComputeResource),
+    ('datacenter', pyVmomi.vim.Datacenter),
+])
+
+# Counters included in a report unless specified otherwise
+DEFAULT_COUNTERS = [
+    'cpu.usage.average',
+    'cpu.ready.summation',
+    'mem.usage.average',
+    'mem.active.average',
+    'disk.maxTotalLatency.latest',
+    'net.usage.average',
+]
+
+
+def find_container(agent, name):
+    """
+    Find a cluster or datacenter by name
+
+    Args:
+        agent (VConnector): A VConnector instance
+        name         (str): The entity specified as <type>:<name>,
+                            e.g. cluster:prod01
+
+    Returns:
+        The managed entity
+
+    Raises:
+        ValueError: If the entity type is unknown or the entity was not found
+
+    """
+    entity_type, _, entity_name = name.partition(':')
+    if entity_type not in CONTAINER_TYPES:
+        raise ValueError('Unknown entity type: {}'.format(entity_type))
+
+    view = agent.get_container_view(obj_type=[CONTAINER_TYPES[entity_type]])
+    properties = agent.collect_properties(
+        view_ref=view,
+        obj_type=CONTAINER_TYPES[entity_type],
+        path_set=['name'],
+        include_mors=True
+    )
+    view.DestroyView()
+
+    for p in properties:
+        if p['name'] == entity_name:
+            return p['obj']
+
+    raise ValueError('Entity not found: {}'.format(name))
+
+
+class CsvReportWriter(object):
+    columns = [
+        'entity', 'type', 'counter', 'unit', 'count',
+        'min', 'avg', 'p50', 'p95', 'p99', 'max',
+    ]
+
+    def __init__(self, path, title='', columns=None):
+        """
+        Writes the rows of a report as CSV
+
+        Args:
+            path     (str): Path to the output file
+            title    (str): Title of the report
+            columns (list): Columns of the report, the columns of
+                            a performance report if None
+
+        """
+        if columns:
+            self.columns = columns
+        self.file = open(path, 'w', newline='')
+        self.writer = csv.writer(self.file)
+        self.writer.writerow(self.columns)
+
+    def format(self, value):
+        """
+        Format a single value of a row
+
+        """
+        if isinstance(value, float):
+            return '' if value != value else '{:.2f}'.format(value)
+
+        return str(value)
+
+    def write(self, row):
+        """
+        Write a row of the report
+
+        Args:
+            row (dict): A dict mapping column names to values
+
+        """
+        self.writer.writerow([self.format(row[c]) for c in self.columns])
+
+    def close(self):
+        self.file.close()
+
+
+class HtmlReportWriter(CsvReportWriter):
+    def __init__(self, path, title='', columns=None):
+        """
+        Writes the rows of a report as a HTML table
+
+        Rows are written as they are produced, so the
+        report is never kept in memory as a whole.
+
+        Args:
+            path     (str): Path to the output file
+            title    (str): Title of the report
+            columns (list): Columns of the report, the columns of
+                            a performance report if None
+
+        """
+        if columns:
+            self.columns = columns
+        self.file = open(path, 'w')
+        self.file.write(
+            '<!DOCTYPE html>\n<html>\n<head>\n<meta charset="utf-8">\n'
+            '<title>{title}</title>\n'
+            '<style>\n'
+            'table {{ border-collapse: collapse; font-family: sans-serif; font-size: 13px; }}\n'
+            'th, td {{ border: 1px solid #ccc; padding: 2px 6px; }}\n'
+            'td.num {{ text-align: right; }}\n'
+            '</style>\n</head>\n<body>\n<h1>{title}</h1>\n<table>\n<tr>{header}</tr>\n'.format(
+                title=html.escape(title),
+                header=''.join('<th>{}</th>'.format(c) for c in self.columns)
+            )
+        )
+
+    def write(self, row):
+        """
+        Write a row of the report
+
+        Args:
+            row (dict): A dict mapping column names to values
+
+        """
+        cells = [
+            '<td class="num">{}</td>'.format(self.format(row[c]))
+            if isinstance(row[c], (int, float)) else
+            '<td>{}</td>'.format(html.escape(self.format(row[c])))
+            for c in self.columns
+        ]
+        self.file.write('<tr>{}</tr>\n'.format(''.join(cells)))
+
+    def close(self):
+        self.file.write('</table>\n</body>\n</html>\n')
+        self.file.close()
+
+
+class PerformanceReport(object):
+    def __init__(self, agent, container, counters, interval, max_workers=4, chunk_size=32):
+        """
+        Performance Report
+
+        Summarizes the historical performance of all hosts and
+        Virtual Machines within a cluster or datacenter.
+
+        Entities are processed in chunks - the samples of a chunk
+        are retrieved using concurrent QueryPerf() calls, reduced to
+        summary statistics and discarded before the next chunk is
+        processed, so that memory usage does not grow with the
+        size of the inventory.
+
+        Args:
+            agent                 (VConnector): A VConnector instance
+            container      (vim.ManagedEntity): A ClusterComputeResource or Datacenter
+            counters                    (list): Counters to include in the report, specified
+                                                as <group>.<name>.<rollup>
+            interval  (vim.HistoricalInterval): The historical interval to summarize
+            max_workers                  (int): Maximum number of concurrent QueryPerf() calls
+            chunk_size                   (int): Number of entities processed at a time
+
+        """
+        self.agent = agent
+        self.container = container
+        self.counters = counters
+        self.interval = interval
+        self.max_workers = max_workers
+        self.chunk_size = chunk_size
+        self.pm = self.agent.si.content.perfManager
+
+    def members(self):
+        """
+        Get the hosts and Virtual Machines within the container
+
+        Returns:
+            A list of (type, name, entity) tuples
+
+        """
+        obj_types = (
+            ('Host', pyVmomi.vim.HostSystem),
+            ('VM', pyVmomi.vim.VirtualMachine),
+        )
+
+        result = []
+        for label, obj_type in obj_types:
+            view = self.agent.get_container_view(obj_type=[obj_type], container=self.container)
+            properties = self.agent.collect_properties(
+                view_ref=view,
+                obj_type=obj_type,
+                path_set=['name'],
+                include_mors=True
+            )
+            view.DestroyView()
+            result.extend(sorted((label, p['name'], p['obj']) for p in properties))
+
+        return result
+
+    def rows(self):
+        """
+        Generate the rows of the report
+
+        Yields:
+            A dict per entity and counter with the summary
+            statistics of the counter for the entity
+
+        Raises:
+            ValueError: If any of the counters is unknown
+
+        """
+        names = pvc.perf.counter_names(self.pm)
+        unknown = [c for c in self.counters if c not in names]
+        if unknown:
+            raise ValueError('Unknown counters: {}'.format(', '.join(unknown)))
+
+        counters = [names[c] for c in self.counters]
+        counter_by_key = {c.key: c for c in counters}
+        metric_id = [
+            pyVmomi.vim.PerformanceManager.MetricId(counterId=c.key, instance='')
+            for c in counters
+        ]
+
+        end_time = self.agent.si.CurrentTime()
+        start_time = end_time - datetime.timedelta(seconds=self.interval.length)
+        planner = pvc.perf.QueryPlanner(interval_id=self.interval.samplingPeriod)
+
+        members = self.members()
+        for i in range(0, len(members), self.chunk_size):
+            chunk = members[i:i + self.chunk_size]
+            batches = planner.plan([m[2] for m in chunk], metric_id, start_time, end_time)
+            errors = []
+            result = pvc.perf.query_perf_parallel(self.pm, batches, self.max_workers, errors)
+            if errors:
+                logger.warning('Statistics of %d entities may be incomplete', len(chunk))
+
+            for entity_type, name, entity in chunk:
+                series = pvc.perf.sample_arrays(result.pop(entity._moId, {}), counter_by_key)
+                for counter_name, counter in zip(self.counters, counters):
+                    timestamps, values = series.get((counter.key, ''), ([], []))
+                    row = collections.OrderedDict([
+                        ('entity', name),
+                        ('type', entity_type),
+                        ('counter', counter_name),
+                        ('unit', counter.unitInfo.label),
+                    ])
+                    row.update(pvc.stats.summary(values))
+                    yield row
+
+            logger.info('Processed %d of %d entities', i + len(chunk), len(members))
+
+    def write(self, writer):
+        """
+        Generate the report
+
+        Args:
+            writer (object): A report writer, e.g. a CsvReportWriter instance
+
+        """
+        for row in self.rows():
+            writer.write(row)
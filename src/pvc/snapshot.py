@@ -0,0 +1,664 @@
+# Copyright (c) 2015 Marin Atanasov Nikolov <dnaeon@gmail.com>
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions
+# are met:
+# 1. Redistributions of source code must retain the above copyright
+#    notice, this list of conditions and the following disclaimer
+#    in this position and unchanged.
+# 2. Redistributions in binary form must reproduce the above copyright
+#    notice, this list of conditions and the following disclaimer in the
+#    documentation and/or other materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE AUTHOR(S) ``AS IS'' AND ANY EXPRESS OR
+# IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED WARRANTIES
+# OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE DISCLAIMED.
+# IN NO EVENT SHALL THE AUTHOR(S) BE LIABLE FOR ANY DIRECT, INDIRECT,
+# INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT
+# NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE,
+# DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY
+# THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF
+# THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+"""
+Snapshot module
+
+Snapshot trees of Virtual Machines along with the
+disk space consumed by each snapshot, and reports of
+the snapshots within a cluster, datacenter or the
+whole inventory.
+
+"""
+
+import time
+import logging
+import collections
+
+import pyVmomi
+
+__all__ = [
+    'datastore_name', 'retrieve_paged', 'snapshot_inventory',
+    'SnapshotNode', 'SnapshotTree', 'SnapshotJob', 'BulkSnapshotRunner',
+    'SnapshotReport',
+]
+
+logger = logging.getLogger(__name__)
+
+
+def datastore_name(path):
+    """
+    Get the name of the datastore of a file
+
+    Args:
+        path (str): A datastore path, e.g. '[datastore1] vm/vm.vmdk'
+
+    Returns:
+        The name of the datastore, or an empty string if the
+        path is not a datastore path
+
+    """
+    if not path.startswith('['):
+        return ''
+
+    return path[1:].partition(']')[0]
+
+
+def retrieve_paged(agent, spec, page_size=1000):
+    """
+    Retrieve properties of managed objects page by page
+
+    Properties are retrieved using RetrievePropertiesEx() and
+    ContinueRetrievePropertiesEx(), so that large inventories are
+    not returned by the server in a single response.
+
+    Args:
+        agent                                (VConnector): A VConnector instance
+        spec (vmodl.query.PropertyCollector.FilterSpec): The properties to retrieve
+        page_size                                   (int): Maximum number of objects per page
+
+    Yields:
+        Tuples of a managed object and a dict of its properties
+
+    """
+    pc = agent.si.content.propertyCollector
+    result = pc.RetrievePropertiesEx(
+        specSet=[spec],
+        options=pyVmomi.vmodl.query.PropertyCollector.RetrieveOptions(maxObjects=page_size)
+    )
+
+    try:
+        while result:
+            for content in result.objects:
+                yield content.obj, {prop.name: prop.val for prop in content.propSet}
+            if not result.token:
+                break
+            # The token is no longer valid once used, whether the call succeeds or not
+            token, result = result.token, None
+            result = pc.ContinueRetrievePropertiesEx(token=token)
+    finally:
+        # Release the remaining results if the caller stopped early
+        if result and result.token:
+            pc.CancelRetrievePropertiesEx(token=result.token)
+
+
+def snapshot_inventory(agent, container=None, page_size=1000):
+    """
+    Get the snapshot trees of all Virtual Machines with snapshots
+
+    The names and snapshots of all Virtual Machines are retrieved
+    in a single paged pass over a container view. The file layouts
+    are then retrieved, again page by page, only for the Virtual
+    Machines which have snapshots, since the layouts of all Virtual
+    Machines make up most of the data on large inventories.
+
+    Args:
+        agent            (VConnector): A VConnector instance
+        container (vim.ManagedEntity): Container to search in, the root folder if None
+        page_size               (int): Maximum number of objects per page
+
+    Yields:
+        Tuples of the Virtual Machine name and its SnapshotTree
+
+    """
+    PropertyCollector = pyVmomi.vmodl.query.PropertyCollector
+
+    view = agent.get_container_view(
+        obj_type=[pyVmomi.vim.VirtualMachine],
+        container=container
+    )
+    spec = PropertyCollector.FilterSpec(
+        objectSet=[
+            PropertyCollector.ObjectSpec(
+                obj=view,
+                skip=True,
+                selectSet=[
+                    PropertyCollector.TraversalSpec(
+                        name='traverseEntities',
+                        type=view.__class__,
+                        path='view',
+                        skip=False
+                    )
+                ]
+            )
+        ],
+        propSet=[
+            PropertyCollector.PropertySpec(
+                type=pyVmomi.vim.VirtualMachine,
+                pathSet=['name', 'snapshot']
+            )
+        ]
+    )
+
+    try:
+        vms = [
+            (obj, properties) for obj, properties in retrieve_paged(agent, spec, page_size)
+            if properties.get('snapshot')
+        ]
+    finally:
+        view.DestroyView()
+
+    for i in range(0, len(vms), page_size):
+        chunk = vms[i:i + page_size]
+        spec = PropertyCollector.FilterSpec(
+            objectSet=[PropertyCollector.ObjectSpec(obj=obj) for obj, properties in chunk],
+            propSet=[
+                PropertyCollector.PropertySpec(
+                    type=pyVmomi.vim.VirtualMachine,
+                    pathSet=['layoutEx.file', 'layoutEx.snapshot', 'layoutEx.disk']
+                )
+            ]
+        )
+        layouts = {obj._moId: properties for obj, properties in retrieve_paged(agent, spec, page_size)}
+
+        for obj, properties in chunk:
+            layout = layouts.get(obj._moId, {})
+            yield properties['name'], SnapshotTree(
+                properties['snapshot'],
+                layout.get('layoutEx.file', []),
+                layout.get('layoutEx.snapshot', []),
+                layout.get('layoutEx.disk', [])
+            )
+
+
+class SnapshotNode(object):
+    def __init__(self, tree, parent=None):
+        """
+        A node of a snapshot tree
+
+        Args:
+            tree (vim.vm.SnapshotTree): The snapshot tree of the node
+            parent      (SnapshotNode): The parent node or None for root snapshots
+
+        """
+        self.tree = tree
+        self.parent = parent
+        self.children = []
+        self.depth = parent.depth + 1 if parent else 0
+        self.files = []
+
+    @property
+    def size(self):
+        """
+        Disk space consumed by the snapshot in bytes
+
+        """
+        return sum(size for name, size in self.files)
+
+    @property
+    def id(self):
+        return self.tree.id
+
+    @property
+    def name(self):
+        return self.tree.name
+
+
+class SnapshotTree(object):
+    def __init__(self, snapshot_info, files=None, snapshot_layouts=None, disk_layouts=None):
+        """
+        Snapshot tree of a Virtual Machine
+
+        The whole tree is walked regardless of its depth and each
+        snapshot is indexed by its id, which unlike the snapshot
+        name is unique within a Virtual Machine.
+
+        When the file layout of the Virtual Machine is provided the
+        files of each snapshot are its memory and state files, along
+        with the delta disks holding the changes made after the
+        snapshot was taken. These are the deltas which start the
+        disk chains of its child snapshots and, for the current
+        snapshot, the delta disks the Virtual Machine is running on.
+
+        Args:
+            snapshot_info (vim.vm.SnapshotInfo): The snapshot property of a Virtual Machine
+            files                        (list): The layoutEx.file property of a Virtual Machine
+            snapshot_layouts             (list): The layoutEx.snapshot property of a Virtual Machine
+            disk_layouts                 (list): The layoutEx.disk property of a Virtual Machine
+
+        """
+        self.roots = []
+        self.nodes = collections.OrderedDict()
+        self.current = None
+
+        if snapshot_info is None:
+            return
+
+        by_snapshot = {}
+        stack = [(t, None) for t in reversed(snapshot_info.rootSnapshotList)]
+        while stack:
+            tree, parent = stack.pop()
+            node = SnapshotNode(tree, parent)
+            if parent:
+                parent.children.append(node)
+            else:
+                self.roots.append(node)
+            self.nodes[node.id] = node
+            by_snapshot[tree.snapshot._moId] = node
+            stack.extend((t, node) for t in reversed(tree.childSnapshotList or []))
+
+        current = snapshot_info.currentSnapshot
+        if current is not None:
+            self.current = by_snapshot.get(current._moId)
+
+        if files is not None and snapshot_layouts is not None:
+            self._assign_files(files, snapshot_layouts, disk_layouts or [], by_snapshot)
+
+    @classmethod
+    def retrieve(cls, agent, obj):
+        """
+        Retrieve the snapshot tree of a Virtual Machine
+
+        The snapshot tree and the file layout are retrieved
+        using a single property collector call
+
+        Args:
+            agent        (VConnector): A VConnector instance
+            obj  (vim.VirtualMachine): A VirtualMachine managed entity
+
+        Returns:
+            A SnapshotTree instance
+
+        """
+        spec = pyVmomi.vmodl.query.PropertyCollector.FilterSpec(
+            objectSet=[pyVmomi.vmodl.query.PropertyCollector.ObjectSpec(obj=obj)],
+            propSet=[
+                pyVmomi.vmodl.query.PropertyCollector.PropertySpec(
+                    type=pyVmomi.vim.VirtualMachine,
+                    pathSet=['snapshot', 'layoutEx.file', 'layoutEx.snapshot', 'layoutEx.disk']
+                )
+            ]
+        )
+
+        result = agent.si.content.propertyCollector.RetrieveContents([spec])
+        properties = {prop.name: prop.val for content in result for prop in content.propSet}
+
+        return cls(
+            properties.get('snapshot'),
+            properties.get('layoutEx.file', []),
+            properties.get('layoutEx.snapshot', []),
+            properties.get('layoutEx.disk', [])
+        )
+
+    def _assign_files(self, files, snapshot_layouts, disk_layouts, by_snapshot):
+        """
+        Assign the files of the Virtual Machine to its snapshots
+
+        The disk chain of a snapshot ends with the delta disks which
+        were written before the snapshot was taken, so the changes
+        made after a snapshot are the deltas its children and the
+        running disks add on top of its own chain.
+
+        """
+        files = {f.key: (f.name, f.uniqueSize or f.size or 0) for f in files}
+
+        def chain_keys(disks):
+            return set(key for disk in disks or [] for unit in disk.chain for key in unit.fileKey)
+
+        chains = {}
+        for s in snapshot_layouts:
+            node = by_snapshot.get(s.key._moId)
+            if node is None:
+                continue
+
+            own = [s.dataKey]
+            if s.memoryKey is not None and s.memoryKey >= 0:
+                own.append(s.memoryKey)
+            chains[node.id] = (node, chain_keys(s.disk), own)
+
+        for node, chain, own in chains.values():
+            changes = set()
+            for child in node.children:
+                if child.id in chains:
+                    changes |= chains[child.id][1] - chain
+            if node is self.current:
+                changes |= chain_keys(disk_layouts) - chain
+            node.files = [files[k] for k in own + sorted(changes) if k in files]
+
+    def __len__(self):
+        return len(self.nodes)
+
+    def walk(self):
+        """
+        Walk the tree depth-first, parents before their children
+
+        Yields:
+            SnapshotNode instances
+
+        """
+        stack = list(reversed(self.roots))
+        while stack:
+            node = stack.pop()
+            yield node
+            stack.extend(reversed(node.children))
+
+
+class SnapshotJob(object):
+    def __init__(self, name, host, datastores, calls):
+        """
+        Snapshot operations on a single Virtual Machine
+
+        Args:
+            name        (str): Name of the Virtual Machine
+            host        (str): The moId of the host of the Virtual Machine
+            datastores (list): The moIds of the datastores used by the Virtual Machine
+            calls      (list): Functions starting the tasks of the job one after
+                               another, each of them returning a vim.Task instance
+
+        """
+        self.name = name
+        self.host = host
+        self.datastores = datastores
+        self.calls = list(calls)
+        self.task = None
+        self.started = None
+
+    def start_next(self):
+        """
+        Start the next task of the job
+
+        Returns:
+            True if a task has been started, False if there are no more tasks
+
+        """
+        if not self.calls:
+            self.task = None
+            return False
+
+        self.task = self.calls.pop(0)()
+        self.started = time.monotonic()
+        return True
+
+
+class BulkSnapshotRunner(object):
+    def __init__(self, agent, max_per_host=2, max_per_datastore=4, max_tasks=16, interval=2.0,
+                 queue_timeout=600):
+        """
+        Runs snapshot operations on many Virtual Machines
+
+        Snapshot operations cause bursts of I/O on the datastores of
+        a Virtual Machine and load on its host, so the number of
+        Virtual Machines with tasks in flight is limited per host,
+        per datastore and in total. The tasks of a single Virtual
+        Machine are always run one after another.
+
+        The state of all running tasks is retrieved using a single
+        property collector call on each check. A job fails when its
+        task no longer exists, or when the task has not started
+        running within queue_timeout seconds.
+
+        Args:
+            agent          (VConnector): A VConnector instance
+            max_per_host          (int): Maximum number of running jobs per host
+            max_per_datastore     (int): Maximum number of running jobs per datastore
+            max_tasks             (int): Maximum number of running jobs in total
+            interval            (float): Seconds between checks of the running tasks
+            queue_timeout       (float): Seconds a task may remain queued
+
+        """
+        self.agent = agent
+        self.max_per_host = max(max_per_host, 1)
+        self.max_per_datastore = max(max_per_datastore, 1)
+        self.max_tasks = max(max_tasks, 1)
+        self.interval = interval
+        self.queue_timeout = queue_timeout
+
+    def _task_states(self, tasks):
+        """
+        Get the state and error of tasks
+
+        A task which no longer exists makes the server fail the
+        whole call, in which case the tasks are retrieved one by
+        one and the missing ones are left out of the result.
+
+        Returns:
+            A dict mapping the moId of each existing task to a (state, error) tuple
+
+        """
+        def retrieve(tasks):
+            spec = pyVmomi.vmodl.query.PropertyCollector.FilterSpec(
+                objectSet=[pyVmomi.vmodl.query.PropertyCollector.ObjectSpec(obj=t) for t in tasks],
+                propSet=[
+                    pyVmomi.vmodl.query.PropertyCollector.PropertySpec(
+                        type=pyVmomi.vim.Task,
+                        pathSet=['info.state', 'info.error']
+                    )
+                ]
+            )
+            return self.agent.si.content.propertyCollector.RetrieveContents([spec]) or []
+
+        try:
+            result = retrieve(tasks)
+        except pyVmomi.vmodl.fault.ManagedObjectNotFound:
+            result = []
+            for task in tasks:
+                try:
+                    result.extend(retrieve([task]))
+                except pyVmomi.vmodl.fault.ManagedObjectNotFound:
+                    pass
+
+        states = {}
+        for content in result:
+            properties = {prop.name: prop.val for prop in content.propSet}
+            states[content.obj._moId] = (properties.get('info.state'), properties.get('info.error'))
+
+        return states
+
+    def run(self, jobs, progress=None):
+        """
+        Run snapshot jobs
+
+        Args:
+            jobs      (list): A list of SnapshotJob instances
+            progress  (func): Called with the number of completed, total
+                              and running jobs after each check
+
+        Returns:
+            A list of (job, message) tuples of the failed jobs
+
+        """
+        pending = collections.deque(jobs)
+        running = []
+        failed = []
+        completed = 0
+        per_host = collections.Counter()
+        per_datastore = collections.Counter()
+
+        def release(job):
+            per_host[job.host] -= 1
+            for ds in job.datastores:
+                per_datastore[ds] -= 1
+
+        def start(job):
+            try:
+                return job.start_next()
+            except pyVmomi.vmodl.MethodFault as e:
+                failed.append((job, e.msg))
+                return False
+
+        while pending or running:
+            # Start the jobs allowed by the limits, keeping the order of the rest
+            blocked = collections.deque()
+            while pending and len(running) < self.max_tasks:
+                job = pending.popleft()
+                if per_host[job.host] >= self.max_per_host or \
+                   any(per_datastore[ds] >= self.max_per_datastore for ds in job.datastores):
+                    blocked.append(job)
+                    continue
+
+                if start(job):
+                    running.append(job)
+                    per_host[job.host] += 1
+                    for ds in job.datastores:
+                        per_datastore[ds] += 1
+                else:
+                    completed += 1
+            blocked.extend(pending)
+            pending = blocked
+
+            if progress:
+                progress(completed, len(jobs), len(running))
+
+            if not running:
+                continue
+
+            time.sleep(self.interval)
+
+            states = self._task_states([job.task for job in running])
+            now = time.monotonic()
+            still_running = []
+            for job in running:
+                state, error = states.get(job.task._moId, (None, None))
+                if job.task._moId not in states:
+                    failed.append((job, 'Task no longer exists'))
+                elif state in (None, pyVmomi.vim.TaskInfoState.queued) and \
+                   now - job.started > self.queue_timeout:
+                    failed.append((job, 'Task not started within {} seconds'.format(self.queue_timeout)))
+                elif state == pyVmomi.vim.TaskInfoState.error:
+                    failed.append((job, error.msg if error else 'Task failed'))
+                elif state == pyVmomi.vim.TaskInfoState.success and start(job):
+                    still_running.append(job)
+                    continue
+                elif state != pyVmomi.vim.TaskInfoState.success:
+                    still_running.append(job)
+                    continue
+
+                release(job)
+                completed += 1
+            running = still_running
+
+        if progress:
+            progress(completed, len(jobs), 0)
+
+        return failed
+
+
+class SnapshotReport(object):
+    # Columns of the snapshot and datastore reports
+    SNAPSHOT_COLUMNS = ['vm', 'snapshot', 'id', 'created', 'age_days', 'size_gb', 'datastores', 'current']
+    DATASTORE_COLUMNS = ['datastore', 'vms', 'snapshots', 'size_gb', 'oldest_days']
+
+    def __init__(self, agent, container=None, page_size=1000):
+        """
+        Snapshot Report
+
+        Lists the snapshots of all Virtual Machines within a
+        cluster, datacenter or the whole inventory along with the
+        age and the disk space consumed by each snapshot.
+
+        Args:
+            agent            (VConnector): A VConnector instance
+            container (vim.ManagedEntity): A cluster or datacenter, the whole inventory if None
+            page_size               (int): Maximum number of Virtual Machines retrieved at a time
+
+        """
+        self.agent = agent
+        self.container = container
+        self.page_size = page_size
+        self._snapshots = None
+
+    def snapshots(self):
+        """
+        Get the snapshots of all Virtual Machines
+
+        The inventory is retrieved once, so that both the snapshot
+        and the datastore rows can be generated from it.
+
+        Returns:
+            A list of (vm name, SnapshotNode, is current) tuples
+
+        """
+        if self._snapshots is None:
+            result = []
+            for name, tree in snapshot_inventory(self.agent, self.container, self.page_size):
+                result.extend((name, node, node is tree.current) for node in tree.walk())
+
+            logger.info('Found %d snapshots', len(result))
+            self._snapshots = result
+
+        return self._snapshots
+
+    def rows(self, sort='age'):
+        """
+        Generate the rows of the snapshot report
+
+        Args:
+            sort (str): Sort snapshots by either 'age' or 'size', largest first
+
+        Returns:
+            A list of dicts, one per snapshot
+
+        """
+        if sort not in ('age', 'size'):
+            raise ValueError('Unknown sort key: {}'.format(sort))
+
+        now = self.agent.si.CurrentTime()
+        rows = []
+        for name, node, current in self.snapshots():
+            rows.append(collections.OrderedDict([
+                ('vm', name),
+                ('snapshot', node.name),
+                ('id', node.id),
+                ('created', node.tree.createTime.isoformat()),
+                ('age_days', (now - node.tree.createTime).total_seconds() / 86400.0),
+                ('size_gb', node.size / 1024.0 ** 3),
+                ('datastores', ' '.join(sorted(set(datastore_name(f) for f, size in node.files)))),
+                ('current', current),
+            ]))
+
+        key = 'age_days' if sort == 'age' else 'size_gb'
+        rows.sort(key=lambda r: r[key], reverse=True)
+
+        return rows
+
+    def datastore_rows(self):
+        """
+        Generate the rows of the per-datastore snapshot report
+
+        Returns:
+            A list of dicts, one per datastore, largest first
+
+        """
+        now = self.agent.si.CurrentTime()
+        datastores = collections.defaultdict(lambda: {'vms': set(), 'snapshots': set(), 'size': 0, 'oldest': now})
+        for name, node, current in self.snapshots():
+            for path, size in node.files:
+                ds = datastores[datastore_name(path)]
+                ds['vms'].add(name)
+                ds['snapshots'].add((name, node.id))
+                ds['size'] += size
+                ds['oldest'] = min(ds['oldest'], node.tree.createTime)
+
+        rows = [
+            collections.OrderedDict([
+                ('datastore', datastore),
+                ('vms', len(ds['vms'])),
+                ('snapshots', len(ds['snapshots'])),
+                ('size_gb', ds['size'] / 1024.0 ** 3),
+                ('oldest_days', (now - ds['oldest']).total_seconds() / 86400.0),
+            ]) for datastore, ds in datastores.items()
+        ]
+        rows.sort(key=lambda r: r['size_gb'], reverse=True)
+
+        return rows
@@ -0,0 +1,236 @@
+# Copyright (c) 2015 Marin Atanasov Nikolov <dnaeon@gmail.com>
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions
+# are met:
+# 1. Redistributions of source code must retain the above copyright
+#    notice, this list of conditions and the following disclaimer
+#    in this position and unchanged.
+# 2. Redistributions in binary form must reproduce the above copyright
+#    notice, this list of conditions and the following disclaimer in the
+#    documentation and/or other materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE AUTHOR(S) ``AS IS'' AND ANY EXPRESS OR
+# IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED WARRANTIES
+# OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE DISCLAIMED.
+# IN NO EVENT SHALL THE AUTHOR(S) BE LIABLE FOR ANY DIRECT, INDIRECT,
+# INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT
+# NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE,
+# DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY
+# THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF
+# THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+"""
+Performance Statistics module
+
+Derived series and summary statistics of performance samples.
+
+All functions operate on numpy arrays, e.g. as returned by
+pvc.perf.sample_arrays(), and missing samples are represented
+as NaN values.
+
+"""
+
+import collections
+
+import numpy
+
+__all__ = [
+    'align', 'rate', 'per_cpu', 'ratio', 'rolling_mean',
+    'percentiles', 'summary',
+]
+
+
+def align(a, b):
+    """
+    Align two series on their common timestamps
+
+    The timestamps of both series must be unique and in ascending order.
+
+    Args:
+        a (tuple): A tuple of the timestamps and values of the first series
+        b (tuple): A tuple of the timestamps and values of the second series
+
+    Returns:
+        A tuple of the common timestamps and the values
+        of the first and second series at these timestamps
+
+    """
+    a_timestamps = numpy.asarray(a[0])
+    b_timestamps = numpy.asarray(b[0])
+
+    # Position of each timestamp of the first series in the second
+    # one, which is a match only if the timestamps are equal
+    index_b = numpy.searchsorted(b_timestamps, a_timestamps)
+    found = index_b < len(b_timestamps)
+    found[found] = b_timestamps[index_b[found]] == a_timestamps[found]
+    index_a = numpy.flatnonzero(found)
+    index_b = index_b[found]
+
+    a_values = numpy.asarray(a[1], dtype=float)
+    b_values = numpy.asarray(b[1], dtype=float)
+
+    return a_timestamps[index_a], a_values[index_a], b_values[index_b]
+
+
+def rate(timestamps, values):
+    """
+    Calculate the per second rate of change of a series
+
+    The first value of the result is always missing, as there is
+    no previous sample to compare it with. Decreasing values are
+    treated as a counter reset and result in a missing value.
+
+    Args:
+        timestamps (array_like): The UNIX timestamps of the samples in ascending order
+        values     (array_like): The values of the samples
+
+    Returns:
+        A numpy array of the rates, of the same length as the series
+
+    """
+    t = numpy.asarray(timestamps, dtype=float)
+    y = numpy.asarray(values, dtype=float)
+    result = numpy.full(len(y), numpy.nan)
+
+    if len(y) > 1:
+        dt = numpy.diff(t)
+        dy = numpy.diff(y)
+        with numpy.errstate(divide='ignore', invalid='ignore'):
+            r = dy / dt
+        r[(dt <= 0) | (dy < 0)] = numpy.nan
+        result[1:] = r
+
+    return result
+
+
+def per_cpu(values, num_cpu):
+    """
+    Normalize the values of a series by the number of CPUs
+
+    Args:
+        values (array_like): The values of the samples
+        num_cpu       (int): Number of virtual or logical CPUs
+
+    Returns:
+        A numpy array of the normalized values
+
+    Raises:
+        ValueError: If the number of CPUs is not positive
+
+    """
+    if num_cpu < 1:
+        raise ValueError('Invalid number of CPUs: {}'.format(num_cpu))
+
+    return numpy.asarray(values, dtype=float) / num_cpu
+
+
+def ratio(numerator, denominator):
+    """
+    Calculate the ratio of two aligned series, e.g. cpu.ready / cpu.used
+
+    Args:
+        numerator   (array_like): The values of the numerator series
+        denominator (array_like): The values of the denominator series
+
+    Returns:
+        A numpy array of the ratios, with missing values
+        where the denominator is zero
+
+    """
+    a = numpy.asarray(numerator, dtype=float)
+    b = numpy.asarray(denominator, dtype=float)
+
+    with numpy.errstate(divide='ignore', invalid='ignore'):
+        result = a / b
+    result[b == 0] = numpy.nan
+
+    return result
+
+
+def rolling_mean(values, window):
+    """
+    Calculate the rolling average of a series
+
+    Missing samples are ignored when calculating the average of
+    a window, but remain missing in the result, so that gaps in
+    the series are preserved.
+
+    Args:
+        values (array_like): The values of the samples
+        window        (int): Number of samples in a window
+
+    Returns:
+        A numpy array of the averages, of the same length as the series
+
+    """
+    y = numpy.asarray(values, dtype=float)
+    valid = ~numpy.isnan(y)
+
+    # Sums and counts of each window, calculated using prefix sums
+    sums = numpy.concatenate(([0.0], numpy.cumsum(numpy.where(valid, y, 0.0))))
+    counts = numpy.concatenate(([0], numpy.cumsum(valid)))
+    end = numpy.arange(1, len(y) + 1)
+    start = numpy.maximum(end - max(window, 1), 0)
+
+    with numpy.errstate(divide='ignore', invalid='ignore'):
+        result = (sums[end] - sums[start]) / (counts[end] - counts[start])
+    result[~valid] = numpy.nan
+
+    return result
+
+
+def percentiles(values, q=(50, 95, 99)):
+    """
+    Calculate percentiles of a series
+
+    Args:
+        values (array_like): The values of the samples
+        q           (tuple): The percentiles to calculate
+
+    Returns:
+        A numpy array of the percentiles, which are
+        NaN if the series has no valid samples
+
+    """
+    y = numpy.asarray(values, dtype=float)
+    y = y[~numpy.isnan(y)]
+
+    if not len(y):
+        return numpy.full(len(q), numpy.nan)
+
+    return numpy.percentile(y, q)
+
+
+def summary(values):
+    """
+    Calculate summary statistics of a series
+
+    Args:
+        values (array_like): The values of the samples
+
+    Returns:
+        An ordered dict with the number of valid samples and
+        the min, average, p50, p95, p99 and max values
+
+    """
+    y = numpy.asarray(values, dtype=float)
+    y = y[~numpy.isnan(y)]
+
+    result = collections.OrderedDict([('count', len(y))])
+    if not len(y):
+        for name in ('min', 'avg', 'p50', 'p95', 'p99', 'max'):
+            result[name] = numpy.nan
+        return result
+
+    p50, p95, p99 = numpy.percentile(y, (50, 95, 99))
+    result['min'] = y.min()
+    result['avg'] = y.mean()
+    result['p50'] = p50
+    result['p95'] = p95
+    result['p99'] = p99
+    result['max'] = y.max()
+
+    return result
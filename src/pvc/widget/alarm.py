@@ -27,11 +27,16 @@ Alarm Widgets
 
 """
 
+import shutil
+
+import pyVmomi
+
+import pvc.alarm
 import pvc.widget.debug
 import pvc.widget.form
 import pvc.widget.menu
 
-__all__ = ['AlarmWidget']
+__all__ = ['AlarmWidget', 'AlarmDashboardWidget']
 
 
 class AlarmWidget(object):
@@ -65,7 +70,8 @@ class AlarmWidget(object):
             ),
             pvc.widget.menu.MenuItem(
                 tag='Reset',
-                description='Reset Alarm'
+                description='Reset Alarm',
+                on_select=self.reset
             ),
             pvc.widget.menu.MenuItem(
                 tag='Debug',
@@ -130,13 +136,10 @@ class AlarmWidget(object):
 
         return form.display()
 
-    def acknowledge(self, alarm):
+    def acknowledge(self):
         """
         Acknowledge alarm
 
-        Args:
-            alarm (vim.AlarmState): A vim.AlarmState instance
-
         """
         self.dialog.infobox(
             title=self.title,
@@ -145,6 +148,253 @@ class AlarmWidget(object):
 
         am = self.agent.si.content.alarmManager
         am.AcknowledgeAlarm(
-            alarm=alarm.alarm,
-            entity=alarm.entity
+            alarm=self.obj.alarm,
+            entity=self.obj.entity
+        )
+
+    def reset(self):
+        """
+        Reset alarm to green
+
+        """
+        self.dialog.infobox(
+            title=self.title,
+            text='Resetting alarm ...'
+        )
+
+        am = self.agent.si.content.alarmManager
+        try:
+            am.SetAlarmStatus(
+                alarm=self.obj.alarm,
+                entity=self.obj.entity,
+                status='green'
+            )
+        except pyVmomi.vmodl.MethodFault as e:
+            self.dialog.msgbox(
+                title=self.title,
+                text=e.msg
+            )
+
+
+class AlarmDashboardWidget(object):
+    # Sort orders of the dashboard, switched using the Sort button
+    SORT_KEYS = ('severity', 'age', 'entity')
+
+    def __init__(self, agent, dialog, container=None):
+        """
+        Alarm Dashboard Widget
+
+        Displays the triggered alarms of all managed entities
+        in a datacenter or in the whole inventory
+
+        Args:
+            agent           (VConnector): A VConnector instance
+            dialog       (dialog.Dialog): A Dialog instance
+            container (vim.ManagedEntity): A Datacenter or None for the whole inventory
+
+        """
+        self.agent = agent
+        self.dialog = dialog
+        self.container = container
+        if self.container:
+            self.title = '{} ({})'.format(self.container.name, self.container.__class__.__name__)
+        else:
+            self.title = 'Alarms'
+        self.display()
+
+    def format_age(self, delta):
+        """
+        Format the age of an alarm, e.g. 2d 5h
+
+        """
+        seconds = max(int(delta.total_seconds()), 0)
+        days, seconds = divmod(seconds, 86400)
+        hours, seconds = divmod(seconds, 3600)
+        minutes = seconds // 60
+
+        if days:
+            return '{}d {}h'.format(days, hours)
+        elif hours:
+            return '{}h {}m'.format(hours, minutes)
+
+        return '{}m'.format(minutes)
+
+    def get_alarms(self):
+        self.dialog.infobox(
+            title=self.title,
+            text='Retrieving information ...'
+        )
+
+        return pvc.alarm.triggered_alarms(self.agent, self.container), self.agent.si.CurrentTime()
+
+    def display(self):
+        columns, lines = shutil.get_terminal_size()
+        alarms, now = self.get_alarms()
+        sort_key = self.SORT_KEYS[0]
+
+        while True:
+            if not alarms:
+                self.dialog.msgbox(
+                    title=self.title,
+                    text='No triggered alarms'
+                )
+                return
+
+            alarms = pvc.alarm.sort_alarms(alarms, sort_key)
+            by_key = {a.state.key: a for a in alarms}
+            choices = [
+                (a.state.key, '{:<6} {:>7}  {}: {}'.format(
+                    a.state.overallStatus,
+                    self.format_age(now - a.state.time),
+                    a.entity_name,
+                    a.name
+                )) for a in alarms
+            ]
+
+            code, tag = self.dialog.menu(
+                title=self.title,
+                text='{} triggered alarms, sorted by {}'.format(len(alarms), sort_key),
+                choices=choices,
+                height=lines - 2,
+                width=columns - 4,
+                menu_height=lines - 9,
+                ok_label='Details',
+                cancel_label='Back',
+                extra_button=True,
+                extra_label='Sort',
+                help_button=True,
+                help_label='Actions'
+            )
+
+            if code in (self.dialog.CANCEL, self.dialog.ESC):
+                return
+            elif code == self.dialog.EXTRA:
+                sort_key = self.SORT_KEYS[(self.SORT_KEYS.index(sort_key) + 1) % len(self.SORT_KEYS)]
+            elif code == self.dialog.HELP:
+                action = self.select_action()
+                if action:
+                    if action != 'refresh':
+                        self.bulk_action(alarms, action)
+                    alarms, now = self.get_alarms()
+            elif tag in by_key:
+                AlarmWidget(self.agent, self.dialog, by_key[tag].state)
+
+    def select_action(self):
+        """
+        Prompts the user for an action on the dashboard
+
+        Returns:
+            One of 'refresh', 'acknowledge' or 'reset', or
+            None if no action has been selected
+
+        """
+        code, tag = self.dialog.menu(
+            title=self.title,
+            text='Select an action to be performed',
+            choices=[
+                ('Refresh', 'Retrieve the triggered alarms again'),
+                ('Acknowledge', 'Acknowledge all matching alarms'),
+                ('Reset', 'Reset all matching alarms to green'),
+            ]
+        )
+
+        if code in (self.dialog.CANCEL, self.dialog.ESC):
+            return None
+
+        return tag.lower()
+
+    def bulk_action(self, alarms, action):
+        """
+        Acknowledge or reset all alarms matching a filter
+
+        Args:
+            alarms  (list): A list of pvc.alarm.TriggeredAlarm instances
+            action   (str): Either 'acknowledge' or 'reset'
+
+        """
+        elements = [
+            pvc.widget.form.FormElement(
+                label='Status',
+                item='red, yellow'
+            ),
+            pvc.widget.form.FormElement(
+                label='Alarm name',
+                item=''
+            ),
+            pvc.widget.form.FormElement(
+                label='Entity name',
+                item=''
+            ),
+        ]
+
+        form = pvc.widget.form.Form(
+            dialog=self.dialog,
+            form_elements=elements,
+            title=self.title,
+            text=(
+                'Alarms to {}. Status is a comma-separated list, '
+                'alarm and entity names match any part of the name'.format(action)
+            )
+        )
+
+        code, fields = form.display()
+        if code in (self.dialog.CANCEL, self.dialog.ESC):
+            return
+
+        matching = pvc.alarm.filter_alarms(
+            alarms=alarms,
+            statuses=[s.strip() for s in fields['Status'].split(',') if s.strip()],
+            name=fields['Alarm name'].strip(),
+            entity=fields['Entity name'].strip(),
+            acknowledged=False if action == 'acknowledge' else None
+        )
+
+        if not matching:
+            self.dialog.msgbox(
+                title=self.title,
+                text='No matching alarms'
+            )
+            return
+
+        code = self.dialog.yesno(
+            title=self.title,
+            text='{} {} alarms?'.format(action.capitalize(), len(matching))
+        )
+
+        if code in (self.dialog.ESC, self.dialog.CANCEL):
+            return
+
+        text = '{} alarms ...'.format('Acknowledging' if action == 'acknowledge' else 'Resetting')
+        self.dialog.gauge_start(
+            title=self.title,
+            text=text
+        )
+
+        failed = pvc.alarm.bulk_alarm_action(
+            agent=self.agent,
+            states=[a.state for a in matching],
+            action=action,
+            progress=lambda done, total: self.dialog.gauge_update(
+                int(done * 100 / total),
+                text='{}\n\n{} of {} done'.format(text, done, total),
+                update_text=True
+            )
+        )
+
+        self.dialog.gauge_stop()
+
+        by_key = {a.state.key: a for a in matching}
+        text = '{} of {} alarms done'.format(len(matching) - len(failed), len(matching))
+        if failed:
+            text += ', {} failed:\n\n{}'.format(
+                len(failed),
+                '\n'.join(
+                    '{}: {}: {}'.format(by_key[s.key].entity_name, by_key[s.key].name, msg)
+                    for s, msg in failed
+                )
+            )
+
+        self.dialog.scrollbox(
+            title=self.title,
+            text=text
         )
@@ -0,0 +1,305 @@
+# Copyright (c) 2015 Marin Atanasov Nikolov <dnaeon@gmail.com>
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions
+# are met:
+# 1. Redistributions of source code must retain the above copyright
+#    notice, this list of conditions and the following disclaimer
+#    in this position and unchanged.
+# 2. Redistributions in binary form must reproduce the above copyright
+#    notice, this list of conditions and the following disclaimer in the
+#    documentation and/or other materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE AUTHOR(S) ``AS IS'' AND ANY EXPRESS OR
+# IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED WARRANTIES
+# OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE DISCLAIMED.
+# IN NO EVENT SHALL THE AUTHOR(S) BE LIABLE FOR ANY DIRECT, INDIRECT,
+# INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT
+# NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE,
+# DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY
+# THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF
+# THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+"""
+Chart Widgets
+
+Renders line charts of time series as text using the Unicode
+braille patterns, so that graphs can be displayed directly
+in a dialog(1) widget without any external tools.
+
+"""
+
+import datetime
+
+__all__ = ['Chart', 'ChartSeries']
+
+# Bit values of the braille dots, indexed by the dot
+# column (0-1) and row (0-3) within a single character cell
+_BRAILLE_DOTS = (
+    (0x01, 0x02, 0x04, 0x40),
+    (0x08, 0x10, 0x20, 0x80),
+)
+_BRAILLE_BASE = 0x2800
+_BRAILLE_FULL = chr(_BRAILLE_BASE + 0xff)
+
+# dialog(1) color escapes used for the different series
+_COLORS = ('\\Z1', '\\Z4', '\\Z2', '\\Z5', '\\Z6', '\\Z3')
+_COLOR_RESET = '\\Zn'
+
+
+def _is_valid(value):
+    """
+    Check whether a value represents an existing sample
+
+    """
+    return value is not None and value == value
+
+
+class ChartSeries(object):
+    def __init__(self, label, x, y):
+        """
+        A series of points to be plotted on a chart
+
+        Args:
+            label (str): Label of the series used in the chart legend
+            x    (list): A list of x values, e.g. UNIX timestamps
+            y    (list): A list of y values. None or NaN values represent
+                         missing samples and break the plotted line
+
+        """
+        self.label = label
+        self.x = x
+        self.y = y
+
+
+class Chart(object):
+    def __init__(self, width=60, height=15, ymin=None, ymax=None,
+                 title='', colors=True, time_axis=True):
+        """
+        A line chart rendered with braille characters
+
+        Each character cell holds 2x4 dots, so the effective
+        resolution of the chart is twice its width and four
+        times its height.
+
+        Args:
+            width      (int): Width of the plot area in characters
+            height     (int): Height of the plot area in characters
+            ymin     (float): Lower bound of the y axis, autoscale if None
+            ymax     (float): Upper bound of the y axis, autoscale if None
+            title      (str): Title displayed above the chart
+            colors    (bool): If True use dialog(1) color escapes to
+                              distinguish between the different series
+            time_axis (bool): If True treat x values as UNIX timestamps
+
+        """
+        self.width = max(width, 10)
+        self.height = max(height, 2)
+        self.ymin = ymin
+        self.ymax = ymax
+        self.title = title
+        self.colors = colors
+        self.time_axis = time_axis
+        self.series = []
+
+    def add_series(self, label, x, y):
+        """
+        Add a series to the chart
+
+        Args:
+            label (str): Label of the series
+            x    (list): A list of x values
+            y    (list): A list of y values
+
+        """
+        self.series.append(ChartSeries(label=label, x=x, y=y))
+
+    def _bounds(self):
+        """
+        Calculate the bounds of the plotted data
+
+        Returns:
+            A tuple of (xmin, xmax, ymin, ymax)
+
+        """
+        xs = [x for s in self.series for x, y in zip(s.x, s.y) if _is_valid(y)]
+        ys = [y for s in self.series for y in s.y if _is_valid(y)]
+
+        if not xs:
+            return (0, 1, 0, 1)
+
+        xmin, xmax = min(xs), max(xs)
+        ymin = self.ymin if self.ymin is not None else min(ys)
+        ymax = self.ymax if self.ymax is not None else max(ys)
+
+        if self.ymin is None and ymin > 0 and ymin <= (ymax - ymin):
+            # Anchor the y axis at zero unless the series are far from it
+            ymin = 0
+        if xmax == xmin:
+            xmax = xmin + 1
+        if ymax == ymin:
+            ymax = ymin + 1
+
+        return (xmin, xmax, ymin, ymax)
+
+    def _format_value(self, value):
+        """
+        Format a y axis value in a compact form
+
+        """
+        for divisor, suffix in ((1e9, 'G'), (1e6, 'M'), (1e3, 'k')):
+            if abs(value) >= divisor:
+                return '{:.1f}{}'.format(value / divisor, suffix)
+
+        if value == int(value):
+            return str(int(value))
+
+        return '{:.2f}'.format(value)
+
+    def _format_time(self, value, span):
+        """
+        Format a x axis value depending on the time span of the chart
+
+        """
+        if not self.time_axis:
+            return self._format_value(value)
+
+        t = datetime.datetime.utcfromtimestamp(value)
+        if span <= 86400:
+            return t.strftime('%H:%M:%S' if span <= 600 else '%H:%M')
+        elif span <= 86400 * 60:
+            return t.strftime('%m-%d %H:%M')
+
+        return t.strftime('%Y-%m-%d')
+
+    def _plot(self, bounds):
+        """
+        Plot all series on a dot canvas
+
+        Returns:
+            A tuple of two matrices holding the braille dot masks
+            and the index of the series last drawn in each cell
+
+        """
+        xmin, xmax, ymin, ymax = bounds
+        dots_x = self.width * 2 - 1
+        dots_y = self.height * 4 - 1
+        masks = [[0] * self.width for _ in range(self.height)]
+        owners = [[None] * self.width for _ in range(self.height)]
+
+        def set_dot(index, dx, dy):
+            if not (0 <= dx <= dots_x and 0 <= dy <= dots_y):
+                return
+            row, col = dy // 4, dx // 2
+            masks[row][col] |= _BRAILLE_DOTS[dx % 2][dy % 4]
+            owners[row][col] = index
+
+        for index, s in enumerate(self.series):
+            previous = None
+            for x, y in zip(s.x, s.y):
+                if not _is_valid(y):
+                    previous = None
+                    continue
+
+                y = min(max(y, ymin), ymax)
+                dx = int(round((x - xmin) / (xmax - xmin) * dots_x))
+                dy = int(round((ymax - y) / (ymax - ymin) * dots_y))
+
+                if previous is None:
+                    set_dot(index, dx, dy)
+                else:
+                    # Bresenham's line algorithm
+                    x0, y0 = previous
+                    step_x = 1 if dx > x0 else -1
+                    step_y = 1 if dy > y0 else -1
+                    delta_x, delta_y = abs(dx - x0), -abs(dy - y0)
+                    err = delta_x + delta_y
+                    while True:
+                        set_dot(index, x0, y0)
+                        if x0 == dx and y0 == dy:
+                            break
+                        e2 = 2 * err
+                        if e2 >= delta_y:
+                            err += delta_y
+                            x0 += step_x
+                        if e2 <= delta_x:
+                            err += delta_x
+                            y0 += step_y
+                previous = (dx, dy)
+
+        return masks, owners
+
+    def _colorize(self, text, index):
+        if not self.colors or index is None:
+            return text
+
+        return '{}{}{}'.format(_COLORS[index % len(_COLORS)], text, _COLOR_RESET)
+
+    def render(self):
+        """
+        Render the chart
+
+        Returns:
+            The rendered chart as a string
+
+        """
+        bounds = self._bounds()
+        xmin, xmax, ymin, ymax = bounds
+        masks, owners = self._plot(bounds)
+
+        y_labels = {
+            0: self._format_value(ymax),
+            self.height // 2: self._format_value((ymax + ymin) / 2.0),
+            self.height - 1: self._format_value(ymin),
+        }
+        label_width = max(len(l) for l in y_labels.values())
+
+        lines = []
+        if self.title:
+            lines.append(self.title)
+
+        for row in range(self.height):
+            label = y_labels.get(row, '')
+            axis = '┤' if row in y_labels else '│'
+            cells = []
+            run, run_owner = '', None
+            for col in range(self.width):
+                mask, owner = masks[row][col], owners[row][col]
+                char = chr(_BRAILLE_BASE + mask) if mask else ' '
+                if owner != run_owner and run:
+                    cells.append(self._colorize(run, run_owner))
+                    run = ''
+                run_owner = owner if mask else run_owner
+                run += char
+            cells.append(self._colorize(run, run_owner))
+            lines.append('{:>{width}} {}{}'.format(label, axis, ''.join(cells), width=label_width))
+
+        lines.append('{} └{}'.format(' ' * label_width, '─' * self.width))
+
+        span = xmax - xmin
+        left = self._format_time(xmin, span)
+        middle = self._format_time(xmin + span / 2.0, span)
+        right = self._format_time(xmax, span)
+        x_axis = [' '] * self.width
+        taken = []
+        # Labels which do not fit between the ones already placed are dropped
+        for position, text in ((0, left), (self.width - len(right), right), ((self.width - len(middle)) // 2, middle)):
+            end = position + len(text)
+            if position < 0 or end > self.width:
+                continue
+            if any(position <= e and end >= p for p, e in taken):
+                continue
+            x_axis[position:end] = list(text)
+            taken.append((position, end))
+        lines.append('{}  {}'.format(' ' * label_width, ''.join(x_axis)))
+
+        legend = [
+            '{} {}'.format(self._colorize(_BRAILLE_FULL, index), s.label)
+            for index, s in enumerate(self.series)
+        ]
+        lines.append('')
+        lines.append('  '.join(legend))
+
+        return '\n'.join(lines)
@@ -39,6 +39,7 @@ import pvc.widget.form
 import pvc.widget.gauge
 import pvc.widget.menu
 import pvc.widget.performance
+import pvc.widget.top
 import pvc.widget.virtualmachine
 
 __all__ = [
@@ -112,6 +113,12 @@ class ClusterWidget(object):
                 on_select=pvc.widget.performance.PerformanceProviderWidget,
                 on_select_args=(self.agent, self.dialog, self.obj)
             ),
+            pvc.widget.menu.MenuItem(
+                tag='Top',
+                description='Live resource usage ranking',
+                on_select=pvc.widget.top.TopWidget,
+                on_select_args=(self.agent, self.dialog, self.obj)
+            ),
             pvc.widget.menu.MenuItem(
                 tag='Events',
                 description='View Events',
@@ -37,6 +37,7 @@ import pvc.widget.event
 import pvc.widget.hostsystem
 import pvc.widget.menu
 import pvc.widget.performance
+import pvc.widget.top
 import pvc.widget.virtualmachine
 
 __all__ = [
@@ -117,6 +118,12 @@ class DatacenterWidget(object):
                 on_select=pvc.widget.performance.PerformanceProviderWidget,
                 on_select_args=(self.agent, self.dialog, self.obj)
             ),
+            pvc.widget.menu.MenuItem(
+                tag='Top',
+                description='Live resource usage ranking',
+                on_select=pvc.widget.top.TopWidget,
+                on_select_args=(self.agent, self.dialog, self.obj)
+            ),
             pvc.widget.menu.MenuItem(
                 tag='Events',
                 description='View Events',
@@ -129,6 +136,12 @@ class DatacenterWidget(object):
                 on_select=pvc.widget.common.alarm_menu,
                 on_select_args=(self.agent, self.dialog, self.obj)
             ),
+            pvc.widget.menu.MenuItem(
+                tag='Alarm Dashboard',
+                description='View triggered alarms of all entities',
+                on_select=pvc.widget.alarm.AlarmDashboardWidget,
+                on_select_args=(self.agent, self.dialog, self.obj)
+            ),
             pvc.widget.menu.MenuItem(
                 tag='Debug',
                 description='Start a Python REPL console',
@@ -28,13 +28,24 @@ Event Widgets
 """
 
 import os
-import time
+import shutil
+import datetime
 import tempfile
-import threading
 
 import pyVmomi
 
-__all__ = ['EventWidget', 'EventCollector']
+import pvc.eventsink
+import pvc.eventstore
+import pvc.widget.menu
+import pvc.widget.form
+import pvc.widget.checklist
+
+from pvc.event import EventCollector
+
+__all__ = [
+    'EventWidget', 'AggregatedEventWidget', 'EventCollector',
+    'EventHistoryWidget', 'EventPager', 'follow_events',
+]
 
 
 class EventWidget(object):
@@ -55,133 +66,718 @@ class EventWidget(object):
         self.display()
 
     def display(self):
-        self.dialog.infobox(
+        items = [
+            pvc.widget.menu.MenuItem(
+                tag='Latest',
+                description='Follow the latest events',
+                on_select=self.latest_events
+            ),
+            pvc.widget.menu.MenuItem(
+                tag='History',
+                description='Browse historical events',
+                on_select=EventHistoryWidget,
+                on_select_args=(self.agent, self.dialog, self.obj)
+            ),
+            pvc.widget.menu.MenuItem(
+                tag='Export',
+                description='Follow and export events as JSON lines',
+                on_select=self.export_events
+            ),
+        ]
+
+        menu = pvc.widget.menu.Menu(
+            items=items,
+            dialog=self.dialog,
             title=self.title,
-            text='Retrieving information ...'
+            text='Select an item from the menu'
+        )
+
+        menu.display()
+
+    def latest_events(self):
+        """
+        Follow the latest events of the entity
+
+        """
+        follow_events(
+            agent=self.agent,
+            dialog=self.dialog,
+            title=self.title,
+            obj=self.obj
+        )
+
+    def export_events(self):
+        """
+        Follow the latest events of the entity and export
+        them as JSON lines to rotating files
+
+        """
+        elements = [
+            pvc.widget.form.FormElement(
+                label='Path',
+                item=os.path.join(os.getcwd(), '{}-events.jsonl'.format(self.obj.name))
+            ),
+            pvc.widget.form.FormElement(
+                label='Max size (MB)',
+                item='64'
+            ),
+            pvc.widget.form.FormElement(
+                label='Max age (hours)',
+                item='0'
+            ),
+            pvc.widget.form.FormElement(
+                label='Backups',
+                item='10'
+            ),
+        ]
+
+        form = pvc.widget.form.Form(
+            dialog=self.dialog,
+            form_elements=elements,
+            title=self.title,
+            text='Files are rotated once they reach the given size or age, 0 disables the limit'
+        )
+
+        code, fields = form.display()
+        if code in (self.dialog.CANCEL, self.dialog.ESC):
+            return
+
+        try:
+            max_bytes = int(fields['Max size (MB)']) * 1024 * 1024
+            interval = int(fields['Max age (hours)']) * 3600
+            backup_count = int(fields['Backups'])
+        except ValueError:
+            self.dialog.msgbox(
+                title=self.title,
+                text='Invalid rotation settings provided'
+            )
+            return
+
+        code = self.dialog.yesno(
+            title=self.title,
+            text='Compress rotated files?'
+        )
+        compress = code == self.dialog.OK
+
+        try:
+            sink = pvc.eventsink.JsonEventSink(
+                path=os.path.expanduser(fields['Path']),
+                max_bytes=max_bytes,
+                interval=interval,
+                backup_count=backup_count,
+                compress=compress
+            )
+        except OSError as e:
+            self.dialog.msgbox(
+                title=self.title,
+                text='Cannot open file: {}'.format(e)
+            )
+            return
+
+        try:
+            follow_events(
+                agent=self.agent,
+                dialog=self.dialog,
+                title=self.title,
+                obj=self.obj,
+                sink=sink
+            )
+        finally:
+            sink.close()
+
+
+class AggregatedEventWidget(object):
+    def __init__(self, agent, dialog):
+        """
+        Aggregated Event Widget
+
+        Follows the latest events of multiple entities
+        merged in a single stream ordered by time
+
+        Args:
+            agent     (VConnector): A VConnector instance
+            dialog (dialog.Dialog): A Dialog instance
+
+        """
+        self.agent = agent
+        self.dialog = dialog
+        self.title = 'Events'
+        self.display()
+
+    def display(self):
+        items = [
+            pvc.widget.menu.MenuItem(
+                tag='Virtual Machines',
+                description='Follow events of Virtual Machines',
+                on_select=self.select_entities,
+                on_select_args=(pyVmomi.vim.VirtualMachine,)
+            ),
+            pvc.widget.menu.MenuItem(
+                tag='Hosts',
+                description='Follow events of hosts',
+                on_select=self.select_entities,
+                on_select_args=(pyVmomi.vim.HostSystem,)
+            ),
+            pvc.widget.menu.MenuItem(
+                tag='Folder',
+                description='Follow events of a folder',
+                on_select=self.select_folder
+            ),
+        ]
+
+        menu = pvc.widget.menu.Menu(
+            items=items,
+            dialog=self.dialog,
+            title=self.title,
+            text='Select the entities to follow'
+        )
+
+        menu.display()
+
+    def get_entities(self, obj_type):
+        """
+        Get the entities of a given type sorted by name
+
+        Args:
+            obj_type (type): A vim.ManagedEntity type
+
+        Returns:
+            A list of (name, entity) tuples
+
+        """
+        view = self.agent.get_container_view(obj_type=[obj_type])
+        properties = self.agent.collect_properties(
+            view_ref=view,
+            obj_type=obj_type,
+            path_set=['name'],
+            include_mors=True
         )
+        view.DestroyView()
 
-        fd, path = tempfile.mkstemp(prefix='pvcevents-')
+        return sorted(((p['name'], p['obj']) for p in properties), key=lambda x: x[0])
 
-        # We need to create the destination file where events
-        # will be appended to because we don't know exactly how long
-        # the event history collector will take to put any new
-        # data in the file, so the operation can take long enough
-        # to create the file and dialog(1) needs a valid and
-        # already existing file in order to display the widget
-        with open(path, 'w'):
-            pass
+    def select_entities(self, obj_type):
+        """
+        Select the entities to follow from a checklist
+
+        Args:
+            obj_type (type): A vim.ManagedEntity type
 
+        """
         self.dialog.infobox(
             title=self.title,
-            text='Starting event collector ...'
+            text='Retrieving information ...'
+        )
+
+        entities = self.get_entities(obj_type)
+        if not entities:
+            self.dialog.msgbox(
+                title=self.title,
+                text='No entities found'
+            )
+            return
+
+        # Tags of the checklist must be unique
+        registry = {'{} ({})'.format(name, obj._moId): obj for name, obj in entities}
+        items = [
+            pvc.widget.checklist.CheckListItem(tag=tag, description=obj.__class__.__name__)
+            for tag, obj in sorted(registry.items())
+        ]
+
+        checklist = pvc.widget.checklist.CheckList(
+            items=items,
+            dialog=self.dialog,
+            title=self.title,
+            text='Select the entities to follow'
         )
 
-        collector = EventCollector(
+        checklist.display()
+        selected = [registry[tag] for tag in checklist.selected()]
+
+        if not selected:
+            return
+
+        follow_events(
             agent=self.agent,
-            obj=self.obj,
-            path=path
+            dialog=self.dialog,
+            title='{} ({} entities)'.format(self.title, len(selected)),
+            obj=selected
         )
-        collector.start()
 
-        # Give it some time before displaying the widget
-        time.sleep(3)
+    def select_folder(self):
+        """
+        Select a folder to follow
+
+        The events of all entities in the folder are
+        collected through the folder itself
 
-        self.dialog.tailbox(
-            filepath=path,
+        """
+        self.dialog.infobox(
             title=self.title,
+            text='Retrieving information ...'
         )
 
-        collector.signal_stop()
-        collector.join(1)
-        os.unlink(path)
-
+        folders = self.get_entities(pyVmomi.vim.Folder)
+        names = [name for name, obj in folders]
+
+        # Folder names are not unique, e.g. 'vm' and 'host' folders
+        items = [
+            pvc.widget.menu.MenuItem(
+                tag=name if names.count(name) == 1 else '{} ({})'.format(name, obj._moId),
+                description=obj._moId,
+                on_select=follow_events,
+                on_select_args=(self.agent, self.dialog, '{} ({})'.format(name, obj.__class__.__name__), obj)
+            ) for name, obj in folders
+        ]
+
+        menu = pvc.widget.menu.Menu(
+            items=items,
+            dialog=self.dialog,
+            title=self.title,
+            text='Select a folder to follow'
+        )
 
-class EventCollector(threading.Thread):
-    def __init__(self, agent, obj, path):
+        menu.display()
+
+
+def follow_events(agent, dialog, title, obj, sink=None):
+    """
+    Follow the latest events of one or more entities
+
+    Args:
+        agent              (VConnector): A VConnector instance
+        dialog          (dialog.Dialog): A Dialog instance
+        title                     (str): Title of the widget
+        obj         (vim.ManagedEntity): A Managed Entity or a list of Managed Entities
+        sink            (JsonEventSink): An event sink to also write the events to
+
+    """
+    dialog.infobox(
+        title=title,
+        text='Retrieving information ...'
+    )
+
+    fd, path = tempfile.mkstemp(prefix='pvcevents-')
+
+    # We need to create the destination file where events
+    # will be appended to because we don't know exactly how long
+    # the event history collector will take to put any new
+    # data in the file, so the operation can take long enough
+    # to create the file and dialog(1) needs a valid and
+    # already existing file in order to display the widget
+    with open(path, 'w'):
+        pass
+
+    dialog.infobox(
+        title=title,
+        text='Starting event collector ...'
+    )
+
+    collector = EventCollector(
+        agent=agent,
+        obj=obj,
+        path=path,
+        store_path=pvc.eventstore.store_path(),
+        sink=sink
+    )
+    collector.start()
+
+    # Give it some time to save the latest events
+    # before displaying the widget
+    collector.ready.wait(3)
+
+    dialog.tailbox(
+        filepath=path,
+        title=title,
+    )
+
+    collector.signal_stop()
+    collector.join(1)
+    os.unlink(path)
+
+
+class EventPager(object):
+    def __init__(self, collector, page_size):
         """
-        Event Collector Thread
+        Pages through the events of an event history collector
+
+        Only the current page of events is kept in memory and
+        pages are read from the collector as they are requested.
+
+        The position of the collector is kept either at the start
+        or at the end of the current page, so that moving to an
+        adjacent page takes no more than two requests.
 
         Args:
-            agent        (VConnector): A VConnector instance
-            obj   (vim.ManagedEntity): A Managed Entity
-            path                (str): Path where new events are appended to
+            collector (vim.event.EventHistoryCollector): A collector instance
+            page_size                           (int): Number of events in a page
+
+        """
+        self.collector = collector
+        self.page_size = page_size
+        self.page = []
+        self.at_start = True
 
+    def latest(self):
         """
-        super().__init__()
-        self.daemon = True
-        self.time_to_die = threading.Event()
+        Move to the page of the latest events
+
+        Returns:
+            True if the page contains any events, False otherwise
 
+        """
+        self.collector.SetCollectorPageSize(maxCount=self.page_size)
+
+        # Moves the collector right before the latest page
+        self.collector.ResetCollector()
+        self.page = sorted(self.collector.latestPage, key=lambda e: e.key)
+        self.at_start = True
+
+        return bool(self.page)
+
+    def older(self):
+        """
+        Move to the page of events preceding the current page
+
+        Returns:
+            True if the page was changed, False if there are no older events
+
+        """
+        if not self.at_start and self.page:
+            self.collector.ReadPreviousEvents(maxCount=len(self.page))
+            self.at_start = True
+
+        events = self.collector.ReadPreviousEvents(maxCount=self.page_size)
+        if not events:
+            return False
+
+        self.page = sorted(events, key=lambda e: e.key)
+
+        return True
+
+    def newer(self):
+        """
+        Move to the page of events following the current page
+
+        Returns:
+            True if the page was changed, False if there are no newer events
+
+        """
+        if self.at_start and self.page:
+            self.collector.ReadNextEvents(maxCount=len(self.page))
+            self.at_start = False
+
+        events = self.collector.ReadNextEvents(maxCount=self.page_size)
+        if not events:
+            return False
+
+        self.page = sorted(events, key=lambda e: e.key)
+
+        return True
+
+
+class EventHistoryWidget(object):
+    def __init__(self, agent, dialog, obj):
+        """
+        Widget for browsing the historical events of an entity
+
+        Events can be filtered by time range, event type and user.
+
+        Args:
+            agent         (VConnector): A VConnector instance
+            dialog     (dialog.Dialog): A Dialog instance
+            obj    (vim.ManagedEntity): A Managed Entity
+
+        """
         self.agent = agent
+        self.dialog = dialog
         self.obj = obj
-        self.path = path
-        self.last_event_key = 0
+        self.title = '{} ({})'.format(self.obj.name, self.obj.__class__.__name__)
+        self.display()
 
-    def run(self):
-        entity_filter_spec = pyVmomi.vim.event.EventFilterSpec.ByEntity(
-            entity=self.obj,
-            recursion=pyVmomi.vim.event.EventFilterSpec.RecursionOption.all
+    def display(self):
+        filter_spec = self.select_filter()
+        if not filter_spec:
+            return
+
+        self.dialog.infobox(
+            title=self.title,
+            text='Retrieving information ...'
         )
 
+        store_path = pvc.eventstore.store_path()
+        if store_path:
+            self.browse_store(filter_spec, store_path)
+            return
+
+        collector = self.agent.si.content.eventManager.CreateCollectorForEvents(
+            filter=filter_spec
+        )
+
+        try:
+            self.browse(EventPager(collector=collector, page_size=self.page_size()))
+        finally:
+            collector.DestroyCollector()
+
+    def page_size(self):
+        """
+        Calculate the number of events in a page based on the terminal size
+
+        """
+        columns, lines = shutil.get_terminal_size()
+
+        return max(lines - 12, 5)
+
+    def browse_store(self, filter_spec, path):
+        """
+        Browse the events using the local event store
+
+        Only the parts of the time range which are not yet present
+        in the store are retrieved from the server.
+
+        Args:
+            filter_spec (vim.event.EventFilterSpec): The events to browse
+            path                             (str): Path to the event store
+
+        """
+        store = pvc.eventstore.EventStore(path)
+        about = self.agent.si.content.about
+        server = about.instanceUuid if about.instanceUuid else self.agent.host
+        end_time = min(filter_spec.time.endTime, self.agent.si.CurrentTime())
+
+        try:
+            for start, end in store.gaps(server, self.obj._moId, filter_spec.time.beginTime, end_time):
+                self.fetch_events(store, server, start, end)
+
+            pager = pvc.eventstore.StoredEventPager(
+                store=store,
+                server=server,
+                entity=self.obj._moId,
+                filter_spec=filter_spec,
+                page_size=self.page_size()
+            )
+            self.browse(pager)
+        finally:
+            store.close()
+
+    def fetch_events(self, store, server, start_time, end_time):
+        """
+        Retrieve all events of the entity within a time range into the store
+
+        Args:
+            store (pvc.eventstore.EventStore): An EventStore instance
+            server                     (str): Instance UUID of the vCenter server
+            start_time   (datetime.datetime): Start of the time range
+            end_time     (datetime.datetime): End of the time range
+
+        """
         filter_spec = pyVmomi.vim.event.EventFilterSpec(
             disableFullMessage=False,
-            entity=entity_filter_spec
+            entity=pyVmomi.vim.event.EventFilterSpec.ByEntity(
+                entity=self.obj,
+                recursion=pyVmomi.vim.event.EventFilterSpec.RecursionOption.all
+            ),
+            time=pyVmomi.vim.event.EventFilterSpec.ByTime(
+                beginTime=start_time,
+                endTime=end_time
+            )
         )
 
         collector = self.agent.si.content.eventManager.CreateCollectorForEvents(
             filter=filter_spec
         )
 
-        while not self.time_to_die.is_set():
-            latest_events = self.get_latest_events(collector)
-            if latest_events:
-                self.save_events(latest_events)
-            time.sleep(1)
+        try:
+            collector.RewindCollector()
+            while True:
+                events = collector.ReadNextEvents(maxCount=EventCollector.PAGE_SIZE)
+                if not events:
+                    break
+                store.add(server, events, entity=self.obj._moId)
+        finally:
+            collector.DestroyCollector()
 
-        collector.DestroyCollector()
+        store.add_coverage(server, self.obj._moId, start_time, end_time)
 
-    def signal_stop(self):
+    def select_filter(self):
         """
-        Signal the thread that it's time to die
+        Prompts the user for the events to browse
+
+        Returns:
+            A vim.event.EventFilterSpec instance or None if
+            no valid filter has been provided
 
         """
-        self.time_to_die.set()
+        time_format = '%Y-%m-%d %H:%M:%S'
+        now = self.agent.si.CurrentTime()
+        start = now - datetime.timedelta(days=1)
+
+        elements = [
+            pvc.widget.form.FormElement(
+                label='Start',
+                item=start.strftime(time_format)
+            ),
+            pvc.widget.form.FormElement(
+                label='End',
+                item=now.strftime(time_format)
+            ),
+            pvc.widget.form.FormElement(
+                label='Event types',
+                item=''
+            ),
+            pvc.widget.form.FormElement(
+                label='Users',
+                item=''
+            ),
+        ]
+
+        form = pvc.widget.form.Form(
+            dialog=self.dialog,
+            form_elements=elements,
+            title=self.title,
+            text=(
+                'Time range of the events (UTC, {}).\n'
+                'Event types and users are comma-separated lists, '
+                'e.g. VmPoweredOnEvent, VmPoweredOffEvent'.format(time_format.replace('%', ''))
+            )
+        )
 
-    def get_latest_events(self, collector):
+        code, fields = form.display()
+        if code in (self.dialog.CANCEL, self.dialog.ESC):
+            return None
+
+        try:
+            start_time = datetime.datetime.strptime(fields['Start'], time_format).replace(tzinfo=now.tzinfo)
+            end_time = datetime.datetime.strptime(fields['End'], time_format).replace(tzinfo=now.tzinfo)
+        except ValueError:
+            start_time = end_time = None
+
+        if not start_time or start_time >= end_time:
+            self.dialog.msgbox(
+                title=self.title,
+                text='Invalid time range provided'
+            )
+            return None
+
+        filter_spec = pyVmomi.vim.event.EventFilterSpec(
+            disableFullMessage=False,
+            entity=pyVmomi.vim.event.EventFilterSpec.ByEntity(
+                entity=self.obj,
+                recursion=pyVmomi.vim.event.EventFilterSpec.RecursionOption.all
+            ),
+            time=pyVmomi.vim.event.EventFilterSpec.ByTime(
+                beginTime=start_time,
+                endTime=end_time
+            )
+        )
+
+        event_types = [t.strip() for t in fields['Event types'].split(',') if t.strip()]
+        if event_types:
+            filter_spec.eventTypeId = event_types
+
+        users = [u.strip() for u in fields['Users'].split(',') if u.strip()]
+        if users:
+            filter_spec.userName = pyVmomi.vim.event.EventFilterSpec.ByUsername(
+                systemUser=False,
+                userList=users
+            )
+
+        return filter_spec
+
+    def browse(self, pager):
         """
-        Get latest events up to the last known event
+        Browse events page by page
 
         Args:
-            collector (vim.event.EventHistoryCollector): A collector instance
-
-        Returns:
-            A list of the latest events
+            pager (EventPager): An EventPager or pvc.eventstore.StoredEventPager instance
 
         """
-        latest_events = []
-        latest_page = collector.latestPage
-        for e in latest_page:
-            if e.key == self.last_event_key:
+        columns, lines = shutil.get_terminal_size()
+
+        if not pager.latest():
+            self.dialog.msgbox(
+                title=self.title,
+                text='No events found'
+            )
+            return
+
+        default_item = ''
+        while True:
+            events = {str(e.key): e for e in pager.page}
+            choices = [
+                (str(e.key), self.format_event(e))
+                for e in reversed(pager.page)
+            ]
+            text = 'Events from {} to {}, newest first'.format(
+                pager.page[0].createdTime.strftime('%Y-%m-%d %H:%M:%S'),
+                pager.page[-1].createdTime.strftime('%Y-%m-%d %H:%M:%S')
+            )
+
+            code, tag = self.dialog.menu(
+                title=self.title,
+                text=text,
+                choices=choices,
+                default_item=default_item,
+                height=lines - 2,
+                width=columns - 4,
+                menu_height=pager.page_size,
+                ok_label='Details',
+                cancel_label='Back',
+                extra_button=True,
+                extra_label='Older',
+                help_button=True,
+                help_label='Newer'
+            )
+
+            if code in (self.dialog.CANCEL, self.dialog.ESC):
                 break
-            else:
-                latest_events.append(e)
+            elif code == self.dialog.EXTRA:
+                default_item = ''
+                if not pager.older():
+                    self.dialog.msgbox(title=self.title, text='No older events')
+            elif code == self.dialog.HELP:
+                default_item = ''
+                if not pager.newer():
+                    self.dialog.msgbox(title=self.title, text='No newer events')
+            elif tag in events:
+                default_item = tag
+                self.details(events[tag])
+
+    def format_event(self, event):
+        """
+        Format an event as a single line
 
-        # The last event is the one with the largest key
-        self.last_event_key = max([e.key for e in latest_page])
-        latest_events.sort(key=lambda x: x.key)
+        """
+        message = ' '.join((event.fullFormattedMessage or '').split())
+        if event.userName:
+            return '{} {}: {}'.format(event.createdTime.strftime('%Y-%m-%d %H:%M:%S'), event.userName, message)
 
-        return latest_events
+        return '{} {}'.format(event.createdTime.strftime('%Y-%m-%d %H:%M:%S'), message)
 
-    def save_events(self, events):
+    def details(self, event):
         """
-        Append new events to a file
+        Display the details of an event
 
         Args:
-            events (list): A list of vim.event.Event instances
+            event (vim.event.Event): The event to display
 
         """
-        with open(self.path, 'a') as f:
-            for e in events:
-                if e.userName:
-                    f.write('[{}]: User {}: {}\n'.format(str(e.createdTime), e.userName, e.fullFormattedMessage))
-                else:
-                    f.write('[{}]: {}\n'.format(str(e.createdTime), e.fullFormattedMessage))
+        text = (
+            'Key: {}\n'
+            'Time: {}\n'
+            'Type: {}\n'
+            'User: {}\n\n'
+            '{}\n'
+        ).format(
+            event.key,
+            event.createdTime,
+            pvc.eventstore.event_type_id(event),
+            event.userName or '-',
+            event.fullFormattedMessage
+        )
+
+        self.dialog.msgbox(
+            title=self.title,
+            text=text,
+            width=70
+        )
@@ -41,6 +41,7 @@ import pvc.widget.menu
 import pvc.widget.form
 import pvc.widget.network
 import pvc.widget.performance
+import pvc.widget.top
 import pvc.widget.virtualmachine
 
 __all__ = [
@@ -103,6 +104,12 @@ class HostSystemWidget(object):
                 on_select=pvc.widget.performance.PerformanceProviderWidget,
                 on_select_args=(self.agent, self.dialog, self.obj)
             ),
+            pvc.widget.menu.MenuItem(
+                tag='Top',
+                description='Live resource usage ranking',
+                on_select=pvc.widget.top.TopWidget,
+                on_select_args=(self.agent, self.dialog, self.obj)
+            ),
             pvc.widget.menu.MenuItem(
                 tag='Events',
                 description='View Events',
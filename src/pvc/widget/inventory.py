@@ -29,9 +29,11 @@ Inventory Widgets
 
 import pyVmomi
 
+import pvc.widget.alarm
 import pvc.widget.common
 import pvc.widget.menu
 import pvc.widget.datastore
+import pvc.widget.event
 import pvc.widget.hostsystem
 import pvc.widget.network
 import pvc.widget.radiolist
@@ -92,6 +94,24 @@ class InventoryWidget(object):
                 description='Manage Networking',
                 on_select=self.network_menu
             ),
+            pvc.widget.menu.MenuItem(
+                tag='Alarms',
+                description='View triggered alarms of all entities',
+                on_select=pvc.widget.alarm.AlarmDashboardWidget,
+                on_select_args=(self.agent, self.dialog)
+            ),
+            pvc.widget.menu.MenuItem(
+                tag='Snapshots',
+                description='Create or remove snapshots in bulk',
+                on_select=pvc.widget.virtualmachine.BulkSnapshotWidget,
+                on_select_args=(self.agent, self.dialog)
+            ),
+            pvc.widget.menu.MenuItem(
+                tag='Events',
+                description='Follow events of multiple entities',
+                on_select=pvc.widget.event.AggregatedEventWidget,
+                on_select_args=(self.agent, self.dialog)
+            ),
             pvc.widget.menu.MenuItem(
                 tag='Search',
                 description='Search Inventory',
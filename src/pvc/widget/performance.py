@@ -28,12 +28,21 @@ Performance Metrics Widgets
 """
 
 import os
+import shutil
 import datetime
 import tempfile
 import subprocess
+import collections
 
+import numpy
 import pyVmomi
 
+import pvc.perf
+import pvc.stats
+import pvc.cache
+import pvc.export
+import pvc.downsample
+import pvc.widget.chart
 import pvc.widget.menu
 import pvc.widget.form
 import pvc.widget.checklist
@@ -42,7 +51,7 @@ import pvc.widget.radiolist
 __all__ = [
     'PerformanceProviderWidget', 'PerformanceGroupWidget',
     'PerformanceCounterInGroupWidget', 'PerformanceCounterWidget',
-    'PerformanceCounterGraphWidget',
+    'PerformanceCounterGraphWidget', 'PerformanceOverlayGraphWidget',
 ]
 
 
@@ -77,6 +86,11 @@ class PerformanceProviderWidget(object):
                 on_select=PerformanceGroupWidget,
                 on_select_args=(self.agent, self.dialog, self.obj)
             ),
+            pvc.widget.menu.MenuItem(
+                tag='Overlay',
+                description='Graph of multiple counters',
+                on_select=self.overlay
+            ),
         ]
 
         menu = pvc.widget.menu.Menu(
@@ -88,6 +102,35 @@ class PerformanceProviderWidget(object):
 
         menu.display()
 
+    def overlay(self):
+        """
+        Graph multiple performance counters in a single view
+
+        """
+        items = [
+            pvc.widget.menu.MenuItem(
+                tag='Real-time',
+                description='Real-time performance metrics',
+                on_select=PerformanceOverlayGraphWidget,
+                on_select_args=(self.agent, self.dialog, self.obj, True)
+            ),
+            pvc.widget.menu.MenuItem(
+                tag='Historical',
+                description='Historical performance metrics',
+                on_select=PerformanceOverlayGraphWidget,
+                on_select_args=(self.agent, self.dialog, self.obj, False)
+            ),
+        ]
+
+        menu = pvc.widget.menu.Menu(
+            items=items,
+            dialog=self.dialog,
+            title=self.title,
+            text='Select the type of performance metrics to graph',
+        )
+
+        menu.display()
+
     def summary(self):
         """
         Performance provider summary information
@@ -457,9 +500,33 @@ class PerformanceCounterWidget(object):
 
 
 class PerformanceCounterGraphWidget(object):
+    # Series which can be derived from the samples of the graph
+    DERIVED = collections.OrderedDict([
+        ('raw', 'Samples as reported by the server'),
+        ('rate', 'Rate of change per second'),
+        ('per-cpu', 'Normalized per CPU'),
+        ('ratio', 'Ratio of two series'),
+        ('rolling', 'Rolling average'),
+    ])
+
+    # Number of samples in the window of rolling averages
+    ROLLING_WINDOW = 15
+
+    # Minimum size of the chart in characters on small terminals
+    MIN_CHART_WIDTH = 20
+    MIN_CHART_HEIGHT = 4
+
     def __init__(self, agent, dialog, obj, counter, realtime):
         """
-        Widget to plot a gnuplot(1) graph of a performance counter
+        Widget to plot a graph of a performance counter
+
+        Graphs are rendered directly in the terminal by default.
+        Set the PVC_GRAPH_BACKEND environment variable to 'gnuplot'
+        in order to plot graphs using gnuplot(1) instead.
+
+        Dense series are downsampled to the width of the graph using
+        the method set in the PVC_GRAPH_DOWNSAMPLE environment
+        variable - 'minmax' (default) or 'lttb'.
 
         Args:
             agent                           (VConnector): A VConnector instance
@@ -478,80 +545,348 @@ class PerformanceCounterGraphWidget(object):
         self.dialog = dialog
         self.obj = obj
         self.counter = counter
+        self.counters = {counter.key: counter} if counter else {}
         self.realtime = realtime
         self.pm = self.agent.si.content.perfManager
         self.title = '{} ({})'.format(self.obj.name, self.obj.__class__.__name__)
+        self.backend = os.environ.get('PVC_GRAPH_BACKEND', 'native')
+        self.downsampling = self.downsample_method()
+        self.labels = collections.OrderedDict()
+        self.samples = collections.OrderedDict()
+        self.derived = 'raw'
+        self.ratio = None
+        self.metric_id = []
+        self.historical_range = None
+        self.datafile = None
+        self.script = None
         self.display()
 
     def display(self):
+        if self.backend == 'gnuplot' and not self.gnuplot_is_available():
+            return
+
+        metrics = self.select_metrics()
+        if not metrics:
+            self.dialog.msgbox(
+                title=self.title,
+                text='No counter instances selected'
+            )
+            return
+
+        metric_id = list(metrics.values())
+        self.metric_id = metric_id
+        self.labels = collections.OrderedDict(
+            (pvc.perf.metric_key(m), label) for label, m in metrics.items()
+        )
+        self.samples = collections.OrderedDict(
+            (label, (numpy.empty(0, dtype=numpy.int64), numpy.empty(0))) for label in metrics
+        )
+
+        if self.backend == 'gnuplot':
+            fd, self.datafile = tempfile.mkstemp(prefix='pvcgnuplot-data-')
+            self.script = self.create_gnuplot_script(
+                datafile=self.datafile,
+                instances=list(metrics.keys())
+            )
+
+        try:
+            if self.realtime:
+                self.realtime_graph(metric_id)
+            else:
+                self.historical_graph(metric_id)
+        finally:
+            if self.backend == 'gnuplot':
+                os.unlink(self.datafile)
+                os.unlink(self.script)
+
+    def downsample_method(self):
+        """
+        Get the method used for downsampling dense series
+
+        Returns:
+            The method set in the PVC_GRAPH_DOWNSAMPLE environment
+            variable or 'minmax' if it is not set or not supported
+
+        """
+        method = os.environ.get('PVC_GRAPH_DOWNSAMPLE', 'minmax')
+        if method not in pvc.downsample.METHODS:
+            return 'minmax'
+
+        return method
+
+    def gnuplot_is_available(self):
+        """
+        Check whether gnuplot(1) can be used for plotting graphs
+
+        Returns:
+            True if gnuplot(1) is available, False otherwise
+
+        """
         try:
             subprocess.Popen(
                 args=['gnuplot', '--version'],
                 stdout=subprocess.PIPE,
                 stderr=subprocess.PIPE
-            )
+            ).communicate()
         except OSError as e:
             self.dialog.msgbox(
                 title=self.title,
                 text='Unable to find gnuplot(1): \n{}\n'.format(e)
             )
-            return
+            return False
+
+        return True
+
+    def query_performance_samples(self, metric_id, interval_id, start_time, end_time):
+        """
+        Query the performance manager for historical samples
+
+        The time range is split into smaller windows, which
+        are retrieved concurrently and merged in order. Samples
+        already present in the local cache are not retrieved again.
+        Windows which could not be retrieved are reported and skipped.
 
-        selected_instances = self.select_counter_instances()
-        if not selected_instances:
+        Args:
+            metric_id                (list): A list of vim.PerformanceManager.MetricId instances
+            interval_id               (int): Sampling period of the historical interval
+            start_time (datetime.datetime): Start of the time range
+            end_time   (datetime.datetime): End of the time range
+
+        Returns:
+            An ordered dict mapping metric keys to a list of
+            (timestamp, value) tuples
+
+        """
+        about = self.agent.si.content.about
+        errors = []
+
+        samples = pvc.perf.query_historical_samples(
+            pm=self.pm,
+            entity=self.obj,
+            metric_id=metric_id,
+            interval_id=interval_id,
+            start_time=start_time,
+            end_time=end_time,
+            cache=pvc.cache.PerformanceCache(),
+            cache_id=about.instanceUuid if about.instanceUuid else self.agent.host,
+            errors=errors
+        )
+
+        if errors:
             self.dialog.msgbox(
                 title=self.title,
-                text='No counter instances selected'
+                text='{} of the performance queries failed, the graph may have gaps'.format(len(errors))
             )
-            return
 
-        metric_id = [
-            pyVmomi.vim.PerformanceManager.MetricId(
-                counterId=self.counter.key,
-                instance='' if instance == self.obj.name else instance
-            ) for instance in selected_instances
-        ]
+        return samples
 
-        fd, datafile = tempfile.mkstemp(prefix='pvcgnuplot-data-')
-        script = self.create_gnuplot_script(
-            datafile=datafile,
-            instances=selected_instances
-        )
+    def add_performance_samples(self, samples):
+        """
+        Add performance samples to the samples of the graph
 
-        if self.realtime:
-            self.realtime_graph(metric_id, datafile, script)
-        else:
-            self.historical_graph(metric_id, datafile, script)
+        Sample values are scaled to the units of their
+        counters, e.g. values of counters measured in percent
+        are divided by a hundred, as the returned sample value
+        represents a 1/100th of the percent.
+
+        Args:
+            samples (dict): A dict mapping metric keys to a list of
+                            (timestamp, value) tuples
+
+        """
+        series = pvc.perf.sample_arrays(samples, self.counters)
+
+        for key, (timestamps, values) in series.items():
+            if key not in self.labels:
+                continue
+
+            label = self.labels[key]
+            old_timestamps, old_values = self.samples[label]
+            timestamps = numpy.concatenate((old_timestamps, timestamps))
+            values = numpy.concatenate((old_values, values))
 
-        os.unlink(datafile)
-        os.unlink(script)
+            # Real-time graphs display the samples from the past hour only
+            if self.realtime and len(timestamps):
+                keep = timestamps >= timestamps[-1] - 3600
+                timestamps, values = timestamps[keep], values[keep]
 
-    def save_performance_samples(self, path, data):
+            self.samples[label] = (timestamps, values)
+
+        if self.backend == 'gnuplot':
+            self.save_performance_samples(
+                path=self.datafile,
+                series=series
+            )
+
+    def save_performance_samples(self, path, series):
         """
         Save performance samples to a file
 
         New samples are appended to the file
 
-        NOTE: If the performance counter unit is percentage we need
-              to make sure that the sample value is divided by
-              a hundred, as the returned sample value
-              represents a 1/100th of the percent.
-
         Args:
-            path                                      (str): Path to the datafile
-            data  (vim.PerformanceManager.EntityMetricBase): The data to be saved
+            path     (str): Path to the datafile
+            series  (dict): A dict mapping metric keys to a tuple of
+                            the timestamps and scaled values, as
+                            returned by pvc.perf.sample_arrays()
 
         """
-        all_values = [v.value for v in data.value]
-        samples = zip(data.sampleInfo, *all_values)
+        labels = list(self.samples.keys())
+        columns = [
+            (labels.index(self.labels[key]) + 1, timestamps, values)
+            for key, (timestamps, values) in series.items() if key in self.labels
+        ]
+        if not columns:
+            return
+
+        # One row per timestamp, with the samples of each series
+        # in its own column and NaN for the missing samples
+        timestamps = numpy.unique(numpy.concatenate([c[1] for c in columns]))
+        rows = numpy.full((len(timestamps), len(labels) + 1), numpy.nan)
+        rows[:, 0] = timestamps
+        for column, t, values in columns:
+            rows[numpy.searchsorted(timestamps, t), column] = values
 
         with open(path, 'a') as f:
-            for sample in samples:
-                timestamp, values = sample[0].timestamp, sample[1:]
-                if self.counter.unitInfo.key == 'percent':
-                    f.write('{},{}\n'.format(str(timestamp), ','.join([str(v / 100) for v in values])))
-                else:
-                    f.write('{},{}\n'.format(str(timestamp), ','.join([str(v) for v in values])))
+            numpy.savetxt(f, rows, fmt=['%d'] + ['%.10g'] * len(labels), delimiter=',')
+
+    def is_percent(self):
+        """
+        Check whether all graphed counters are measured in percent
+
+        """
+        return bool(self.counters) and all(
+            c.unitInfo.key == 'percent' for c in self.counters.values()
+        )
+
+    def graph_title(self):
+        """
+        Get the title of the graph
+
+        """
+        return self.counter.nameInfo.label
+
+    def num_cpu(self):
+        """
+        Get the number of CPUs of the entity
+
+        Returns:
+            The number of virtual CPUs of a Virtual Machine, the
+            number of logical CPUs of a host or None otherwise
+
+        """
+        if isinstance(self.obj, pyVmomi.vim.VirtualMachine):
+            config = self.obj.config
+            return config.hardware.numCPU if config else None
+        elif isinstance(self.obj, pyVmomi.vim.HostSystem):
+            return self.obj.summary.hardware.numCpuThreads
+
+        return None
+
+    def derived_samples(self):
+        """
+        Derive the series selected for the graph from the samples
+
+        Returns:
+            An ordered dict mapping the labels of the series
+            to a tuple of the timestamps and values of the series
+
+        """
+        if self.derived == 'raw' or not self.samples:
+            return self.samples
+
+        result = collections.OrderedDict()
+        if self.derived == 'ratio':
+            numerator, denominator = self.ratio
+            timestamps, values, reference_values = pvc.stats.align(
+                self.samples[numerator],
+                self.samples[denominator]
+            )
+            result[self.ratio_label()] = (timestamps, pvc.stats.ratio(values, reference_values))
+            return result
+
+        num_cpu = self.num_cpu()
+        for label, (timestamps, values) in self.samples.items():
+            if self.derived == 'rate':
+                values = pvc.stats.rate(timestamps, values)
+            elif self.derived == 'per-cpu' and num_cpu:
+                values = pvc.stats.per_cpu(values, num_cpu)
+            elif self.derived == 'rolling':
+                values = pvc.stats.rolling_mean(values, self.ROLLING_WINDOW)
+            result[label] = (timestamps, values)
+
+        return result
+
+    def ratio_label(self):
+        """
+        Get the expression of the selected ratio, e.g. 'cpu.ready / cpu.used'
+
+        """
+        return '{} / {}'.format(*self.ratio)
+
+    def unit_label(self):
+        """
+        Get the label of the units of the graphed counters
+
+        """
+        return ', '.join(sorted(set(c.unitInfo.label for c in self.counters.values())))
+
+    def chart_size(self):
+        """
+        Calculate the size of the chart based on the terminal size
+
+        Returns:
+            A tuple of the (width, height) of the chart in characters
+
+        """
+        columns, lines = shutil.get_terminal_size()
+
+        return (max(columns - 24, self.MIN_CHART_WIDTH), max(lines - 16, self.MIN_CHART_HEIGHT))
+
+    def render_chart(self):
+        """
+        Render a chart of the collected performance samples
+
+        Returns:
+            The rendered chart as a string
+
+        """
+        width, height = self.chart_size()
+        percent = self.is_percent() and self.derived in ('raw', 'per-cpu', 'rolling')
+
+        title = '{} - {} ({})'.format(
+            self.obj.name,
+            self.graph_title(),
+            self.unit_label()
+        )
+        if self.derived == 'ratio':
+            title = '{} - {}'.format(title, self.ratio_label())
+        elif self.derived != 'raw':
+            title = '{} - {}'.format(title, self.DERIVED[self.derived])
+
+        chart = pvc.widget.chart.Chart(
+            width=width,
+            height=height,
+            ymin=0 if percent else None,
+            ymax=100 if percent else None,
+            title=title
+        )
+
+        # Each character of the chart holds two points horizontally
+        for label, (timestamps, values) in self.derived_samples().items():
+            x, y = pvc.downsample.downsample(
+                x=timestamps,
+                y=values,
+                points=width * 2,
+                method=self.downsampling
+            )
+            chart.add_series(
+                label=label,
+                x=x.tolist(),
+                y=y.tolist()
+            )
+
+        return chart.render()
 
     def create_gnuplot_script(self, datafile, instances):
         """
@@ -583,12 +918,13 @@ class PerformanceCounterGraphWidget(object):
             "set term {term}\n"
             "set grid\n"
             "set xdata time\n"
-            "set timefmt '%Y-%m-%d %H:%M:%S+00:00'\n"
+            "set timefmt '%s'\n"
             "# set format x '%H:%M:%S'\n"
             "set xlabel 'Time'\n"
             "set ylabel '{unit}'\n"
             "set key outside right center\n"
             "set datafile separator ','\n"
+            "set datafile missing 'nan'\n"
             "set autoscale fix\n"
             "set yrange [{yrange}]\n"
             "plot {lines}\n"
@@ -611,13 +947,13 @@ class PerformanceCounterGraphWidget(object):
             pause = -1
 
         # Set a yrange for counters which unit is percentage
-        yrange = '0:100' if self.counter.unitInfo.key == 'percent' else ''
+        yrange = '0:100' if self.is_percent() else ''
 
         gnuplot_script = script_template.format(
             name=self.obj.name,
-            title=self.counter.nameInfo.summary,
+            title=self.graph_title(),
             term=gnuplot_term,
-            unit=self.counter.unitInfo.label,
+            unit=self.unit_label(),
             lines=', '.join(lines),
             pause=pause,
             yrange=yrange
@@ -629,6 +965,22 @@ class PerformanceCounterGraphWidget(object):
 
         return path
 
+    def select_metrics(self):
+        """
+        Prompts the user to select the metrics to graph
+
+        Returns:
+            An ordered dict mapping the labels of the graph
+            series to vim.PerformanceManager.MetricId instances
+
+        """
+        return collections.OrderedDict(
+            (instance, pyVmomi.vim.PerformanceManager.MetricId(
+                counterId=self.counter.key,
+                instance='' if instance == self.obj.name else instance
+            )) for instance in self.select_counter_instances()
+        )
+
     def select_counter_instances(self):
         """
         Prompts the user to select counter instances
@@ -697,14 +1049,65 @@ class PerformanceCounterGraphWidget(object):
 
         return radiolist.display()
 
-    def realtime_graph(self, metric_id, datafile, script):
+    def select_time_range(self, interval):
+        """
+        Prompts the user to select a time range for a historical interval
+
+        Args:
+            interval (vim.HistoricalInterval): The selected historical interval
+
+        Returns:
+            A tuple of the (start, end) time of the range or
+            None if no valid time range has been provided
+
+        """
+        time_format = '%Y-%m-%d %H:%M:%S'
+        now = self.agent.si.CurrentTime()
+        start = now - datetime.timedelta(seconds=interval.length)
+
+        elements = [
+            pvc.widget.form.FormElement(
+                label='Start',
+                item=start.strftime(time_format)
+            ),
+            pvc.widget.form.FormElement(
+                label='End',
+                item=now.strftime(time_format)
+            ),
+        ]
+
+        form = pvc.widget.form.Form(
+            dialog=self.dialog,
+            form_elements=elements,
+            title=self.title,
+            text='Time range of the graph (UTC, {})'.format(time_format.replace('%', ''))
+        )
+
+        code, fields = form.display()
+        if code in (self.dialog.CANCEL, self.dialog.ESC):
+            return None
+
+        try:
+            start_time = datetime.datetime.strptime(fields['Start'], time_format).replace(tzinfo=now.tzinfo)
+            end_time = datetime.datetime.strptime(fields['End'], time_format).replace(tzinfo=now.tzinfo)
+        except ValueError:
+            start_time = end_time = None
+
+        if not start_time or start_time >= end_time:
+            self.dialog.msgbox(
+                title=self.title,
+                text='Invalid time range provided'
+            )
+            return None
+
+        return (start_time, end_time)
+
+    def realtime_graph(self, metric_id):
         """
         Plot a real-time graph
 
         Args:
             metric_id (list): A list of vim.PerformanceManager.MetricId instances
-            datafile   (str): Path to a datafile to store collected samples
-            script     (str): Path to a gnuplot(1) script used to plot the graph
 
         """
         self.dialog.infobox(
@@ -717,31 +1120,25 @@ class PerformanceCounterGraphWidget(object):
         )
         interval_id = provider_summary.refreshRate
 
-        # Query spec to get data from the past hour
+        # Start with the samples from the past hour and then
+        # continuously get any new performance data, using
+        # a single query spec for all metrics on each refresh
         one_hour_ago = self.agent.si.CurrentTime() - datetime.timedelta(seconds=3600)
-        query_spec_last_hour = pyVmomi.vim.PerformanceManager.QuerySpec(
+        poller = pvc.perf.RealtimePoller(
+            pm=self.pm,
             entity=self.obj,
-            metricId=metric_id,
-            intervalId=interval_id,
-            startTime=one_hour_ago
-        )
-        data = self.pm.QueryPerf(querySpec=[query_spec_last_hour]).pop()
-        self.save_performance_samples(
-            path=datafile,
-            data=data
-        )
-
-        # Query spec used to continuously get new performance data
-        query_spec = pyVmomi.vim.PerformanceManager.QuerySpec(
-            maxSample=1,
-            entity=self.obj,
-            metricId=metric_id,
-            intervalId=interval_id
+            metric_id=metric_id,
+            interval_id=interval_id,
+            start_time=one_hour_ago,
+            single_spec=True
         )
+        self.add_performance_samples(poller.poll())
 
-        p = subprocess.Popen(
-            args=['gnuplot', script]
-        )
+        p = None
+        if self.backend == 'gnuplot':
+            p = subprocess.Popen(
+                args=['gnuplot', self.script]
+            )
 
         text = (
             'Graph updates every {} seconds.\n\n'
@@ -750,56 +1147,481 @@ class PerformanceCounterGraphWidget(object):
         )
 
         while True:
-            data = self.pm.QueryPerf(querySpec=[query_spec]).pop()
-            self.save_performance_samples(
-                path=datafile,
-                data=data
-            )
-            code = self.dialog.pause(
-                title=self.title,
-                text=text.format(interval_id),
-                height=15,
-                width=60,
-                seconds=interval_id
-            )
+            if p:
+                code = self.dialog.pause(
+                    title=self.title,
+                    text=text.format(interval_id),
+                    height=15,
+                    width=60,
+                    seconds=interval_id,
+                    extra_button=True,
+                    extra_label='Options'
+                )
+            else:
+                columns, lines = shutil.get_terminal_size()
+                code = self.dialog.pause(
+                    title=self.title,
+                    text='{}\n\n{}'.format(self.render_chart(), text.format(interval_id)),
+                    height=lines - 2,
+                    width=columns - 4,
+                    seconds=interval_id,
+                    extra_button=True,
+                    extra_label='Options',
+                    colors=True,
+                    cr_wrap=True,
+                    no_collapse=True
+                )
+
             if code == self.dialog.CANCEL:
                 break
+            elif code == self.dialog.EXTRA:
+                self.options()
+
+            self.add_performance_samples(poller.poll())
 
-        p.terminate()
+        if p:
+            p.terminate()
 
-    def historical_graph(self, metric_id, datafile, script):
+    def historical_graph(self, metric_id):
         """
         Plot a historical graph
 
         Args:
             metric_id (list): A list of vim.PerformanceManager.MetricId instances
-            datafile   (str): Path to a datafile to store collected samples
-            script     (str): Path to a gnuplot(1) script used to plot the graph
 
         """
         code, interval = self.select_historical_interval()
         if code in (self.dialog.CANCEL, self.dialog.ESC) or not interval:
             return
 
+        historical_interval = [i for i in self.pm.historicalInterval if i.name == interval].pop()
+        time_range = self.select_time_range(historical_interval)
+        if not time_range:
+            return
+
+        self.dialog.infobox(
+            title=self.title,
+            text='Retrieving information ...'
+        )
+
+        start_time, end_time = time_range
+        self.historical_range = (historical_interval.samplingPeriod, start_time, end_time)
+        samples = self.query_performance_samples(
+            metric_id=metric_id,
+            interval_id=historical_interval.samplingPeriod,
+            start_time=start_time,
+            end_time=end_time
+        )
+        self.add_performance_samples(samples)
+
+        if self.backend == 'gnuplot':
+            p = subprocess.Popen(
+                args=['gnuplot', self.script]
+            )
+            p.wait()
+            return
+
+        while True:
+            columns, lines = shutil.get_terminal_size()
+            code = self.dialog.yesno(
+                title=self.title,
+                text=self.render_chart(),
+                height=lines - 2,
+                width=columns - 4,
+                yes_label='OK',
+                no_label='Options',
+                colors=True,
+                cr_wrap=True,
+                no_collapse=True
+            )
+
+            if code != self.dialog.CANCEL:
+                break
+
+            self.options()
+
+    def options(self):
+        """
+        Display a menu for changing the options of the graph
+
+        """
+        items = [
+            pvc.widget.menu.MenuItem(
+                tag='Statistics',
+                description='Summary statistics of the series',
+                on_select=self.statistics
+            ),
+            pvc.widget.menu.MenuItem(
+                tag='Export',
+                description='Export samples to a file',
+                on_select=self.export
+            ),
+        ]
+
+        # Derived series are plotted by the native backend only
+        if self.backend != 'gnuplot':
+            items.insert(0, pvc.widget.menu.MenuItem(
+                tag='Series',
+                description='Derived series to plot',
+                on_select=self.select_derived
+            ))
+
+        menu = pvc.widget.menu.Menu(
+            items=items,
+            dialog=self.dialog,
+            title=self.title,
+            text='Select an option'
+        )
+
+        menu.display()
+
+    def select_derived(self):
+        """
+        Prompts the user to select the derived series to plot
+
+        """
+        derived = list(self.DERIVED.keys())
+        if not self.num_cpu():
+            derived.remove('per-cpu')
+        if len(self.samples) < 2:
+            derived.remove('ratio')
+
+        items = [
+            pvc.widget.radiolist.RadioListItem(
+                tag=key,
+                description=self.DERIVED[key],
+                status='on' if key == self.derived else 'off'
+            ) for key in derived
+        ]
+
+        radiolist = pvc.widget.radiolist.RadioList(
+            items=items,
+            dialog=self.dialog,
+            title=self.title,
+            text='Select the series to plot'
+        )
+
+        code, tag = radiolist.display()
+        if code != self.dialog.OK or not tag:
+            return
+
+        if tag == 'ratio':
+            ratio = self.select_ratio()
+            if not ratio:
+                return
+            self.ratio = ratio
+
+        self.derived = tag
+
+    def select_ratio(self):
+        """
+        Prompts the user to select the numerator and denominator of a ratio
+
+        Returns:
+            A tuple of the labels of the numerator and denominator
+            series or None if no series have been selected
+
+        """
+        labels = list(self.samples.keys())
+        current = self.ratio or (labels[0], labels[1])
+
+        items = [
+            pvc.widget.radiolist.RadioListItem(
+                tag=label,
+                status='on' if label == current[0] else 'off'
+            ) for label in labels
+        ]
+
+        radiolist = pvc.widget.radiolist.RadioList(
+            items=items,
+            dialog=self.dialog,
+            title=self.title,
+            text='Select the numerator of the ratio'
+        )
+
+        code, numerator = radiolist.display()
+
+        if code != self.dialog.OK or not numerator:
+            return None
+
+        items = [
+            pvc.widget.radiolist.RadioListItem(
+                tag=label,
+                status='on' if label == current[1] else 'off'
+            ) for label in labels if label != numerator
+        ]
+
+        radiolist = pvc.widget.radiolist.RadioList(
+            items=items,
+            dialog=self.dialog,
+            title=self.title,
+            text='Select the denominator of the ratio {} / ...'.format(numerator)
+        )
+
+        code, denominator = radiolist.display()
+
+        if code != self.dialog.OK or not denominator:
+            return None
+
+        return (numerator, denominator)
+
+    def render_statistics(self):
+        """
+        Render the summary statistics of the plotted series as a table
+
+        Returns:
+            The rendered table as a string
+
+        """
+        line = '{:<32} {:>6} {:>9} {:>9} {:>9} {:>9} {:>9} {:>9}'
+        lines = [
+            line.format('SERIES', 'COUNT', 'MIN', 'AVG', 'P50', 'P95', 'P99', 'MAX'),
+        ]
+
+        for label, (timestamps, values) in self.derived_samples().items():
+            summary = pvc.stats.summary(values)
+            columns = [
+                '-' if numpy.isnan(v) else '{:.2f}'.format(v)
+                for k, v in summary.items() if k != 'count'
+            ]
+            lines.append(line.format(label[:32], summary['count'], *columns))
+
+        return '\n'.join(lines)
+
+    def statistics(self):
+        """
+        Display the summary statistics of the plotted series
+
+        """
+        columns, lines = shutil.get_terminal_size()
+        self.dialog.msgbox(
+            title=self.title,
+            text=self.render_statistics(),
+            height=lines - 2,
+            width=columns - 4,
+            cr_wrap=True,
+            no_collapse=True
+        )
+
+    def metric_names(self):
+        """
+        Get the counter names and instances of the graphed metrics
+
+        Returns:
+            A dict mapping metric keys to (counter, instance) tuples
+
+        """
+        names = {
+            c.key: '{}.{}.{}'.format(c.groupInfo.key, c.nameInfo.key, c.rollupType)
+            for c in self.counters.values()
+        }
+
+        return {
+            key: (names.get(key[0], str(key[0])), key[1])
+            for key in self.labels
+        }
+
+    def export_series(self):
+        """
+        Generate the row groups of an export
+
+        Samples of real-time graphs are exported as they are. Samples
+        of historical graphs are retrieved again a few windows at a
+        time, so that the whole time range is never kept in memory.
+
+        Yields:
+            A dict mapping (counter, instance) tuples to a tuple
+            of the timestamps and values of each metric
+
+        """
+        names = self.metric_names()
+
+        if self.realtime or not self.historical_range:
+            yield collections.OrderedDict(
+                (names[key], self.samples[label]) for key, label in self.labels.items()
+            )
+            return
+
+        interval_id, start_time, end_time = self.historical_range
+        planner = pvc.perf.QueryPlanner(interval_id=interval_id)
+        windows = planner.windows(start_time, end_time)
+        max_workers = 4
+
+        for i in range(0, len(windows), max_workers):
+            group = windows[i:i + max_workers]
+            batches = planner.plan([self.obj], self.metric_id, group[0][0], group[-1][1])
+            samples = pvc.perf.query_perf_parallel(self.pm, batches, max_workers).get(self.obj._moId, {})
+            series = pvc.perf.sample_arrays(samples, self.counters)
+            yield collections.OrderedDict(
+                (names[key], arrays) for key, arrays in series.items() if key in names
+            )
+
+    def export(self):
+        """
+        Export the samples of the graph to a columnar file
+
+        Samples are exported to Parquet files if pyarrow is
+        installed or to NumPy .npz archives otherwise.
+
+        """
+        default_path = os.path.join(
+            os.path.expanduser('~'),
+            '{}-{}{}'.format(
+                self.obj.name,
+                datetime.datetime.now().strftime('%Y%m%d%H%M%S'),
+                pvc.export.default_extension()
+            )
+        )
+
+        code, path = self.dialog.inputbox(
+            title=self.title,
+            text='Path to the export file (.parquet or .npz)',
+            init=default_path,
+            width=max(60, len(default_path) + 10)
+        )
+
+        if code in (self.dialog.CANCEL, self.dialog.ESC):
+            return
+
+        self.dialog.infobox(
+            title=self.title,
+            text='Exporting samples ...'
+        )
+
+        try:
+            writer = pvc.export.sample_writer(path)
+            try:
+                for series in self.export_series():
+                    writer.write(series)
+            finally:
+                writer.close()
+        except (OSError, ValueError, pyVmomi.vim.MethodFault) as e:
+            self.dialog.msgbox(
+                title=self.title,
+                text='Unable to export samples: \n{}\n'.format(e)
+            )
+            return
+
+        self.dialog.msgbox(
+            title=self.title,
+            text='Samples exported to {}'.format(path)
+        )
+
+
+class PerformanceOverlayGraphWidget(PerformanceCounterGraphWidget):
+    def __init__(self, agent, dialog, obj, realtime):
+        """
+        Widget to plot a graph of multiple performance counters
+
+        Allows any of the available counters of an entity
+        measured in the same unit, e.g. cpu.usage and cpu.ready,
+        to be plotted together in a single view.
+
+        Args:
+            agent         (VConnector): A VConnector instance
+            dialog     (dialog.Dialog): A Dialog instance
+            obj    (vim.ManagedEntity): A managed entity
+            realtime            (bool): If True plot real-time counters,
+                                        otherwise plot historical counters
+
+        """
+        super(PerformanceOverlayGraphWidget, self).__init__(
+            agent=agent,
+            dialog=dialog,
+            obj=obj,
+            counter=None,
+            realtime=realtime
+        )
+
+    def graph_title(self):
+        """
+        Get the title of the graph
+
+        """
+        return ', '.join(sorted(set(c.nameInfo.label for c in self.counters.values())))
+
+    def select_metrics(self):
+        """
+        Prompts the user to select the counters and instances to graph
+
+        Returns:
+            An ordered dict mapping the labels of the graph
+            series to vim.PerformanceManager.MetricId instances
+
+        """
         self.dialog.infobox(
             title=self.title,
             text='Retrieving information ...'
         )
 
-        interval_id = [i.samplingPeriod for i in self.pm.historicalInterval if i.name == interval].pop()
-        query_spec = pyVmomi.vim.PerformanceManager.QuerySpec(
+        if self.realtime:
+            provider_summary = self.pm.QueryPerfProviderSummary(
+                entity=self.obj
+            )
+            interval_id = provider_summary.refreshRate
+        else:
+            interval_id = None
+
+        metric_id = self.pm.QueryAvailablePerfMetric(
             entity=self.obj,
-            metricId=metric_id,
             intervalId=interval_id
         )
-        data = self.pm.QueryPerf(querySpec=[query_spec]).pop()
-        self.save_performance_samples(
-            path=datafile,
-            data=data
+
+        counters = {c.key: (name, c) for name, c in pvc.perf.counter_names(self.pm).items()}
+        metrics = sorted(
+            [m for m in metric_id if m.counterId in counters],
+            key=lambda m: (counters[m.counterId][0], m.instance)
         )
 
-        p = subprocess.Popen(
-            args=['gnuplot', script]
+        # Counters measured in different units do not share a
+        # meaningful y axis, so only counters of one unit are offered
+        units = collections.OrderedDict()
+        for m in metrics:
+            unit = counters[m.counterId][1].unitInfo.label
+            units[unit] = units.get(unit, 0) + 1
+
+        if len(units) > 1:
+            radiolist = pvc.widget.radiolist.RadioList(
+                items=[
+                    pvc.widget.radiolist.RadioListItem(
+                        tag=unit,
+                        description='{} counter instances'.format(count),
+                        status='on' if i == 0 else 'off'
+                    )
+                    for i, (unit, count) in enumerate(sorted(units.items()))
+                ],
+                dialog=self.dialog,
+                title=self.title,
+                text='Select the unit of the counters to graph'
+            )
+            code, unit = radiolist.display()
+            if code != self.dialog.OK:
+                return collections.OrderedDict()
+            metrics = [m for m in metrics if counters[m.counterId][1].unitInfo.label == unit]
+
+        available = collections.OrderedDict()
+        for m in metrics:
+            name = counters[m.counterId][0]
+            label = '{} {}'.format(name, m.instance) if m.instance else name
+            available[label] = m
+
+        items = [
+            pvc.widget.checklist.CheckListItem(tag=label)
+            for label in available
+        ]
+
+        checklist = pvc.widget.checklist.CheckList(
+            items=items,
+            dialog=self.dialog,
+            title=self.title,
+            text='Select the counters to graph'
+        )
+        checklist.display()
+
+        selected = collections.OrderedDict(
+            (label, available[label]) for label in checklist.selected()
         )
+        selected_ids = set(m.counterId for m in selected.values())
+        self.counters = {c.key: c for c in self.pm.perfCounter if c.key in selected_ids}
 
-        p.wait()
+        return selected
@@ -0,0 +1,353 @@
+# Copyright (c) 2015 Marin Atanasov Nikolov <dnaeon@gmail.com>
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions
+# are met:
+# 1. Redistributions of source code must retain the above copyright
+#    notice, this list of conditions and the following disclaimer
+#    in this position and unchanged.
+# 2. Redistributions in binary form must reproduce the above copyright
+#    notice, this list of conditions and the following disclaimer in the
+#    documentation and/or other materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE AUTHOR(S) ``AS IS'' AND ANY EXPRESS OR
+# IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED WARRANTIES
+# OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE DISCLAIMED.
+# IN NO EVENT SHALL THE AUTHOR(S) BE LIABLE FOR ANY DIRECT, INDIRECT,
+# INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT
+# NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE,
+# DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY
+# THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF
+# THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+"""
+Top Widgets
+
+"""
+
+import shutil
+import collections
+
+import pyVmomi
+
+import pvc.perf
+import pvc.widget.menu
+import pvc.widget.radiolist
+
+__all__ = ['TopWidget']
+
+
+class TopWidget(object):
+    # Performance counters used by the widget
+    COUNTERS = collections.OrderedDict([
+        ('disk', 'disk.maxTotalLatency.latest'),
+        ('net', 'net.usage.average'),
+    ])
+
+    # Columns by which the entities can be sorted
+    SORT_KEYS = collections.OrderedDict([
+        ('cpu', 'CPU usage (MHz)'),
+        ('mem', 'Memory usage (MB)'),
+        ('disk', 'Highest disk latency (ms)'),
+        ('net', 'Network throughput (KBps)'),
+    ])
+
+    def __init__(self, agent, dialog, obj):
+        """
+        Widget displaying a live ranking of the Virtual Machines
+        and hosts within a managed entity by resource usage
+
+        Args:
+            agent         (VConnector): A VConnector instance
+            dialog     (dialog.Dialog): A Dialog instance
+            obj    (vim.ManagedEntity): A HostSystem, ClusterComputeResource
+                                        or Datacenter managed entity
+
+        """
+        self.agent = agent
+        self.dialog = dialog
+        self.obj = obj
+        self.pm = self.agent.si.content.perfManager
+        self.title = '{} ({})'.format(self.obj.name, self.obj.__class__.__name__)
+        self.sort_by = 'cpu'
+        self.interval = 20
+        self.counter_id = {}
+        self.refresh_rates = {}
+        self.display()
+
+    def display(self):
+        self.dialog.infobox(
+            title=self.title,
+            text='Retrieving information ...'
+        )
+
+        self.counter_id = self.get_counter_id()
+
+        obj_type = [pyVmomi.vim.VirtualMachine]
+        if not isinstance(self.obj, pyVmomi.vim.HostSystem):
+            obj_type.append(pyVmomi.vim.HostSystem)
+
+        views = [
+            (t, self.agent.get_container_view(obj_type=[t], container=self.obj))
+            for t in obj_type
+        ]
+
+        try:
+            while True:
+                rows = self.collect(views)
+                columns, lines = shutil.get_terminal_size()
+                code = self.dialog.pause(
+                    title=self.title,
+                    text=self.render(rows, limit=lines - 14),
+                    height=lines - 2,
+                    width=columns - 4,
+                    seconds=self.interval,
+                    extra_button=True,
+                    extra_label='Options',
+                    cr_wrap=True,
+                    no_collapse=True
+                )
+
+                if code == self.dialog.EXTRA:
+                    self.options()
+                elif code in (self.dialog.CANCEL, self.dialog.ESC):
+                    break
+        finally:
+            for t, view in views:
+                view.DestroyView()
+
+    def get_counter_id(self):
+        """
+        Get the keys of the performance counters used by the widget
+
+        Returns:
+            A dict mapping the column names to performance counter keys
+
+        """
+        counters = pvc.perf.counter_names(self.pm)
+
+        return {
+            column: counters[name].key
+            for column, name in self.COUNTERS.items() if name in counters
+        }
+
+    def refresh_rate(self, entity):
+        """
+        Get the real-time refresh rate of the performance provider of an entity
+
+        The refresh rates are cached, as they do not change while
+        the widget is displayed.
+
+        Args:
+            entity (vim.ManagedEntity): A managed entity
+
+        Returns:
+            The refresh rate in seconds or None if the entity
+            has no real-time performance provider
+
+        """
+        if entity._moId not in self.refresh_rates:
+            summary = self.pm.QueryPerfProviderSummary(entity=entity)
+            self.refresh_rates[entity._moId] = summary.refreshRate if summary.currentSupported else None
+
+        return self.refresh_rates[entity._moId]
+
+    def collect(self, views):
+        """
+        Collect the resource usage of the entities
+
+        Quick stats are retrieved using the property collector and
+        the rest of the counters are retrieved using a single
+        QueryPerf() call for all entities which have a real-time
+        performance provider.
+
+        Args:
+            views (list): A list of (type, vim.view.ContainerView) tuples
+
+        Returns:
+            A list of dicts describing the resource usage of each entity
+
+        """
+        path_set = {
+            pyVmomi.vim.VirtualMachine: [
+                'name',
+                'runtime.powerState',
+                'summary.quickStats.overallCpuUsage',
+                'summary.quickStats.hostMemoryUsage',
+            ],
+            pyVmomi.vim.HostSystem: [
+                'name',
+                'runtime.connectionState',
+                'summary.quickStats.overallCpuUsage',
+                'summary.quickStats.overallMemoryUsage',
+            ],
+        }
+
+        rows = collections.OrderedDict()
+        for obj_type, view in views:
+            properties = self.agent.collect_properties(
+                view_ref=view,
+                obj_type=obj_type,
+                path_set=path_set[obj_type],
+                include_mors=True
+            )
+
+            for p in properties:
+                if obj_type == pyVmomi.vim.VirtualMachine:
+                    active = p.get('runtime.powerState') == pyVmomi.vim.VirtualMachinePowerState.poweredOn
+                    mem = p.get('summary.quickStats.hostMemoryUsage')
+                else:
+                    active = p.get('runtime.connectionState') == pyVmomi.vim.HostSystemConnectionState.connected
+                    mem = p.get('summary.quickStats.overallMemoryUsage')
+
+                rows[p['obj']._moId] = {
+                    'obj': p['obj'],
+                    'name': p['name'],
+                    'type': 'VM' if obj_type == pyVmomi.vim.VirtualMachine else 'Host',
+                    'active': active,
+                    'cpu': p.get('summary.quickStats.overallCpuUsage'),
+                    'mem': mem,
+                    'disk': None,
+                    'net': None,
+                }
+
+        metric_id = [
+            pyVmomi.vim.PerformanceManager.MetricId(counterId=key, instance='')
+            for key in self.counter_id.values()
+        ]
+        specs = []
+        for row in rows.values():
+            if not metric_id or not row['active']:
+                continue
+
+            refresh_rate = self.refresh_rate(row['obj'])
+            if refresh_rate is None:
+                continue
+
+            specs.append(
+                pyVmomi.vim.PerformanceManager.QuerySpec(
+                    maxSample=1,
+                    entity=row['obj'],
+                    metricId=metric_id,
+                    intervalId=refresh_rate
+                )
+            )
+
+        if metric_id and specs:
+            columns = {key: column for column, key in self.counter_id.items()}
+            for data in self.pm.QueryPerf(querySpec=specs):
+                row = rows.get(data.entity._moId)
+                for series in data.value:
+                    if row and series.value and series.value[-1] != -1:
+                        row[columns[series.id.counterId]] = series.value[-1]
+
+        return list(rows.values())
+
+    def render(self, rows, limit):
+        """
+        Render the entities with the highest resource usage as a table
+
+        Args:
+            rows  (list): A list of rows as returned by collect()
+            limit  (int): Maximum number of rows to render
+
+        Returns:
+            The rendered table as a string
+
+        """
+        rows = sorted(
+            rows,
+            key=lambda r: r[self.sort_by] if r[self.sort_by] is not None else -1,
+            reverse=True
+        )
+
+        line = '{:<32} {:<4} {:>9} {:>9} {:>8} {:>10}'
+        lines = [
+            'Sorted by {}, refreshed every {} seconds\n'.format(
+                self.SORT_KEYS[self.sort_by].lower(),
+                self.interval
+            ),
+            line.format('NAME', 'TYPE', 'CPU MHz', 'MEM MB', 'DISK ms', 'NET KBps'),
+        ]
+
+        for row in rows[:max(limit, 1)]:
+            values = ['-' if row[c] is None else str(row[c]) for c in ('cpu', 'mem', 'disk', 'net')]
+            lines.append(line.format(row['name'][:32], row['type'], *values))
+
+        return '\n'.join(lines)
+
+    def options(self):
+        """
+        Display a menu for changing the options of the widget
+
+        """
+        items = [
+            pvc.widget.menu.MenuItem(
+                tag='Sort',
+                description='Column used for ranking',
+                on_select=self.select_sort_key
+            ),
+            pvc.widget.menu.MenuItem(
+                tag='Interval',
+                description='Refresh interval',
+                on_select=self.select_interval
+            ),
+        ]
+
+        menu = pvc.widget.menu.Menu(
+            items=items,
+            dialog=self.dialog,
+            title=self.title,
+            text='Select an option to change'
+        )
+
+        menu.display()
+
+    def select_sort_key(self):
+        """
+        Prompts the user to select the column used for ranking
+
+        """
+        items = [
+            pvc.widget.radiolist.RadioListItem(
+                tag=key,
+                description=description,
+                status='on' if key == self.sort_by else 'off'
+            ) for key, description in self.SORT_KEYS.items()
+        ]
+
+        radiolist = pvc.widget.radiolist.RadioList(
+            items=items,
+            dialog=self.dialog,
+            title=self.title,
+            text='Select the column used for ranking'
+        )
+
+        code, tag = radiolist.display()
+        if code == self.dialog.OK and tag:
+            self.sort_by = tag
+
+    def select_interval(self):
+        """
+        Prompts the user to select the refresh interval
+
+        """
+        code, interval = self.dialog.inputbox(
+            title=self.title,
+            text='Refresh interval in seconds',
+            init=str(self.interval)
+        )
+
+        if code in (self.dialog.CANCEL, self.dialog.ESC):
+            return
+
+        if not interval.isdigit() or int(interval) < 1:
+            self.dialog.msgbox(
+                title=self.title,
+                text='Invalid input provided'
+            )
+            return
+
+        self.interval = int(interval)
@@ -31,11 +31,15 @@ import os
 import platform
 import time
 import tarfile
+import functools
+import collections
 
 import pyVmomi
 import humanize
 import requests
 
+import pvc.snapshot
+import pvc.placement
 import pvc.widget.alarm
 import pvc.widget.common
 import pvc.widget.device
@@ -44,6 +48,7 @@ import pvc.widget.event
 import pvc.widget.menu
 import pvc.widget.form
 import pvc.widget.gauge
+import pvc.widget.checklist
 import pvc.widget.vnc
 import pvc.widget.network
 import pvc.widget.performance
@@ -66,6 +71,7 @@ __all__ = [
     'VirtualMachineCloneWidget',
     'VirtualMachineSnapshotManagerWidget',
     'VirtualMachineSnapshotViewWidget',
+    'BulkSnapshotWidget',
 ]
 
 
@@ -815,7 +821,7 @@ class VirtualMachineConsoleWidget(object):
                 tag='VNC',
                 description='Launch VNC Console',
                 on_select=pvc.widget.vnc.VncWidget,
-                on_select_args=(self.dialog, self.obj)
+                on_select_args=(self.agent, self.dialog, self.obj)
             ),
             pvc.widget.menu.MenuItem(
                 tag='VMRC',
@@ -1048,38 +1054,39 @@ class VirtualMachineSnapshotViewWidget(object):
         self.display()
 
     def display(self):
-        if not self.obj.snapshot:
+        self.dialog.infobox(
+            title=self.title,
+            text='Retrieving information ...'
+        )
+
+        tree = pvc.snapshot.SnapshotTree.retrieve(self.agent, self.obj)
+        if not tree.roots:
             self.dialog.msgbox(
                 title=self.title,
                 text='No snapshots found for {}'.format(self.obj.name)
             )
             return
 
-        self.dialog.infobox(
-            title=self.title,
-            text='Retrieving information ...'
-        )
-
-        snapshots = []
-        for root in self.obj.snapshot.rootSnapshotList:
-            snapshots.append(root)
-            for child in root.childSnapshotList:
-                snapshots.append(child)
+        now = self.agent.si.CurrentTime()
 
         # Tree view item tuples are documented in Dialog.treeview method
         # http://sourceforge.net/p/pythondialog/code/ci/master/tree/dialog.py#l3548
         items = []
-        for s in snapshots:
-            if s.snapshot == self.obj.snapshot.currentSnapshot:
-                name = '{} (You are here)'.format(s.name)
-            else:
-                name = s.name
-            items.append((s.name, name, False, s.id-1))
+        for node in tree.walk():
+            name = '{} ({}, {} old)'.format(
+                node.name,
+                humanize.naturalsize(node.size, binary=True),
+                humanize.naturaldelta(now - node.tree.createTime)
+            )
+            if node is tree.current:
+                name = '{} (You are here)'.format(name)
+            items.append((str(node.id), name, node is tree.current, node.depth))
 
-        # Mark root snapshot as the selected item from the tree view
-        root = list(items[0])
-        root[2] = True # Mark snapshot item as the selected one
-        items[0] = tuple(root)
+        # Mark root snapshot as the selected item if there is no current snapshot
+        if tree.current is None:
+            root = list(items[0])
+            root[2] = True # Mark snapshot item as the selected one
+            items[0] = tuple(root)
 
         code, tag = self.dialog.treeview(
             title=self.title,
@@ -1090,21 +1097,17 @@ class VirtualMachineSnapshotViewWidget(object):
         if code in (self.dialog.CANCEL, self.dialog.ESC):
             return
 
-        selected = [s for s in snapshots if s.name == tag].pop()
-        self.details(selected)
+        self.details(tree.nodes[int(tag)])
 
-    def details(self, snapshot):
+    def details(self, node):
         """
         Display details about a snapshot
 
         Args:
-            snapshot: A vim.VirtualMachineSnapshotTree instance
+            node (pvc.snapshot.SnapshotNode): A node of the snapshot tree
 
         """
-        self.dialog.infobox(
-            title=self.title,
-            text='Retrieving information ...'
-        )
+        snapshot = node.tree
 
         elements = [
             pvc.widget.form.FormElement(
@@ -1135,6 +1138,18 @@ class VirtualMachineSnapshotViewWidget(object):
                 label='Replay Supported',
                 item=str(snapshot.replaySupported)
             ),
+            pvc.widget.form.FormElement(
+                label='Size',
+                item=humanize.naturalsize(node.size, binary=True)
+            ),
+            pvc.widget.form.FormElement(
+                label='Parent',
+                item=node.parent.name if node.parent else ''
+            ),
+            pvc.widget.form.FormElement(
+                label='Children',
+                item=str(len(node.children))
+            ),
         ]
 
         form = pvc.widget.form.Form(
@@ -1147,6 +1162,350 @@ class VirtualMachineSnapshotViewWidget(object):
         form.display()
 
 
+class BulkSnapshotWidget(object):
+    def __init__(self, agent, dialog):
+        """
+        Bulk Snapshot Widget
+
+        Creates or removes snapshots of many Virtual Machines
+        with a limited number of tasks per host and per datastore
+
+        Args:
+            agent      (VConnector): A VConnector instance
+            dialog  (dialog.Dialog): A Dialog instance
+
+        """
+        self.agent = agent
+        self.dialog = dialog
+        self.title = 'Snapshots'
+        self.display()
+
+    def display(self):
+        items = [
+            pvc.widget.menu.MenuItem(
+                tag='Create',
+                description='Create snapshots of Virtual Machines',
+                on_select=self.create
+            ),
+            pvc.widget.menu.MenuItem(
+                tag='Remove',
+                description='Remove snapshots of Virtual Machines',
+                on_select=self.remove
+            ),
+        ]
+
+        menu = pvc.widget.menu.Menu(
+            items=items,
+            dialog=self.dialog,
+            title=self.title,
+            text='Select an action to be performed'
+        )
+
+        menu.display()
+
+    def select_vms(self):
+        """
+        Prompts the user for the Virtual Machines to work on
+
+        Virtual Machines are first filtered by name and the
+        matching ones are then presented for selection
+
+        Returns:
+            A list of dicts with the properties of the selected Virtual Machines
+
+        """
+        form = pvc.widget.form.Form(
+            dialog=self.dialog,
+            form_elements=[pvc.widget.form.FormElement(label='Name contains')],
+            title=self.title,
+            text='Filter Virtual Machines by name, leave empty for all'
+        )
+
+        code, fields = form.display()
+        if code in (self.dialog.CANCEL, self.dialog.ESC):
+            return []
+
+        self.dialog.infobox(
+            title=self.title,
+            text='Retrieving information ...'
+        )
+
+        view = self.agent.get_vm_view()
+        properties = self.agent.collect_properties(
+            view_ref=view,
+            obj_type=pyVmomi.vim.VirtualMachine,
+            path_set=['name', 'runtime.host', 'datastore', 'snapshot', 'config.template'],
+            include_mors=True
+        )
+        view.DestroyView()
+
+        pattern = fields['Name contains'].strip().lower()
+        vms = sorted(
+            (vm for vm in properties if pattern in vm['name'].lower() and not vm.get('config.template')),
+            key=lambda vm: vm['name']
+        )
+
+        if not vms:
+            self.dialog.msgbox(
+                title=self.title,
+                text='No matching Virtual Machines found'
+            )
+            return []
+
+        # Tags of the checklist must be unique
+        names = collections.Counter(vm['name'] for vm in vms)
+        registry = collections.OrderedDict(
+            (vm['name'] if names[vm['name']] == 1 else '{} ({})'.format(vm['name'], vm['obj']._moId), vm)
+            for vm in vms
+        )
+        items = [
+            pvc.widget.checklist.CheckListItem(
+                tag=tag,
+                description='{} snapshots'.format(
+                    len(pvc.snapshot.SnapshotTree(vm.get('snapshot')))
+                ),
+                status='off'
+            ) for tag, vm in registry.items()
+        ]
+
+        checklist = pvc.widget.checklist.CheckList(
+            items=items,
+            dialog=self.dialog,
+            title=self.title,
+            text='Select Virtual Machines'
+        )
+
+        checklist.display()
+
+        return [registry[tag] for tag in checklist.selected()]
+
+    def get_limits(self, elements, text):
+        """
+        Prompts the user for the parameters of the operation
+
+        Args:
+            elements (list): Additional FormElement instances to display
+            text      (str): Text of the form
+
+        Returns:
+            A dict of the form fields, with the concurrency limits
+            converted to integers, or None if cancelled
+
+        """
+        elements = elements + [
+            pvc.widget.form.FormElement(
+                label='Max per host',
+                item='2'
+            ),
+            pvc.widget.form.FormElement(
+                label='Max per datastore',
+                item='4'
+            ),
+        ]
+
+        form = pvc.widget.form.Form(
+            dialog=self.dialog,
+            form_elements=elements,
+            title=self.title,
+            text=text
+        )
+
+        code, fields = form.display()
+        if code in (self.dialog.CANCEL, self.dialog.ESC):
+            return None
+
+        try:
+            fields['Max per host'] = int(fields['Max per host'])
+            fields['Max per datastore'] = int(fields['Max per datastore'])
+        except ValueError:
+            self.dialog.msgbox(
+                title=self.title,
+                text='Invalid limits provided'
+            )
+            return None
+
+        return fields
+
+    def job(self, vm, calls):
+        """
+        Create a snapshot job for a Virtual Machine
+
+        Args:
+            vm     (dict): The properties of the Virtual Machine
+            calls  (list): Functions starting the tasks of the job
+
+        Returns:
+            A pvc.snapshot.SnapshotJob instance
+
+        """
+        host = vm.get('runtime.host')
+
+        return pvc.snapshot.SnapshotJob(
+            name=vm['name'],
+            host=host._moId if host else '',
+            datastores=[ds._moId for ds in vm.get('datastore', [])],
+            calls=calls
+        )
+
+    def run(self, jobs, fields, action):
+        """
+        Run snapshot jobs and display the progress
+
+        Args:
+            jobs   (list): A list of pvc.snapshot.SnapshotJob instances
+            fields (dict): The fields returned by get_limits()
+            action  (str): Description of the operation
+
+        """
+        code = self.dialog.yesno(
+            title=self.title,
+            text='{} of {} Virtual Machines?'.format(action, len(jobs))
+        )
+
+        if code in (self.dialog.ESC, self.dialog.CANCEL):
+            return
+
+        runner = pvc.snapshot.BulkSnapshotRunner(
+            agent=self.agent,
+            max_per_host=fields['Max per host'],
+            max_per_datastore=fields['Max per datastore']
+        )
+
+        self.dialog.gauge_start(
+            title=self.title,
+            text='{} ...'.format(action)
+        )
+
+        try:
+            failed = runner.run(
+                jobs=jobs,
+                progress=lambda done, total, running: self.dialog.gauge_update(
+                    int(done * 100 / total),
+                    text='{} ...\n\n{} of {} done, {} in progress'.format(action, done, total, running),
+                    update_text=True
+                )
+            )
+        except pyVmomi.vmodl.MethodFault as e:
+            self.dialog.gauge_stop()
+            self.dialog.msgbox(
+                title=self.title,
+                text='{} failed: {}'.format(action, e.msg)
+            )
+            return
+
+        self.dialog.gauge_stop()
+
+        text = '{} of {} Virtual Machines done'.format(len(jobs) - len(failed), len(jobs))
+        if failed:
+            text += ', {} failed:\n\n{}'.format(
+                len(failed),
+                '\n'.join('{}: {}'.format(job.name, msg) for job, msg in failed)
+            )
+
+        self.dialog.scrollbox(
+            title=self.title,
+            text=text
+        )
+
+    def create(self):
+        """
+        Create snapshots of many Virtual Machines
+
+        """
+        vms = self.select_vms()
+        if not vms:
+            return
+
+        fields = self.get_limits(
+            elements=[
+                pvc.widget.form.FormElement(
+                    label='Name',
+                    item='pvc-{}'.format(time.strftime('%Y%m%d-%H%M'))
+                ),
+                pvc.widget.form.FormElement(
+                    label='Description',
+                    item=''
+                ),
+            ],
+            text='Snapshot details'
+        )
+
+        if not fields:
+            return
+
+        if not fields['Name']:
+            self.dialog.msgbox(
+                title=self.title,
+                text='Invalid snapshot name'
+            )
+            return
+
+        jobs = [
+            self.job(vm, [
+                functools.partial(
+                    vm['obj'].CreateSnapshot_Task,
+                    name=fields['Name'],
+                    description=fields['Description'],
+                    memory=False,
+                    quiesce=False
+                )
+            ]) for vm in vms
+        ]
+
+        self.run(jobs, fields, 'Creating snapshots')
+
+    def remove(self):
+        """
+        Remove snapshots with a given name from many Virtual Machines
+
+        """
+        vms = self.select_vms()
+        if not vms:
+            return
+
+        fields = self.get_limits(
+            elements=[
+                pvc.widget.form.FormElement(
+                    label='Name',
+                    item=''
+                ),
+            ],
+            text='Name of the snapshots to remove'
+        )
+
+        if not fields:
+            return
+
+        jobs = []
+        for vm in vms:
+            tree = pvc.snapshot.SnapshotTree(vm.get('snapshot'))
+
+            # Remove the deepest snapshots first, so that the
+            # removal of a snapshot never consolidates into
+            # another one which is about to be removed
+            nodes = sorted(
+                (n for n in tree.walk() if n.name == fields['Name']),
+                key=lambda n: n.depth,
+                reverse=True
+            )
+            if not nodes:
+                continue
+
+            jobs.append(self.job(vm, [
+                functools.partial(n.tree.snapshot.RemoveSnapshot_Task, removeChildren=False)
+                for n in nodes
+            ]))
+
+        if not jobs:
+            self.dialog.msgbox(
+                title=self.title,
+                text='No snapshots named {} found'.format(fields['Name'])
+            )
+            return
+
+        self.run(jobs, fields, 'Removing snapshots')
+
+
 class VirtualMachineActionWidget(object):
     def __init__(self, agent, dialog, obj):
         """
@@ -1683,21 +2042,23 @@ class VirtualMachineChangeHostWidgetWidget(object):
             return
 
         old_host = self.obj.runtime.host
-        new_host = pvc.widget.common.choose_host(
-            agent=self.agent,
-            dialog=self.dialog,
-            folder=cluster
-        )
+        placement = self.choose_placement(cluster)
 
-        if not new_host:
-            self.dialog.msgbox(
+        if not placement:
+            return
+
+        if placement.warnings:
+            self.show_check_messages(placement.warnings, [])
+
+            code = self.dialog.yesno(
                 title=self.title,
-                text='No valid host selected'
+                text='Migrate Virtual Machine to {}?'.format(placement.name)
             )
-            return
 
-        if not self.migration_would_succeed(host=new_host, pool=cluster.resourcePool):
-            return
+            if code in (self.dialog.ESC, self.dialog.CANCEL):
+                return
+
+        new_host = placement.host
 
         task = self.obj.MigrateVM_Task(
             host=new_host,
@@ -1716,50 +2077,79 @@ class VirtualMachineChangeHostWidgetWidget(object):
 
         gauge.display()
 
-    def migration_would_succeed(self, host, pool):
+    def choose_placement(self, cluster):
         """
-        Runs compatibility tests in order to determine whether a
-        migration task would succeed or not.
+        Prompts the user for the target host, ranked by
+        the placement advisor
 
         Args:
-            host   (vim.HostSystem): A target HostSystem entity to migrate the VM on
-            pool (vim.ResourcePool): A target ResourcePool entity for the VM
+            cluster (vim.ClusterComputeResource): The target cluster
 
         Returns:
-            True if there are no errors reported by the compatibily tests,
-            False otherwise.
+            A pvc.placement.Placement instance or None if no
+            valid host has been selected
 
         """
-        task = self.agent.si.content.vmProvisioningChecker.CheckMigrate_Task(
-            vm=self.obj,
-            host=host,
-            pool=pool
+        self.dialog.infobox(
+            title=self.title,
+            text='Running compatibility tests against all hosts in {} ...'.format(cluster.name)
         )
 
-        gauge = pvc.widget.gauge.TaskGauge(
-            dialog=self.dialog,
-            task=task,
+        advisor = pvc.placement.PlacementAdvisor(
+            agent=self.agent,
+            vm=self.obj,
+            cluster=cluster
+        )
+        placements = advisor.rank()
+        valid = [p for p in placements if p.valid]
+
+        if not valid:
+            text = 'No valid target hosts found in {}'.format(cluster.name)
+            if placements:
+                text += ':\n\n{}'.format(
+                    '\n\n'.join(
+                        '{}\n{}'.format(p.name, '\n'.join('    {}'.format(e) for e in p.errors))
+                        for p in placements
+                    )
+                )
+            self.dialog.scrollbox(
+                title=self.title,
+                text=text
+            )
+            return None
+
+        by_name = {p.name: p for p in valid}
+        choices = [
+            (p.name, 'CPU free {:.0%}, memory free {:.0%}{}'.format(
+                p.cpu_free,
+                p.memory_free,
+                ', {} warnings'.format(len(p.warnings)) if p.warnings else ''
+            )) for p in valid
+        ]
+
+        code, tag = self.dialog.menu(
             title=self.title,
-            text='Running compatibility tests ...'
+            text='Target hosts ranked by headroom after migration, {} of {} hosts are not valid targets'.format(
+                len(placements) - len(valid),
+                len(placements)
+            ),
+            choices=choices
         )
 
-        gauge.display()
+        if code in (self.dialog.CANCEL, self.dialog.ESC):
+            return None
 
-        warnings = [r for r in task.info.result if r.warning]
-        errors = [r for r in task.info.result if r.error]
+        return by_name[tag]
 
-        warning_messages = []
-        for r in warnings:
-            for w in r.warning:
-                warning_messages.append(w.msg)
-                warning_messages.extend(['    {}'.format(f.message) for f in w.faultMessage])
+    def show_check_messages(self, warning_messages, error_messages):
+        """
+        Display the warnings and errors of compatibility tests
 
-        error_messages = []
-        for r in errors:
-            for e in r.error:
-                error_messages.append(e.msg)
-                error_messages.extend(['    {}'.format(f.message) for f in e.faultMessage])
+        Args:
+            warning_messages (list): Warning messages to display
+            error_messages   (list): Error messages to display
 
+        """
         if warning_messages:
             warn_msg = (
                 'The following warnings were reported by the '
@@ -1789,9 +2179,6 @@ class VirtualMachineChangeHostWidgetWidget(object):
                 title='Migration Task Error',
                 text=error_msg.format('\n'.join(error_messages))
             )
-            return False  # Migration would not succeed
-
-        return True
 
 
 class VirtualMachineChangeDatastoreWidget(object):
@@ -28,12 +28,15 @@ VNC module
 """
 
 import os
+import errno
 import random
 import socket
 import string
 import time
 import tempfile
 
+from concurrent.futures import ThreadPoolExecutor
+
 import pyVmomi
 import pvc.widget.form
 import pvc.widget.menu
@@ -45,20 +48,125 @@ __all__ = ['VncWidget']
 
 
 class VncWidget(object):
-    def __init__(self, dialog, obj):
+    # Ports which may be used for VNC consoles
+    VNC_PORTS = range(5901, 6000)
+
+    # Number of ports probed concurrently
+    PROBE_WORKERS = 16
+
+    # Extra configuration options of the VNC console
+    VNC_OPTIONS = (
+        'RemoteDisplay.vnc.enabled',
+        'RemoteDisplay.vnc.port',
+        'RemoteDisplay.vnc.password',
+    )
+
+    def __init__(self, agent, dialog, obj):
         """
         VNC widget
 
         Args:
+            agent          (VConnector): A VConnector instance
             dialog      (dialog.Dialog): A Dialog instance
             obj    (vim.VirtualMachine): A vim.VirtualMachine managed entity
 
         """
+        self.agent = agent
         self.dialog = dialog
         self.obj = obj
         self.title = '{} ({})'.format(self.obj.name, self.obj.__class__.__name__)
+        self._vm_properties = None
+        self._host_properties = None
         self.display()
 
+    def _retrieve_properties(self, obj, path_set):
+        """
+        Retrieve only the given properties of a managed object
+
+        Args:
+            obj      (vim.ManagedEntity): A managed entity
+            path_set              (list): List of property paths to retrieve
+
+        Returns:
+            A dict mapping the property paths to their values.
+            Properties which are not set are not present in the dict.
+
+        """
+        spec = pyVmomi.vmodl.query.PropertyCollector.FilterSpec(
+            objectSet=[pyVmomi.vmodl.query.PropertyCollector.ObjectSpec(obj=obj)],
+            propSet=[
+                pyVmomi.vmodl.query.PropertyCollector.PropertySpec(
+                    type=obj.__class__,
+                    pathSet=path_set
+                )
+            ]
+        )
+
+        result = self.agent.si.content.propertyCollector.RetrieveContents([spec])
+
+        return {prop.name: prop.val for content in result for prop in content.propSet}
+
+    def _get_vm_properties(self, refresh=False):
+        """
+        Get the properties of the Virtual Machine used by the widget
+
+        Only the VNC options of the extra configuration are retrieved
+        along with the runtime host and power state, and are kept
+        for the lifetime of the widget unless refreshed.
+
+        Args:
+            refresh (bool): If True retrieve the properties again
+
+        Returns:
+            A dict of the retrieved properties
+
+        """
+        if self._vm_properties is None or refresh:
+            path_set = ['runtime.host', 'runtime.powerState']
+            path_set.extend('config.extraConfig["{}"]'.format(o) for o in self.VNC_OPTIONS)
+            self._vm_properties = self._retrieve_properties(self.obj, path_set)
+
+        return self._vm_properties
+
+    def _get_host_properties(self):
+        """
+        Get the name and management IP address of the host
+        on which the Virtual Machine is registered
+
+        Only the host name and virtual NICs are retrieved instead
+        of the whole host configuration, and are kept for the
+        lifetime of the widget.
+
+        Returns:
+            A tuple of the host name and IP address. The IP
+            address is None if the host has no virtual NICs.
+
+        """
+        if self._host_properties is None:
+            host = self._get_vm_properties()['runtime.host']
+            properties = self._retrieve_properties(
+                host,
+                ['name', 'config.virtualNicManagerInfo.netConfig', 'config.network.vnic']
+            )
+
+            # Prefer the virtual NIC selected for management traffic
+            ip_address = None
+            for nc in properties.get('config.virtualNicManagerInfo.netConfig', []):
+                if nc.nicType != 'management':
+                    continue
+                for vnic in nc.candidateVnic:
+                    if vnic.key in (nc.selectedVnic or []):
+                        ip_address = vnic.spec.ip.ipAddress
+                        break
+
+            vnics = properties.get('config.network.vnic') or []
+            if not ip_address and vnics:
+                ip_address = vnics[0].spec.ip.ipAddress
+
+            self._host_properties = (properties['name'], ip_address)
+
+        return self._host_properties
+
     def _port_is_open(self, host, port, timeout=3.0):
         """
         Probes a port to check if it is open or not
@@ -74,19 +182,100 @@ class VncWidget(object):
 
         return not err_code
 
-    def _get_available_port(self, attempts):
+    def _port_is_free(self, host, port, timeout=3.0):
+        """
+        Probes a port to check if it is known to be free
+
+        Only a refused connection proves that nothing listens on
+        the port. A timeout or any other error leaves the state of
+        the port unknown, e.g. because of a firewall, and the port
+        is not considered free.
+
+        Returns:
+            True if the connection to the port was refused, False otherwise
+
+        """
+        sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        sock.settimeout(timeout)
+        try:
+            err_code = sock.connect_ex((host, port))
+        except OSError:
+            return False
+        finally:
+            sock.close()
+
+        return err_code == errno.ECONNREFUSED
+
+    def _get_configured_ports(self, host):
+        """
+        Get the VNC ports configured for the Virtual Machines on a host
+
+        The ports of all Virtual Machines registered on the host,
+        including the powered off ones, are retrieved using a single
+        property collector call, which returns only the port option
+        of the extra configuration of each Virtual Machine.
+
+        Args:
+            host (vim.HostSystem): A HostSystem managed entity
+
+        Returns:
+            A set of the configured ports
+
+        """
+        spec = pyVmomi.vmodl.query.PropertyCollector.FilterSpec(
+            objectSet=[
+                pyVmomi.vmodl.query.PropertyCollector.ObjectSpec(
+                    obj=host,
+                    skip=True,
+                    selectSet=[
+                        pyVmomi.vmodl.query.PropertyCollector.TraversalSpec(
+                            name='traverseVm',
+                            type=pyVmomi.vim.HostSystem,
+                            path='vm',
+                            skip=False
+                        )
+                    ]
+                )
+            ],
+            propSet=[
+                pyVmomi.vmodl.query.PropertyCollector.PropertySpec(
+                    type=pyVmomi.vim.VirtualMachine,
+                    pathSet=['config.extraConfig["RemoteDisplay.vnc.port"]']
+                )
+            ]
+        )
+
+        result = self.agent.si.content.propertyCollector.RetrieveContents([spec])
+
+        ports = set()
+        for content in result:
+            for prop in content.propSet:
+                try:
+                    ports.add(int(prop.val.value))
+                except (AttributeError, TypeError, ValueError):
+                    continue
+
+        return ports
+
+    def _get_available_port(self, timeout=0.5):
         """
         Look for available port to use for the VNC console
 
         We search for available port on the HostSystem where
         our Virtual Machine is running in the port range 5901-5999.
 
+        Ports configured for other Virtual Machines on the host are
+        skipped, and the remaining ports are probed concurrently in
+        random order. A port is used only if the host refuses the
+        connection to it, ports which time out are skipped.
+
         Args:
-            attempts (int): Perform that many iterations when searching for a port
+            timeout (float): Timeout in seconds when probing a port
 
         Returns:
             A random port in the range 5901-5999 if an available
-            port was found, None otherwise
+            port was found, None otherwise or if the IP address
+            of the host is not known
 
         """
         self.dialog.infobox(
@@ -94,13 +283,22 @@ class VncWidget(object):
             text='Searching for available port ...'
         )
 
-        host = self.obj.runtime.host
-        host_ip = host.config.network.vnic[0].spec.ip.ipAddress
+        host = self._get_vm_properties()['runtime.host']
+        host_name, host_ip = self._get_host_properties()
+        if not host_ip:
+            return None
+
+        configured = self._get_configured_ports(host)
+        candidates = [p for p in self.VNC_PORTS if p not in configured]
+        random.shuffle(candidates)
 
-        for i in range(attempts):
-            random_port = 5900 + random.randrange(1, 99)
-            if not self._port_is_open(host=host_ip, port=random_port):
-                return random_port
+        with ThreadPoolExecutor(max_workers=self.PROBE_WORKERS) as executor:
+            for i in range(0, len(candidates), self.PROBE_WORKERS):
+                batch = candidates[i:i + self.PROBE_WORKERS]
+                result = executor.map(lambda p: self._port_is_free(host=host_ip, port=p, timeout=timeout), batch)
+                for port, is_free in zip(batch, result):
+                    if is_free:
+                        return port
 
         return None
 
@@ -120,11 +318,16 @@ class VncWidget(object):
         """
         Get Virtual Machine extra configuration options
 
+        Only the VNC options are retrieved
+
         Returns:
             A dictionary of the extra config options
 
         """
-        return {o.key: o.value for o in self.obj.config.extraConfig}
+        properties = self._get_vm_properties()
+        options = [properties.get('config.extraConfig["{}"]'.format(o)) for o in self.VNC_OPTIONS]
+
+        return {o.key: o.value for o in options if o is not None}
 
     def _configure_vnc_options(self, enabled, port, password):
         """
@@ -151,6 +354,7 @@ class VncWidget(object):
             task=task
         )
         gauge.display()
+        self._vm_properties = None
 
     def display(self):
         """
@@ -211,7 +415,16 @@ class VncWidget(object):
             )
             return
 
-        port = port if port else self._get_available_port(attempts=10)
+        if not port:
+            host_name, host_ip = self._get_host_properties()
+            if not host_ip:
+                self.dialog.msgbox(
+                    title=self.title,
+                    text='Cannot find the IP address of host {}'.format(host_name)
+                )
+                return
+            port = self._get_available_port()
+
         if not port:
             self.dialog.msgbox(
                 title=self.title,
@@ -245,6 +458,7 @@ class VncWidget(object):
         )
 
         gauge.display()
+        self._vm_properties = None
 
     def settings(self):
         """
@@ -299,7 +513,8 @@ class VncWidget(object):
         Launch a VNC Console
 
         """
-        if self.obj.runtime.powerState != pyVmomi.vim.VirtualMachinePowerState.poweredOn:
+        properties = self._get_vm_properties(refresh=True)
+        if properties['runtime.powerState'] != pyVmomi.vim.VirtualMachinePowerState.poweredOn:
             self.dialog.msgbox(
                 title=self.title,
                 text='You need to power on the Virtual Machine first'
@@ -318,8 +533,13 @@ class VncWidget(object):
             )
             return
 
-        host = self.obj.runtime.host
-        host_ip = host.config.network.vnic[0].spec.ip.ipAddress
+        host_name, host_ip = self._get_host_properties()
+        if not host_ip:
+            self.dialog.msgbox(
+                title=self.title,
+                text='Cannot find the IP address of host {}'.format(host_name)
+            )
+            return
 
         self.dialog.infobox(
             title=self.title,
@@ -333,7 +553,7 @@ class VncWidget(object):
             )
             self.dialog.msgbox(
                 title=self.title,
-                text=text.format(host.name, host_ip, port)
+                text=text.format(host_name, host_ip, port)
             )
             return
 
@@ -0,0 +1,48 @@
+import datetime
+
+import pytest
+
+pyVmomi = pytest.importorskip('pyVmomi')
+
+import pvc.perf  # noqa: E402
+
+
+def make_metric_id(count):
+    return [
+        pyVmomi.vim.PerformanceManager.MetricId(counterId=i, instance='')
+        for i in range(count)
+    ]
+
+
+def make_entities(count):
+    return [pyVmomi.vim.VirtualMachine('vm-{}'.format(i)) for i in range(count)]
+
+
+@pytest.mark.parametrize('num_entities, num_metrics', [
+    (16, 6),
+    (1, 200),
+    (100, 1),
+    (7, 64),
+    (3, 65),
+])
+def test_plan_batches_never_exceed_max_metrics(num_entities, num_metrics):
+    planner = pvc.perf.QueryPlanner(interval_id=300, max_samples=10, max_metrics=64, max_specs=16)
+    entities = make_entities(num_entities)
+    metric_id = make_metric_id(num_metrics)
+    end_time = datetime.datetime(2020, 1, 1)
+    start_time = end_time - datetime.timedelta(hours=2)
+
+    batches = planner.plan(entities, metric_id, start_time, end_time)
+
+    for batch in batches:
+        assert batch
+        assert len(batch) <= planner.max_specs
+        assert sum(len(spec.metricId) for spec in batch) <= planner.max_metrics
+
+    # Every metric of every entity is queried once in each window
+    windows = planner.windows(start_time, end_time)
+    queried = [
+        (spec.entity._moId, m.counterId, spec.startTime)
+        for batch in batches for spec in batch for m in spec.metricId
+    ]
+    assert len(queried) == len(set(queried)) == num_entities * num_metrics * len(windows)